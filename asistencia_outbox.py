@@ -0,0 +1,289 @@
+"""
+Bandeja de salida (outbox) durable para el registro de asistencias en Laravel.
+
+El camino de la petición solo inserta el evento en una base SQLite local
+(microsegundos). Un hilo de envío agrupa los eventos pendientes por
+matrícula en una sola llamada a registro-masivo, reintenta con backoff
+exponencial cuando Laravel falla y vacía la cola al apagar el servicio.
+
+Los eventos que Laravel rechaza (4xx) o que agotan `max_intentos` pasan a
+la tabla asistencias_descartadas en lugar de reintentarse para siempre.
+Los eventos nuevos nunca se agrupan con un lote que ya falló: se envían
+por separado y no heredan su backoff.
+
+Varios procesos (p.ej. los workers de gunicorn) pueden encolar en la misma
+base; solo el proceso que llama a iniciar() envía.
+"""
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import logging
+
+from laravel_utils import reportar_asistencias
+
+
+class AsistenciaOutbox:
+    """
+    Cola persistente de asistencias con envío agrupado por matrícula.
+
+    - intervalo: segundos que se esperan para agrupar eventos antes de enviar
+    - backoff_base / backoff_max: espera entre reintentos (exponencial con jitter)
+    - max_intentos: intentos fallidos tras los que un evento se descarta
+    - enviar: función (matricula_id, rostros, captura, laravel_api_url) que
+      retorna True (enviado), False (error transitorio) o None (rechazado)
+    """
+
+    def __init__(self, db_path, laravel_api_url, intervalo=1.0, backoff_base=2.0, backoff_max=300.0,
+                 max_intentos=100, enviar=reportar_asistencias):
+        self.db_path = db_path
+        self.laravel_api_url = laravel_api_url
+        self.intervalo = intervalo
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_intentos = max_intentos
+        self.enviar = enviar
+
+        self._lock = threading.Lock()
+        self._hay_eventos = threading.Event()
+        self._activo = False
+        self._thread = None
+
+        self._conn = None
+        self._pid = None
+        self._conexion().execute(
+            """
+            CREATE TABLE IF NOT EXISTS asistencias_pendientes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                matricula_id TEXT NOT NULL,
+                rostros TEXT NOT NULL,
+                captura TEXT NOT NULL,
+                creado REAL NOT NULL,
+                intentos INTEGER NOT NULL DEFAULT 0,
+                proximo_intento REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conexion().execute(
+            """
+            CREATE TABLE IF NOT EXISTS asistencias_descartadas (
+                id INTEGER PRIMARY KEY,
+                matricula_id TEXT NOT NULL,
+                rostros TEXT NOT NULL,
+                captura TEXT NOT NULL,
+                creado REAL NOT NULL,
+                intentos INTEGER NOT NULL,
+                motivo TEXT NOT NULL,
+                descartado REAL NOT NULL
+            )
+            """
+        )
+
+        # Estadísticas
+        self.encolados = 0
+        self.enviados = 0
+        self.envios_fallidos = 0
+        self.descartados = 0
+        self.latencia_ultima_ms = None
+        self.latencia_media_ms = None
+        self.ultimo_envio = None
+
+    def _conexion(self):
+        """Conexión SQLite del proceso actual (se reabre después de un fork)."""
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+        return self._conn
+
+    # === Camino de la petición ===
+
+    def encolar(self, matricula_id, rostros, captura):
+        """Guarda un evento de asistencia para envío posterior."""
+        with self._lock:
+            self._conexion().execute(
+                "INSERT INTO asistencias_pendientes (matricula_id, rostros, captura, creado) VALUES (?, ?, ?, ?)",
+                (str(matricula_id), json.dumps(rostros), captura, time.time()),
+            )
+            self.encolados += 1
+        self._hay_eventos.set()
+        return True
+
+    # === Ciclo de vida ===
+
+    def iniciar(self):
+        """Inicia el hilo de envío."""
+        if self._activo:
+            return
+        self._activo = True
+        self._thread = threading.Thread(target=self._trabajar, daemon=True)
+        self._thread.start()
+        logging.info(f"📮 DEPURACIÓN: Outbox de asistencias iniciado ({self.db_path}, {self.profundidad()} pendiente(s))")
+
+    def detener(self, flush=True):
+        """Detiene el hilo de envío; con flush intenta enviar todo lo pendiente."""
+        self._activo = False
+        self._hay_eventos.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+            if self._thread.is_alive():
+                # Sigue enviando un lote: vaciar ahora lo enviaría dos veces
+                logging.warning(
+                    f"⚠️ DEPURACIÓN: El envío del outbox sigue en curso; "
+                    f"{self.profundidad()} asistencia(s) quedan para el próximo inicio"
+                )
+                return
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Envía inmediatamente todos los eventos pendientes (ignora el backoff)."""
+        return self._enviar_pendientes(ignorar_backoff=True)
+
+    # === Envío ===
+
+    def _trabajar(self):
+        while self._activo:
+            self._hay_eventos.wait(timeout=self.intervalo)
+            if not self._activo:
+                break
+            self._hay_eventos.clear()
+            # Pequeña espera para agrupar los eventos que llegan juntos
+            time.sleep(self.intervalo)
+            try:
+                self._enviar_pendientes()
+            except Exception as e:
+                logging.error(f"❌ DEPURACIÓN: Error en outbox de asistencias: {str(e)}")
+
+    def _enviar_pendientes(self, ignorar_backoff=False):
+        """Envía los eventos pendientes agrupados por matrícula; retorna lotes enviados."""
+        ahora = time.time()
+        with self._lock:
+            filas = self._conexion().execute(
+                "SELECT id, matricula_id, rostros, captura, intentos FROM asistencias_pendientes "
+                "WHERE proximo_intento <= ? ORDER BY id",
+                (float("inf") if ignorar_backoff else ahora,),
+            ).fetchall()
+
+        # Un lote que ya falló no absorbe eventos nuevos: se agrupa también por intentos
+        lotes = {}
+        for fila in filas:
+            lotes.setdefault((fila[1], fila[4]), []).append(fila)
+
+        enviados = 0
+        for (matricula_id, _), eventos in lotes.items():
+            resultado = self._enviar_lote(matricula_id, eventos)
+            if resultado is None and len(eventos) > 1:
+                # Laravel rechazó el lote: se envía evento por evento para descartar solo los inválidos
+                for evento in eventos:
+                    enviados += self._resolver(matricula_id, [evento], self._enviar_lote(matricula_id, [evento]))
+            else:
+                enviados += self._resolver(matricula_id, eventos, resultado)
+        return enviados
+
+    def _enviar_lote(self, matricula_id, eventos):
+        rostros, captura = self._agrupar(eventos)
+        inicio = time.perf_counter()
+        resultado = self.enviar(matricula_id, rostros, captura, self.laravel_api_url)
+        self._registrar_latencia((time.perf_counter() - inicio) * 1000)
+        return resultado
+
+    def _resolver(self, matricula_id, eventos, resultado):
+        """Borra, reprograma o descarta los eventos según el resultado del envío; retorna lotes enviados."""
+        ids = [evento[0] for evento in eventos]
+        marcadores = ",".join("?" * len(ids))
+        intentos = max(evento[4] for evento in eventos) + 1
+        with self._lock:
+            conexion = self._conexion()
+            if resultado:
+                conexion.execute(f"DELETE FROM asistencias_pendientes WHERE id IN ({marcadores})", ids)
+                self.enviados += len(ids)
+                self.ultimo_envio = time.time()
+                return 1
+
+            self.envios_fallidos += 1
+            if resultado is None or intentos >= self.max_intentos:
+                motivo = "rechazado" if resultado is None else "intentos_agotados"
+                with conexion:  # Con autocommit el BEGIN explícito agrupa ambas sentencias
+                    conexion.execute("BEGIN")
+                    conexion.execute(
+                        "INSERT OR REPLACE INTO asistencias_descartadas "
+                        "(id, matricula_id, rostros, captura, creado, intentos, motivo, descartado) "
+                        f"SELECT id, matricula_id, rostros, captura, creado, ?, ?, ? FROM asistencias_pendientes "
+                        f"WHERE id IN ({marcadores})",
+                        [intentos, motivo, time.time(), *ids],
+                    )
+                    conexion.execute(f"DELETE FROM asistencias_pendientes WHERE id IN ({marcadores})", ids)
+                self.descartados += len(ids)
+                logging.error(
+                    f"❌ DEPURACIÓN: {len(ids)} asistencia(s) de matrícula {matricula_id} descartada(s) "
+                    f"({motivo}, {intentos} intento(s)); quedan en asistencias_descartadas"
+                )
+                return 0
+
+            espera = min(self.backoff_max, self.backoff_base * 2 ** (intentos - 1))
+            espera *= random.uniform(0.5, 1.0)
+            conexion.execute(
+                f"UPDATE asistencias_pendientes SET intentos = ?, proximo_intento = ? WHERE id IN ({marcadores})",
+                [intentos, time.time() + espera, *ids],
+            )
+        logging.warning(
+            f"⚠️ DEPURACIÓN: Envío de {len(ids)} asistencia(s) de matrícula {matricula_id} falló "
+            f"(intento {intentos}); reintento en {espera:.1f}s"
+        )
+        return 0
+
+    @staticmethod
+    def _agrupar(eventos):
+        """
+        Combina varios eventos de una matrícula en un solo registro masivo.
+
+        El cuerpo conserva la forma del envío directo: cada rostro aparece una
+        vez con sus campos originales ({"id", "dist"}) y su menor distancia, y
+        la captura del lote es la del evento más antiguo (cuándo se vio al
+        primero, no cuándo se envía).
+        """
+        rostros = {}
+        for _, _, rostros_json, _, _ in eventos:
+            for rostro in json.loads(rostros_json):
+                actual = rostros.get(rostro["id"])
+                if actual is None:
+                    rostros[rostro["id"]] = dict(rostro)
+                elif rostro.get("dist") is not None and (actual.get("dist") is None or rostro["dist"] < actual["dist"]):
+                    actual["dist"] = rostro["dist"]
+        return list(rostros.values()), min(evento[3] for evento in eventos)
+
+    def _registrar_latencia(self, ms):
+        self.latencia_ultima_ms = round(ms, 1)
+        self.latencia_media_ms = round(
+            ms if self.latencia_media_ms is None else 0.9 * self.latencia_media_ms + 0.1 * ms, 1
+        )
+
+    # === Estado ===
+
+    def profundidad(self):
+        """Cantidad de eventos pendientes de envío."""
+        with self._lock:
+            return self._conexion().execute("SELECT COUNT(*) FROM asistencias_pendientes").fetchone()[0]
+
+    def stats(self):
+        """Estadísticas de la cola."""
+        with self._lock:
+            pendientes, mas_antiguo = self._conexion().execute(
+                "SELECT COUNT(*), MIN(creado) FROM asistencias_pendientes"
+            ).fetchone()
+            descartadas = self._conexion().execute("SELECT COUNT(*) FROM asistencias_descartadas").fetchone()[0]
+        return {
+            "pendientes": pendientes,
+            "antiguedad_max_s": round(time.time() - mas_antiguo, 1) if mas_antiguo else None,
+            "descartadas": descartadas,
+            "encolados": self.encolados,
+            "enviados": self.enviados,
+            "envios_fallidos": self.envios_fallidos,
+            "latencia_envio_ultima_ms": self.latencia_ultima_ms,
+            "latencia_envio_media_ms": self.latencia_media_ms,
+        }
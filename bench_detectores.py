@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Compara la velocidad y la sensibilidad (recall) de los detectores de rostros
+sobre una carpeta de imágenes locales.
+
+Uso:
+    python bench_detectores.py fotos_salon/ --detectores hog:0,hog,hog:2,yunet,haar
+    python bench_detectores.py fotos_salon/ --anotaciones cajas.json
+
+Las anotaciones son un JSON {"archivo.jpg": [[top, right, bottom, left], ...]}
+en coordenadas de la imagen original. Sin anotaciones, la referencia son las
+detecciones del detector --referencia (por defecto "hog:2", el más exhaustivo),
+por lo que el recall es relativo a ese detector.
+
+Una detección acierta si su centro cae dentro de una caja de referencia y
+viceversa (los motores dibujan cajas de distinto tamaño para el mismo rostro).
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+from face_detectors import obtener_detector
+from face_utils import get_all_picture_files, decodificar_imagen, escalar_ubicaciones, MAX_DIMENSION_DEFECTO
+
+
+def _contiene(caja, punto):
+    top, right, bottom, left = caja
+    y, x = punto
+    return top <= y <= bottom and left <= x <= right
+
+
+def _centro(caja):
+    return (caja[0] + caja[2]) / 2.0, (caja[1] + caja[3]) / 2.0
+
+
+def contar_aciertos(detectadas, referencia):
+    """Cantidad de cajas de referencia encontradas (cada detección cuenta una vez)."""
+    usadas = set()
+    aciertos = 0
+    for ref in referencia:
+        for i, caja in enumerate(detectadas):
+            if i in usadas:
+                continue
+            if _contiene(ref, _centro(caja)) and _contiene(caja, _centro(ref)):
+                usadas.add(i)
+                aciertos += 1
+                break
+    return aciertos
+
+
+def medir(detector, imagenes, repeticiones):
+    """Detecta en cada imagen; retorna ({archivo: cajas}, [ms por imagen])."""
+    cajas = {}
+    tiempos = []
+    for archivo, (imagen, escala) in imagenes.items():
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            ubicaciones = detector.detectar(imagen)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        cajas[archivo] = escalar_ubicaciones(ubicaciones, escala)
+    return cajas, tiempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de detectores de rostros")
+    parser.add_argument("carpeta", help="Carpeta con imágenes (png, jpg, jpeg, gif)")
+    parser.add_argument("--detectores", default="hog:0,hog,hog:2,yunet,haar")
+    parser.add_argument("--anotaciones", help="JSON con las cajas reales por archivo")
+    parser.add_argument("--referencia", default="hog:2", help="Detector de referencia sin anotaciones")
+    parser.add_argument("--max-dim", type=int, default=int(os.getenv("IMAGE_MAX_DIM", MAX_DIMENSION_DEFECTO)))
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    archivos = sorted(get_all_picture_files(args.carpeta))
+    if not archivos:
+        print(f"❌ No hay imágenes en {args.carpeta}")
+        return
+    imagenes = {os.path.basename(a): decodificar_imagen(a, args.max_dim) for a in archivos}
+    print(f"🖼️ {len(imagenes)} imagen(es), lado mayor {args.max_dim or 'original'} px")
+
+    if args.anotaciones:
+        with open(args.anotaciones) as f:
+            referencia = {archivo: [tuple(c) for c in cajas] for archivo, cajas in json.load(f).items()}
+        origen = args.anotaciones
+    else:
+        referencia, _ = medir(obtener_detector(args.referencia), imagenes, 1)
+        origen = f"detector {args.referencia}"
+    total_ref = sum(len(referencia.get(a, [])) for a in imagenes)
+    print(f"🎯 Referencia: {origen} ({total_ref} rostro(s))")
+    print("=" * 78)
+    print(f"{'detector':<12}{'media ms':>10}{'p95 ms':>10}{'img/s':>8}{'rostros':>9}{'recall':>9}{'extra':>8}")
+
+    for especificacion in [d.strip() for d in args.detectores.split(",") if d.strip()]:
+        try:
+            detector = obtener_detector(especificacion)
+        except ValueError as e:
+            print(f"{especificacion:<12}  ⚠️ {e}")
+            continue
+        detector.detectar(next(iter(imagenes.values()))[0])  # Calentamiento
+        cajas, tiempos = medir(detector, imagenes, args.repeticiones)
+
+        detectados = sum(len(c) for c in cajas.values())
+        aciertos = sum(contar_aciertos(cajas[a], referencia.get(a, [])) for a in imagenes)
+        media = statistics.mean(tiempos)
+        p95 = sorted(tiempos)[int(0.95 * (len(tiempos) - 1))]
+        recall = aciertos / total_ref if total_ref else float("nan")
+        print(f"{especificacion:<12}{media:>10.1f}{p95:>10.1f}{1000 / media:>8.1f}"
+              f"{detectados:>9}{recall:>9.2f}{detectados - aciertos:>8}")
+
+    print("=" * 78)
+    print("recall = rostros de referencia encontrados; extra = detecciones sin referencia")
+
+
+if __name__ == "__main__":
+    main()
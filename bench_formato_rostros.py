@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Compara el formato JSON y el binario (matriz float32) para descargar las
+galerías de rostros desde Laravel.
+
+Uso:
+    python bench_formato_rostros.py
+    python bench_formato_rostros.py --estudiantes 30,60,500 --repeticiones 50
+
+Levanta un Laravel simulado local que responde /api/biometricos/matricula/{id}
+en el formato que pide la cabecera Accept, con encodings aleatorios
+serializados como los serializa PHP (floats de ~18 dígitos). Por cada
+tamaño de matrícula mide:
+
+- bytes: tamaño del cuerpo (y comprimido con gzip, como viajaría si Laravel
+  comprime la respuesta)
+- parseo: cuerpo -> FaceGallery, sin red (json.loads + from_rostros contra
+  decodificar_rostros_binarios + FaceGallery)
+- descarga: get_faces_delta_from_laravel + FaceGallery de punta a punta
+"""
+
+import argparse
+import gzip
+import json
+import statistics
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+from face_utils import FaceGallery
+from laravel_utils import (
+    LaravelClient, get_faces_delta_from_laravel, codificar_rostros_binarios, decodificar_rostros_binarios
+)
+
+
+class LaravelSimulado:
+    """Sirve la misma matrícula en JSON o en binario según el Accept."""
+
+    def __init__(self, estudiantes):
+        generador = np.random.default_rng(0)
+        rostros = [
+            {"id": 1000 + i, "encoding": (generador.standard_normal(128) * 0.1).tolist()}
+            for i in range(estudiantes)
+        ]
+        self.cuerpo_json = json.dumps({"rostros": rostros}).encode()
+        self.cuerpo_binario = codificar_rostros_binarios(rostros)
+
+        simulado = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Sin esto, cabeceras y cuerpo pequeños esperan al ACK retardado (~40 ms)
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if "application/octet-stream" in self.headers.get("Accept", ""):
+                    tipo, cuerpo = "application/octet-stream", simulado.cuerpo_binario
+                else:
+                    tipo, cuerpo = "application/json", simulado.cuerpo_json
+                self.send_response(200)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.servidor.server_port}"
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+
+    def detener(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+
+def cronometrar(funcion, repeticiones):
+    """Ejecuta la función varias veces; retorna (media ms, p95 ms)."""
+    funcion()  # Calentamiento
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.mean(tiempos), sorted(tiempos)[int(0.95 * (len(tiempos) - 1))]
+
+
+def parsear_json(cuerpo):
+    return FaceGallery.from_rostros(json.loads(cuerpo)["rostros"])
+
+
+def parsear_binario(cuerpo):
+    data = decodificar_rostros_binarios(cuerpo)
+    return FaceGallery(data["ids"], data["matriz"])
+
+
+def descargar(url, cliente):
+    respuesta = get_faces_delta_from_laravel(1, url, cliente=cliente)
+    if "matriz" in respuesta:
+        return FaceGallery(respuesta["ids"], respuesta["matriz"])
+    return FaceGallery.from_rostros(respuesta["rostros"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del formato de descarga de rostros")
+    parser.add_argument("--estudiantes", default="30,60,500", help="Tamaños de matrícula separados por coma")
+    parser.add_argument("--repeticiones", type=int, default=30)
+    args = parser.parse_args()
+
+    clientes = {
+        "json": LaravelClient(pool_size=2, rostros_binarios=False),
+        "binario": LaravelClient(pool_size=2, rostros_binarios=True),
+    }
+    print("=" * 86)
+    print(f"{'alumnos':>8}{'formato':>9}{'bytes':>10}{'gzip':>9}{'B/alumno':>10}"
+          f"{'parseo ms':>11}{'p95':>8}{'descarga ms':>13}{'p95':>8}")
+    for estudiantes in [int(e) for e in args.estudiantes.split(",") if e.strip()]:
+        laravel = LaravelSimulado(estudiantes)
+        try:
+            referencia = parsear_json(laravel.cuerpo_json)
+            for formato, cuerpo, parsear in (
+                ("json", laravel.cuerpo_json, parsear_json),
+                ("binario", laravel.cuerpo_binario, parsear_binario),
+            ):
+                galeria = descargar(laravel.url, clientes[formato])
+                assert galeria.lista_ids() == referencia.lista_ids()
+                assert np.array_equal(galeria.matrix, referencia.matrix)
+
+                parseo, parseo_p95 = cronometrar(lambda: parsear(cuerpo), args.repeticiones)
+                red, red_p95 = cronometrar(lambda: descargar(laravel.url, clientes[formato]), args.repeticiones)
+                print(f"{estudiantes:>8}{formato:>9}{len(cuerpo):>10}{len(gzip.compress(cuerpo)):>9}"
+                      f"{len(cuerpo) / estudiantes:>10.0f}{parseo:>11.3f}{parseo_p95:>8.3f}{red:>13.2f}{red_p95:>8.2f}")
+        finally:
+            laravel.detener()
+    print("=" * 86)
+    for cliente in clientes.values():
+        cliente.cerrar()
+
+
+if __name__ == "__main__":
+    main()
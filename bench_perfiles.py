@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Mide el costo por rostro de cada perfil de encoding sobre una carpeta de
+imágenes locales.
+
+Uso:
+    python bench_perfiles.py fotos_salon/
+    python bench_perfiles.py fotos_salon/ --perfiles rapido,preciso,registro:5,registro
+
+Los rostros se detectan una sola vez (con --detector) y cada perfil codifica
+las mismas cajas, así que los tiempos miden solo landmarks + red. La columna
+"desvío" es la distancia media entre el encoding de cada perfil y el del
+perfil más costoso de la lista: cuánto se aleja el perfil barato del robusto
+(el umbral de reconocimiento es MATCH_TOLERANCE, 0.6 por defecto).
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+import numpy as np
+import face_recognition
+
+from face_detectors import obtener_detector
+from face_utils import get_all_picture_files, decodificar_imagen, obtener_perfil, MAX_DIMENSION_DEFECTO
+
+
+def codificar(imagenes, cajas, parametros):
+    """Codifica cada rostro por separado; retorna (encodings, [ms por rostro])."""
+    encodings = []
+    tiempos = []
+    for archivo, imagen in imagenes.items():
+        for caja in cajas[archivo]:
+            inicio = time.perf_counter()
+            encoding = face_recognition.face_encodings(imagen, known_face_locations=[caja], **parametros)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+            encodings.append(encoding[0])
+    return np.array(encodings), tiempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de perfiles de encoding")
+    parser.add_argument("carpeta", help="Carpeta con imágenes (png, jpg, jpeg, gif)")
+    parser.add_argument("--perfiles", default="rapido,preciso,registro")
+    parser.add_argument("--detector", default="hog")
+    parser.add_argument("--max-dim", type=int, default=int(os.getenv("IMAGE_MAX_DIM", MAX_DIMENSION_DEFECTO)))
+    args = parser.parse_args()
+
+    archivos = sorted(get_all_picture_files(args.carpeta))
+    if not archivos:
+        print(f"❌ No hay imágenes en {args.carpeta}")
+        return
+    imagenes = {os.path.basename(a): decodificar_imagen(a, args.max_dim)[0] for a in archivos}
+    detector = obtener_detector(args.detector)
+    cajas = {archivo: detector.detectar(imagen) for archivo, imagen in imagenes.items()}
+    rostros = sum(len(c) for c in cajas.values())
+    print(f"🖼️ {len(imagenes)} imagen(es), {rostros} rostro(s) detectado(s) con {args.detector}")
+    if not rostros:
+        return
+
+    perfiles = []
+    for especificacion in [p.strip() for p in args.perfiles.split(",") if p.strip()]:
+        try:
+            perfiles.append((especificacion, obtener_perfil(especificacion)))
+        except ValueError as e:
+            print(f"⚠️ {e}")
+
+    resultados = []
+    for especificacion, parametros in perfiles:
+        primera = next(a for a in imagenes if cajas[a])
+        face_recognition.face_encodings(imagenes[primera], [cajas[primera][0]], **parametros)  # Calentamiento
+        encodings, tiempos = codificar(imagenes, cajas, parametros)
+        resultados.append((especificacion, parametros, encodings, tiempos))
+
+    # Referencia: el perfil con más re-muestreos (y 68 puntos ante empate)
+    referencia = max(resultados, key=lambda r: (r[1]["num_jitters"], r[1]["model"] == "large"))
+    print(f"🎯 Desvío respecto de: {referencia[0]}")
+    print("=" * 72)
+    print(f"{'perfil':<14}{'modelo':>8}{'jitters':>9}{'ms/rostro':>11}{'p95 ms':>9}{'rostros/s':>11}{'desvío':>9}")
+    for especificacion, parametros, encodings, tiempos in resultados:
+        media = statistics.mean(tiempos)
+        p95 = sorted(tiempos)[int(0.95 * (len(tiempos) - 1))]
+        desvio = float(np.linalg.norm(encodings - referencia[2], axis=1).mean())
+        print(f"{especificacion:<14}{parametros['model']:>8}{parametros['num_jitters']:>9}"
+              f"{media:>11.1f}{p95:>9.1f}{1000 / media:>11.1f}{desvio:>9.3f}")
+    print("=" * 72)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Cache LRU en memoria con expiración por TTL, límite de memoria y carga
+única (single-flight) por clave.
+"""
+
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+
+class _CargaEnCurso:
+    """Carga pendiente de una clave; los demás hilos esperan su resultado."""
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.valor = None
+        self.error = None
+
+
+class LRUCache:
+    """
+    Cache LRU thread-safe.
+
+    - ttl: segundos de vida de cada entrada (None = sin expiración)
+    - max_bytes: memoria máxima estimada; se desalojan las entradas menos usadas
+    - max_entries: número máximo de entradas (None = sin límite)
+    - sizeof: función que estima el tamaño en bytes de un valor
+    - cachear: predicado que decide si un valor cargado se guarda (p.ej. no
+      guardar listas vacías que pueden venir de un error de red); un valor
+      no guardado también descarta la entrada anterior de esa clave
+    - revalidar: el loader recibe el valor anterior (aunque haya expirado o se
+      pida refrescar) para poder hacer una actualización incremental
+
+    Si varios hilos piden la misma clave ausente, solo uno ejecuta el loader
+    y el resto espera y recibe el mismo resultado.
+    """
+
+    def __init__(self, ttl=None, max_bytes=None, max_entries=None, sizeof=None,
+                 cachear=None, revalidar=False, nombre="cache"):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.sizeof = sizeof or (lambda valor: 0)
+        self.cachear = cachear or (lambda valor: True)
+        self.revalidar = revalidar
+        self.nombre = nombre
+
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # clave -> (valor, tamaño, expira_en)
+        self._cargas = {}  # clave -> _CargaEnCurso
+        self._bytes = 0
+
+        # Estadísticas
+        self.hits = 0
+        self.misses = 0
+        self.cargas = 0
+        self.desalojos = 0
+        self.expirados = 0
+
+    def get(self, clave, loader=None, refrescar=False):
+        """
+        Obtiene un valor del cache; si no está (o expiró) lo carga con loader.
+
+        Args:
+            clave: Clave del valor
+            loader: Función que produce el valor (sin argumentos, o con el
+                valor anterior o None si el cache se creó con revalidar=True)
+            refrescar: Ignora la entrada existente y fuerza una nueva carga
+
+        Returns:
+            El valor cacheado/cargado, o None si no existe y no hay loader
+        """
+        with self._lock:
+            entrada = self._entradas.get(clave) if self.revalidar else None
+            anterior = entrada[0] if entrada is not None else None
+            if not refrescar:
+                valor = self._obtener_vigente(clave)
+                if valor is not None:
+                    self.hits += 1
+                    return valor
+            self.misses += 1
+
+            if loader is None:
+                return None
+
+            carga = self._cargas.get(clave)
+            lider = carga is None
+            if lider:
+                carga = _CargaEnCurso()
+                self._cargas[clave] = carga
+
+        if not lider:
+            carga.evento.wait()
+            if carga.error is not None:
+                raise carga.error
+            return carga.valor
+
+        try:
+            carga.valor = loader(anterior) if self.revalidar else loader()
+            with self._lock:
+                self.cargas += 1
+                if self.cachear(carga.valor):
+                    self._guardar(clave, carga.valor)
+                elif clave in self._entradas:
+                    # La entrada anterior quedó superada por esta carga: servirla (o
+                    # revalidarla) devolvería datos que el loader ya descartó
+                    self._quitar(clave)
+        except Exception as e:
+            carga.error = e
+            raise
+        finally:
+            with self._lock:
+                self._cargas.pop(clave, None)
+            carga.evento.set()
+
+        return carga.valor
+
+    def put(self, clave, valor):
+        """Guarda un valor en el cache."""
+        with self._lock:
+            self._guardar(clave, valor)
+
+    def peek(self, clave):
+        """Obtiene un valor vigente sin cargarlo ni alterar las estadísticas."""
+        with self._lock:
+            return self._obtener_vigente(clave, tocar=False)
+
+    def invalidate(self, clave):
+        """Elimina una clave del cache."""
+        with self._lock:
+            self._quitar(clave)
+
+    def clear(self):
+        """Vacía el cache."""
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def stats(self):
+        """Obtiene las estadísticas del cache."""
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                "nombre": self.nombre,
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / consultas, 4) if consultas else None,
+                "cargas": self.cargas,
+                "cargas_en_curso": len(self._cargas),
+                "desalojos": self.desalojos,
+                "expirados": self.expirados,
+            }
+
+    # === Internos (requieren self._lock) ===
+
+    def _obtener_vigente(self, clave, tocar=True):
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        valor, _, expira_en = entrada
+        if expira_en is not None and time.monotonic() >= expira_en:
+            self._quitar(clave)
+            self.expirados += 1
+            return None
+        if tocar:
+            self._entradas.move_to_end(clave)
+        return valor
+
+    def _guardar(self, clave, valor):
+        self._quitar(clave)
+        tamano = self.sizeof(valor)
+        expira_en = time.monotonic() + self.ttl if self.ttl else None
+        self._entradas[clave] = (valor, tamano, expira_en)
+        self._bytes += tamano
+        self._desalojar()
+
+    def _quitar(self, clave):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is not None:
+            self._bytes -= entrada[1]
+
+    def _desalojar(self):
+        # Nunca se desaloja la entrada recién insertada (la última)
+        while len(self._entradas) > 1 and (
+            (self.max_bytes is not None and self._bytes > self.max_bytes)
+            or (self.max_entries is not None and len(self._entradas) > self.max_entries)
+        ):
+            clave, (_, tamano, _) = self._entradas.popitem(last=False)
+            self._bytes -= tamano
+            self.desalojos += 1
+            logging.info(f"🧹 DEPURACIÓN: Cache {self.nombre} desalojó la clave {clave}")
@@ -0,0 +1,417 @@
+"""
+Planificador central de detección facial para todos los salones.
+
+Un pool de procesos (uno por núcleo por defecto) ejecuta la detección dlib
+fuera del GIL del proceso principal. Un hilo despachador reparte los núcleos
+entre las cámaras con Deficit Round Robin: cada ronda suma a cada cámara un
+quantum proporcional a su peso, y las cámaras que vieron rostros
+recientemente pesan más.
+
+Cada cámara puede tener un presupuesto de CPU (fracción de un núcleo): el
+tiempo de detección y de encoding que informan los procesos se descuenta de
+un balde de tokens, y una cámara sin saldo no recibe más trabajo hasta que
+se recargue.
+
+Si un proceso del pool muere (p.ej. el OOM killer durante un dlib muy
+grande) el pool queda roto; se reemplaza por uno nuevo y los frames en
+vuelo se pierden, pero las cámaras siguen siendo atendidas. El pool inicial
+se crea con fork antes de que existan otros hilos; los de reemplazo salen
+del forkserver que se arranca (con este módulo precargado) al calentar,
+porque hacer fork de un proceso con hilos puede heredar locks tomados.
+"""
+
+import multiprocessing
+import os
+from multiprocessing import forkserver
+import threading
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import face_recognition
+
+from face_detectors import obtener_detector
+from face_utils import obtener_perfil
+
+
+def detectar_en_proceso(frame, detector=None):
+    """
+    Detecta rostros en un frame BGR (se ejecuta en un proceso del pool).
+
+    Args:
+        detector: Especificación del detector de la cámara (ver face_detectors)
+
+    Returns:
+        tuple: (face_locations, segundos_de_detección)
+    """
+    inicio = time.perf_counter()
+    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    face_locations = obtener_detector(detector).detectar(rgb_frame)
+    return face_locations, time.perf_counter() - inicio
+
+
+def codificar_en_proceso(frame, face_locations, perfil=None):
+    """
+    Calcula los encodings de las cajas indicadas (se ejecuta en un proceso del pool).
+
+    Args:
+        perfil: Perfil de encoding de la cámara (ver face_utils.PERFILES_ENCODING)
+
+    Returns:
+        tuple: (encodings, segundos_de_cómputo)
+    """
+    inicio = time.perf_counter()
+    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    encodings = face_recognition.face_encodings(
+        rgb_frame, known_face_locations=face_locations, **obtener_perfil(perfil)
+    )
+    return encodings, time.perf_counter() - inicio
+
+
+def _calentar_proceso(espera):
+    time.sleep(espera)
+
+
+class _Camara:
+    """Estado de planificación de una cámara."""
+
+    def __init__(self, camara_id, fuente, presupuesto_cpu=None, detector=None, perfil_encoding=None):
+        self.camara_id = camara_id
+        self.fuente = fuente
+        self.detector = detector
+        self.perfil_encoding = perfil_encoding
+        self.deficit = 0.0
+        self.en_vuelo = False
+
+        # Balde de tokens de CPU: se recarga a `presupuesto_cpu` segundos por segundo
+        self.presupuesto_cpu = presupuesto_cpu
+        self.capacidad = presupuesto_cpu * 4 if presupuesto_cpu else None
+        self.saldo = self.capacidad
+        self._ultima_recarga = time.monotonic()
+        self.cpu_usada = 0.0
+
+        # Estadísticas
+        self.despachados = 0
+        self.completados = 0
+        self.errores = 0
+        self.espera_ultima_ms = None
+        self.espera_media_ms = None
+        self.deteccion_media_ms = None
+        self.ultimo_con_rostros = None
+
+    def registrar_espera(self, espera_ms):
+        self.espera_ultima_ms = round(espera_ms, 1)
+        self.espera_media_ms = round(
+            espera_ms if self.espera_media_ms is None else 0.9 * self.espera_media_ms + 0.1 * espera_ms, 1
+        )
+
+    def tiene_saldo(self, ahora):
+        if self.presupuesto_cpu is None:
+            return True
+        self.saldo = min(self.capacidad, self.saldo + (ahora - self._ultima_recarga) * self.presupuesto_cpu)
+        self._ultima_recarga = ahora
+        return self.saldo > 0
+
+    def consumir(self, segundos):
+        self.cpu_usada += segundos
+        if self.presupuesto_cpu is not None:
+            self.saldo -= segundos
+
+    def registrar_deteccion(self, segundos):
+        ms = segundos * 1000
+        self.deteccion_media_ms = round(
+            ms if self.deteccion_media_ms is None else 0.9 * self.deteccion_media_ms + 0.1 * ms, 1
+        )
+
+
+class DetectionScheduler:
+    """
+    Pool de detección compartido con reparto justo entre cámaras.
+
+    Cada fuente registrada debe implementar:
+    - frame_pendiente() -> bool   (hay un frame listo para analizar)
+    - tomar_frame() -> (seq, frame, timestamp) | None   (no bloqueante)
+    - procesar_deteccion(seq, timestamp, face_locations, frame)
+
+    Con quantum=0.5 una cámara normal se atiende cada dos rondas y una cámara
+    con rostros recientes (peso 3) tres veces cada dos rondas.
+    """
+
+    # Espera máxima del despachador sin avisos: recarga de presupuestos de CPU
+    ESPERA_SIN_AVISOS = 0.25
+
+    def __init__(self, workers=None, quantum=0.5, peso_con_rostros=3.0, ventana_prioridad=30.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.quantum = quantum
+        self.peso_con_rostros = peso_con_rostros
+        self.ventana_prioridad = ventana_prioridad
+
+        self._lock = threading.Lock()
+        self._hay_trabajo = threading.Event()
+        self._camaras = {}
+        self._orden = []
+        self._turno = 0
+        self._en_vuelo = 0
+        self._activo = False
+        self._thread = None
+        self.reinicios_pool = 0
+        self.pool = self._crear_pool(inicial=True)
+
+    def _crear_pool(self, inicial=False):
+        metodos = multiprocessing.get_all_start_methods()
+        if inicial and "fork" in metodos:
+            # fork: los procesos heredan los modelos de dlib ya cargados
+            contexto = multiprocessing.get_context("fork")
+        elif "forkserver" in metodos:
+            # Ya hay hilos de captura, tareas y HTTP: un fork heredaría sus locks
+            # (logging, urllib3, hilos de BLAS/OpenCV) tomados a mitad de camino
+            contexto = multiprocessing.get_context("forkserver")
+        else:
+            contexto = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=contexto)
+
+    def _reemplazar_pool(self, roto):
+        """Reemplaza el pool roto (una sola vez aunque varios futuros fallen a la vez)."""
+        with self._lock:
+            if self.pool is not roto or not self._activo:
+                return
+            self.pool = self._crear_pool()
+            self.reinicios_pool += 1
+        roto.shutdown(wait=False, cancel_futures=True)
+        logging.error("❌ DEPURACIÓN: Un proceso del pool de detección murió; pool de detección recreado")
+
+    # === Ciclo de vida ===
+
+    def iniciar(self):
+        """Crea los procesos del pool y arranca el hilo despachador."""
+        if self._activo:
+            return
+        # Forzar la creación de todos los procesos antes de que existan más hilos
+        for futuro in [self.pool.submit(_calentar_proceso, 0.05) for _ in range(self.workers)]:
+            futuro.result()
+        # El forkserver de los pools de reemplazo también arranca ahora, con dlib ya cargado
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            forkserver.set_forkserver_preload([__name__])
+            forkserver.ensure_running()
+
+        self._activo = True
+        self._thread = threading.Thread(target=self._despachar, daemon=True)
+        self._thread.start()
+        logging.info(f"⚙️ DEPURACIÓN: Planificador de detección iniciado con {self.workers} proceso(s)")
+
+    def detener(self):
+        """Detiene el despachador y el pool."""
+        self._activo = False
+        self._hay_trabajo.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    # === Registro de cámaras ===
+
+    def registrar(self, camara_id, fuente, presupuesto_cpu=None, detector=None, perfil_encoding=None):
+        """
+        Agrega una cámara a la planificación.
+
+        Args:
+            presupuesto_cpu: Fracción de un núcleo que puede consumir la cámara
+                (p.ej. 0.25); None = sin límite
+            detector: Especificación del detector ("hog", "yunet", ...); None = por defecto
+            perfil_encoding: Perfil de encoding ("rapido", "preciso", ...); None = por defecto
+        """
+        with self._lock:
+            self._camaras[camara_id] = _Camara(camara_id, fuente, presupuesto_cpu, detector, perfil_encoding)
+            self._orden = list(self._camaras)
+        self._hay_trabajo.set()
+
+    def desregistrar(self, camara_id):
+        """Quita una cámara de la planificación."""
+        with self._lock:
+            self._camaras.pop(camara_id, None)
+            self._orden = list(self._camaras)
+
+    def notificar(self):
+        """Avisa al despachador que hay frames nuevos."""
+        self._hay_trabajo.set()
+
+    # === Despacho ===
+
+    def _peso(self, camara, ahora):
+        if camara.ultimo_con_rostros is not None and ahora - camara.ultimo_con_rostros < self.ventana_prioridad:
+            return self.peso_con_rostros
+        return 1.0
+
+    def _despachar(self):
+        """Hilo despachador: rondas de Deficit Round Robin sobre las cámaras."""
+        while self._activo:
+            # Se limpia antes de la ronda: un aviso durante la ronda no se pierde
+            self._hay_trabajo.clear()
+            if not self._ronda():
+                self._hay_trabajo.wait(self.ESPERA_SIN_AVISOS)
+
+    def _ronda(self):
+        """Ejecuta una ronda; retorna True si despachó algún frame."""
+        despachado = False
+        ahora = time.monotonic()
+
+        with self._lock:
+            orden = self._orden[self._turno:] + self._orden[:self._turno]
+            if self._orden:
+                self._turno = (self._turno + 1) % len(self._orden)
+
+        for camara_id in orden:
+            with self._lock:
+                camara = self._camaras.get(camara_id)
+                if camara is None or camara.en_vuelo:
+                    continue
+                if self._en_vuelo >= self.workers:
+                    return despachado
+
+            if not camara.fuente.frame_pendiente() or not camara.tiene_saldo(ahora):
+                # Sin trabajo pendiente (o sin presupuesto) la cámara no acumula déficit
+                camara.deficit = 0.0
+                continue
+
+            camara.deficit += self.quantum * self._peso(camara, ahora)
+            if camara.deficit < 1.0:
+                continue
+
+            capturado = camara.fuente.tomar_frame()
+            if capturado is None:
+                continue
+            camara.deficit -= 1.0
+
+            seq, frame, timestamp = capturado
+            camara.registrar_espera((time.monotonic() - timestamp) * 1000)
+            self._enviar(camara, seq, frame, timestamp)
+            despachado = True
+
+        return despachado
+
+    def _enviar(self, camara, seq, frame, timestamp):
+        with self._lock:
+            camara.en_vuelo = True
+            camara.despachados += 1
+            self._en_vuelo += 1
+
+        pool = self.pool
+        try:
+            futuro = pool.submit(detectar_en_proceso, frame, camara.detector)
+        except Exception as e:
+            logging.error(f"❌ DEPURACIÓN: No se pudo enviar frame de {camara.camara_id} al pool: {str(e)}")
+            if isinstance(e, BrokenProcessPool):
+                self._reemplazar_pool(pool)
+            self._liberar(camara)
+            return
+
+        futuro.add_done_callback(lambda f: self._completado(camara, seq, timestamp, frame, pool, f))
+
+    def _completado(self, camara, seq, timestamp, frame, pool, futuro):
+        try:
+            face_locations, segundos = futuro.result()
+            camara.completados += 1
+            camara.consumir(segundos)
+            camara.registrar_deteccion(segundos)
+            if face_locations:
+                camara.ultimo_con_rostros = time.monotonic()
+            camara.fuente.procesar_deteccion(seq, timestamp, face_locations, frame)
+        except BrokenProcessPool:
+            camara.errores += 1
+            self._reemplazar_pool(pool)
+        except Exception as e:
+            camara.errores += 1
+            logging.error(f"❌ DEPURACIÓN: Error en detección de {camara.camara_id}: {str(e)}")
+        finally:
+            self._liberar(camara)
+
+    def solicitar_encodings(self, camara_id, frame, face_locations, callback):
+        """
+        Calcula en el pool los encodings de las cajas indicadas.
+
+        El tiempo de cómputo se descuenta del presupuesto de la cámara y el
+        trabajo ocupa un lugar del pool como una detección. Si la cámara no
+        tiene saldo o el pool está lleno no se envía nada y se retorna False;
+        el llamador puede reintentar en un frame posterior.
+
+        Args:
+            callback: Función que recibe la lista de encodings
+        """
+        camara = self._camaras.get(camara_id)
+        if camara is None or not camara.tiene_saldo(time.monotonic()):
+            return False
+
+        with self._lock:
+            # Desde procesar_deteccion la detección de la cámara aún cuenta en
+            # vuelo, pero cede su lugar al terminar el callback
+            if self._en_vuelo >= self.workers + int(camara.en_vuelo):
+                return False
+            self._en_vuelo += 1
+
+        pool = self.pool
+
+        def _terminado(futuro):
+            try:
+                encodings, segundos = futuro.result()
+                camara.consumir(segundos)
+                callback(encodings)
+            except BrokenProcessPool:
+                camara.errores += 1
+                self._reemplazar_pool(pool)
+            except Exception as e:
+                camara.errores += 1
+                logging.error(f"❌ DEPURACIÓN: Error calculando encodings de {camara_id}: {str(e)}")
+            finally:
+                self._liberar()
+
+        try:
+            futuro = pool.submit(codificar_en_proceso, frame, face_locations, camara.perfil_encoding)
+        except Exception as e:
+            logging.error(f"❌ DEPURACIÓN: No se pudo enviar encodings de {camara_id} al pool: {str(e)}")
+            if isinstance(e, BrokenProcessPool):
+                self._reemplazar_pool(pool)
+            self._liberar()
+            return False
+        futuro.add_done_callback(_terminado)
+        return True
+
+    def _liberar(self, camara=None):
+        with self._lock:
+            if camara is not None:
+                camara.en_vuelo = False
+            self._en_vuelo -= 1
+        self._hay_trabajo.set()
+
+    # === Estado ===
+
+    def obtener_estado_camara(self, camara_id):
+        """Cola y tiempos de espera de una cámara."""
+        camara = self._camaras.get(camara_id)
+        if camara is None:
+            return None
+        ahora = time.monotonic()
+        return {
+            "en_cola": int(camara.fuente.frame_pendiente()) + int(camara.en_vuelo),
+            "en_vuelo": camara.en_vuelo,
+            "prioridad": self._peso(camara, ahora),
+            "despachados": camara.despachados,
+            "completados": camara.completados,
+            "errores": camara.errores,
+            "espera_ultima_ms": camara.espera_ultima_ms,
+            "espera_media_ms": camara.espera_media_ms,
+            "deteccion_media_ms": camara.deteccion_media_ms,
+            "presupuesto_cpu": camara.presupuesto_cpu,
+            "saldo_cpu_s": round(camara.saldo, 3) if camara.saldo is not None else None,
+            "cpu_usada_s": round(camara.cpu_usada, 3),
+        }
+
+    def obtener_estado(self):
+        """Estado global del pool."""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "en_vuelo": self._en_vuelo,
+                "camaras": len(self._camaras),
+                "reinicios_pool": self.reinicios_pool,
+            }
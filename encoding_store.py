@@ -0,0 +1,380 @@
+"""
+Almacén persistente de encodings para la galería local de /faces.
+
+Guarda junto a las imágenes una matriz float32 (encodings.<gen>.f32) que se
+abre con memory-map y un índice JSON (encodings.json) con la fila, mtime,
+tamaño, hash y perfil de encoding de cada imagen. Al iniciar solo se
+recalculan los encodings de las imágenes nuevas o modificadas, o calculados
+con otro perfil.
+
+Las altas y bajas de /faces son incrementales: una alta agrega una fila al
+final de la matriz y una línea {"op": "put"} al diario (encodings.<gen>.log);
+una baja solo agrega {"op": "del"} y su fila queda muerta. La línea del
+diario (con fsync) es el punto de confirmación: una fila escrita sin su línea
+se ignora y se sobrescribe en la próxima alta. Cuando el diario supera la
+cantidad de rostros (y al sincronizar el directorio) se compacta: se escribe
+una generación nueva sin filas muertas y se reemplaza el índice con
+os.replace, que confirma la generación.
+
+Varios procesos (los workers de gunicorn) pueden compartir el almacén: las
+escrituras se serializan con un flock sobre encodings.lock y parten de la
+última generación confirmada, y recargar() vuelve a mapear la generación
+vigente cuando otro proceso la cambió.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import logging
+import numpy as np
+
+from face_utils import get_all_picture_files, remove_file_ext, PERFIL_DEFECTO
+
+
+def _hash_archivo(path):
+    """Hash SHA-1 del contenido de un archivo."""
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(bloque)
+    return sha1.hexdigest()
+
+
+def _firma_archivo(path):
+    """Metadatos baratos para detectar cambios (mtime y tamaño)."""
+    stat = os.stat(path)
+    return {"mtime": stat.st_mtime_ns, "tamano": stat.st_size}
+
+
+class EncodingStore:
+    """
+    Matriz de encodings memory-mapped + índice de ids, validada por mtime/hash.
+
+    Las filas se acceden como vistas de solo lectura sobre el memory-map,
+    sin copiar los vectores a objetos Python.
+    """
+
+    INDICE = "encodings.json"
+    BLOQUEO = "encodings.lock"
+
+    def __init__(self, path, dim=128, compactar_min=128):
+        self.path = path
+        self.dim = dim
+        # El diario se compacta al superar max(compactar_min, rostros) líneas
+        self.compactar_min = compactar_min
+        self.path_indice = os.path.join(path, self.INDICE)
+        self.path_bloqueo = os.path.join(path, self.BLOQUEO)
+        self.generacion = 0
+
+        self._lock = threading.Lock()
+        self.rostros = {}  # id -> {"fila", "archivo", "mtime", "tamano", "sha1"}
+        self.filas = 0  # Filas escritas en la matriz, incluidas las muertas
+        self.matriz = np.empty((0, dim), dtype=np.float32)
+        self._offset_diario = 0  # Bytes del diario ya aplicados
+        self._lineas_diario = 0
+        self._cargar()
+
+    # === API pública ===
+
+    def sincronizar(self, codificar, perfil=None):
+        """
+        Sincroniza el almacén con las imágenes del directorio.
+
+        Args:
+            codificar: Función path -> encoding (p.ej. calc_face_encoding)
+            perfil: Perfil de encoding de `codificar`; los rostros guardados
+                con otro perfil se recalculan (None = no se compara)
+
+        Returns:
+            dict: {id: encoding} con vistas sobre la matriz memory-mapped
+        """
+        with self._lock, self._bloqueo():
+            self._recargar_si_cambio()
+            deseados = {}
+            reutilizados = 0
+            nuevos = {}
+
+            for imagen in get_all_picture_files(self.path):
+                rostro_id = remove_file_ext(imagen)
+                firma = _firma_archivo(imagen)
+                meta = self.rostros.get(rostro_id)
+
+                if (
+                    meta and meta.get("archivo") == os.path.basename(imagen)
+                    and (perfil is None or meta.get("perfil", PERFIL_DEFECTO) == perfil)
+                    and self._vigente(meta, imagen, firma)
+                ):
+                    if meta.get("mtime") != firma["mtime"]:
+                        meta = dict(meta, mtime=firma["mtime"])
+                    deseados[rostro_id] = meta
+                    reutilizados += 1
+                    continue
+
+                # Imagen nueva o modificada: recalcular encoding
+                meta = dict(firma, archivo=os.path.basename(imagen), sha1=_hash_archivo(imagen), fila=None)
+                if perfil is not None:
+                    meta["perfil"] = perfil
+                try:
+                    nuevos[rostro_id] = np.asarray(codificar(imagen), dtype=np.float32)
+                except Exception as e:
+                    logging.warning(f"⚠️ DEPURACIÓN: No se pudo codificar {imagen}: {e}")
+                    meta["error"] = str(e)
+                deseados[rostro_id] = meta
+
+            cambios = bool(nuevos) or deseados.keys() != self.rostros.keys() or any(
+                deseados[r] is not self.rostros.get(r) for r in deseados
+            )
+            if cambios:
+                self._reescribir(deseados, nuevos)
+
+            logging.info(
+                f"📁 DEPURACIÓN: Almacén de encodings sincronizado - "
+                f"{reutilizados} reutilizado(s), {len(nuevos)} calculado(s), {len(self)} en total"
+            )
+            return self._como_dict()
+
+    def put(self, rostro_id, encoding, imagen, perfil=None):
+        """Agrega o reemplaza el encoding de un rostro (una fila al final + una línea de diario)."""
+        with self._lock, self._bloqueo():
+            self._recargar_si_cambio()
+            if not os.path.exists(self.path_indice):
+                # El diario necesita una generación confirmada a la que pertenecer
+                self._reescribir({}, {})
+            fila = self.filas
+            with open(self._path_matriz(self.generacion), "r+b" if fila else "wb") as f:
+                f.seek(fila * self.dim * 4)
+                f.write(np.asarray(encoding, dtype=np.float32).reshape(self.dim).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            meta = dict(
+                _firma_archivo(imagen),
+                archivo=os.path.basename(imagen),
+                sha1=_hash_archivo(imagen),
+                fila=fila,
+            )
+            if perfil is not None:
+                meta["perfil"] = perfil
+            self._anotar({"op": "put", "id": rostro_id, "meta": meta})
+            self.matriz = self._mapear(self.filas)
+            self._compactar_si_conviene()
+            return self.obtener(rostro_id)
+
+    def remove(self, rostro_id):
+        """Elimina el encoding de un rostro (una línea de diario; la fila queda muerta)."""
+        with self._lock, self._bloqueo():
+            self._recargar_si_cambio()
+            if rostro_id not in self.rostros:
+                return False
+            self._anotar({"op": "del", "id": rostro_id})
+            self._compactar_si_conviene()
+            return True
+
+    def recargar(self):
+        """
+        Vuelve a mapear la generación vigente si otro proceso la cambió.
+
+        Returns:
+            bool: True si cambió (hay que volver a leer como_dict())
+        """
+        with self._lock, self._bloqueo(exclusivo=False):
+            return self._recargar_si_cambio()
+
+    def como_dict(self):
+        """{id: encoding} con vistas sobre la matriz memory-mapped."""
+        return self._como_dict()
+
+    def obtener(self, rostro_id):
+        """Vista de solo lectura del encoding de un rostro (o None)."""
+        meta = self.rostros.get(rostro_id)
+        if meta is None or meta.get("fila") is None:
+            return None
+        return self.matriz[meta["fila"]]
+
+    def __len__(self):
+        return sum(1 for meta in self.rostros.values() if meta.get("fila") is not None)
+
+    def stats(self):
+        """Rostros, filas muertas y líneas del diario pendientes de compactar."""
+        vivas = len(self)
+        return {
+            "rostros": vivas,
+            "filas": self.filas,
+            "filas_muertas": self.filas - vivas,
+            "lineas_diario": self._lineas_diario,
+            "generacion": self.generacion,
+        }
+
+    # === Internos ===
+
+    def _vigente(self, meta, imagen, firma):
+        if meta.get("tamano") != firma["tamano"]:
+            return False
+        if meta.get("mtime") == firma["mtime"]:
+            return True
+        # Mismo tamaño pero distinto mtime: se confirma por contenido
+        return meta.get("sha1") == _hash_archivo(imagen)
+
+    @contextlib.contextmanager
+    def _bloqueo(self, exclusivo=True):
+        """flock entre procesos; el escritor lo toma exclusivo hasta confirmar."""
+        with open(self.path_bloqueo, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusivo else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _recargar_si_cambio(self):
+        try:
+            with open(self.path_indice) as f:
+                generacion = json.load(f).get("generacion", 0)
+        except (OSError, ValueError):
+            return False
+        if generacion != self.generacion:
+            self._cargar()
+            return True
+        # Misma generación: solo se aplican las líneas nuevas del diario
+        if self._leer_diario():
+            self.matriz = self._mapear(self.filas)
+            return True
+        return False
+
+    def _path_matriz(self, generacion):
+        return os.path.join(self.path, f"encodings.{generacion}.f32")
+
+    def _path_diario(self, generacion):
+        return os.path.join(self.path, f"encodings.{generacion}.log")
+
+    def _leer_diario(self):
+        """Aplica las líneas completas del diario desde el último offset; True si hubo alguna."""
+        try:
+            with open(self._path_diario(self.generacion), "rb") as f:
+                f.seek(self._offset_diario)
+                datos = f.read()
+        except FileNotFoundError:
+            return False
+        aplicadas = 0
+        for linea in datos.split(b"\n")[:-1]:  # La última parte no terminó de escribirse
+            self._offset_diario += len(linea) + 1
+            try:
+                entrada = json.loads(linea)
+            except ValueError:
+                continue
+            self._aplicar(entrada)
+            aplicadas += 1
+        self._lineas_diario += aplicadas
+        return aplicadas > 0
+
+    def _aplicar(self, entrada):
+        if entrada["op"] == "put":
+            meta = entrada["meta"]
+            self.rostros[entrada["id"]] = meta
+            if meta.get("fila") is not None:
+                self.filas = max(self.filas, meta["fila"] + 1)
+        elif entrada["op"] == "del":
+            self.rostros.pop(entrada["id"], None)
+
+    def _anotar(self, entrada):
+        """Confirma una entrada en el diario (requiere el bloqueo exclusivo) y la aplica."""
+        with open(self._path_diario(self.generacion), "ab") as f:
+            # Descarta una línea incompleta que haya dejado un corte anterior
+            f.truncate(self._offset_diario)
+            linea = json.dumps(entrada).encode() + b"\n"
+            f.write(linea)
+            f.flush()
+            os.fsync(f.fileno())
+        self._offset_diario += len(linea)
+        self._lineas_diario += 1
+        self._aplicar(entrada)
+
+    def _compactar_si_conviene(self):
+        if self._lineas_diario > max(self.compactar_min, len(self.rostros)):
+            self._reescribir(self.rostros, {})
+
+    def _cargar(self):
+        if not os.path.exists(self.path_indice):
+            return
+        try:
+            with open(self.path_indice) as f:
+                indice = json.load(f)
+            filas = indice.get("filas", 0)
+            generacion = indice.get("generacion", 0)
+            path_matriz = self._path_matriz(generacion)
+            if indice.get("dim", self.dim) != self.dim or (
+                filas and os.path.getsize(path_matriz) < filas * self.dim * 4
+            ):
+                raise ValueError("índice y matriz no coinciden")
+            self.rostros = indice.get("rostros", {})
+            self.generacion = generacion
+            self.filas = filas
+            self._offset_diario = 0
+            self._lineas_diario = 0
+            self._leer_diario()
+            if self.filas and os.path.getsize(path_matriz) < self.filas * self.dim * 4:
+                raise ValueError("el diario referencia filas que la matriz no tiene")
+            self.matriz = self._mapear(self.filas)
+        except Exception as e:
+            logging.warning(f"⚠️ DEPURACIÓN: Almacén de encodings inválido, se reconstruirá: {e}")
+            self.rostros = {}
+            self.filas = 0
+            self._offset_diario = 0
+            self._lineas_diario = 0
+            self.matriz = np.empty((0, self.dim), dtype=np.float32)
+
+    def _mapear(self, filas):
+        if filas == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.memmap(self._path_matriz(self.generacion), dtype=np.float32, mode="r", shape=(filas, self.dim))
+
+    def _reescribir(self, deseados, nuevos):
+        """Escribe matriz e índice nuevos sin filas muertas (compactación) y re-mapea."""
+        filas = []
+        rostros = {}
+        for rostro_id, meta in deseados.items():
+            meta = dict(meta)
+            if rostro_id in nuevos:
+                filas.append(nuevos[rostro_id])
+                meta["fila"] = len(filas) - 1
+            elif meta.get("fila") is not None:
+                filas.append(self.matriz[meta["fila"]])
+                meta["fila"] = len(filas) - 1
+            rostros[rostro_id] = meta
+
+        matriz = np.array(filas, dtype=np.float32).reshape(-1, self.dim)
+
+        generacion = self.generacion + 1
+        path_matriz = self._path_matriz(generacion)
+        with open(path_matriz, "wb") as f:
+            f.write(matriz.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        # El reemplazo del índice confirma la nueva generación
+        temporal = f"{self.path_indice}.tmp"
+        with open(temporal, "w") as f:
+            json.dump({"dim": self.dim, "filas": len(matriz), "generacion": generacion, "rostros": rostros}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.path_indice)
+
+        # La matriz anterior sigue válida para quien la tenga mapeada
+        anteriores = (self._path_matriz(self.generacion), self._path_diario(self.generacion))
+        self.generacion = generacion
+        self.rostros = rostros
+        self.filas = len(matriz)
+        self._offset_diario = 0
+        self._lineas_diario = 0
+        self.matriz = self._mapear(len(matriz))
+        for anterior in anteriores:
+            if os.path.exists(anterior):
+                os.remove(anterior)
+
+    def _como_dict(self):
+        return {
+            rostro_id: self.matriz[meta["fila"]]
+            for rostro_id, meta in self.rostros.items()
+            if meta.get("fila") is not None
+        }
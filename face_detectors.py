@@ -0,0 +1,214 @@
+"""
+Detectores de rostros intercambiables.
+
+Todos reciben una imagen RGB y devuelven cajas (top, right, bottom, left),
+el mismo formato de face_recognition.face_locations, por lo que cualquier
+detector puede alimentar a face_recognition.face_encodings.
+
+Un detector se elige con una especificación de texto "motor[:parámetro]":
+
+- "hog" / "hog:N": HOG de dlib con N re-escalados, de 0 a 2 (por defecto 1;
+  0 es el más rápido pero no encuentra rostros de menos de ~80 px)
+- "yunet" / "yunet:0.7": red YuNet de OpenCV (modelo ONNX en YUNET_MODEL_PATH)
+  con el umbral de confianza indicado, entre 0.01 y 0.99
+- "haar" / "haar:N": cascada Haar de OpenCV con N vecinos mínimos, de 1 a 20
+
+Un parámetro fuera de rango se lleva al límite más cercano. Las instancias
+se crean una vez por proceso y especificación normalizada ("hog" y "hog:1.0"
+comparten la misma), así que su cantidad está acotada.
+"""
+
+import math
+import os
+import threading
+import logging
+
+import cv2
+import face_recognition
+
+
+DETECTOR_DEFECTO = "hog"
+
+YUNET_MODEL_PATH = os.getenv("YUNET_MODEL_PATH", "/root/models/face_detection_yunet_2023mar.onnx")
+
+
+def _caja(x, y, ancho, alto, forma):
+    """Convierte (x, y, ancho, alto) a (top, right, bottom, left) dentro de la imagen."""
+    alto_img, ancho_img = forma[:2]
+    return (
+        max(int(y), 0),
+        min(int(x + ancho), ancho_img),
+        min(int(y + alto), alto_img),
+        max(int(x), 0),
+    )
+
+
+class FaceDetector:
+    """
+    Interfaz común de los detectores.
+
+    Las subclases declaran su parámetro: valor por defecto, rango admitido y
+    decimales que se conservan (0 = entero).
+    """
+
+    motor = None
+    parametro_defecto = None
+    parametro_min = None
+    parametro_max = None
+    decimales = 0
+
+    def __init__(self, especificacion):
+        self.especificacion = especificacion
+
+    @classmethod
+    def normalizar(cls, valor):
+        """Lleva el parámetro a su rango y precisión."""
+        valor = min(max(valor, cls.parametro_min), cls.parametro_max)
+        return round(valor, cls.decimales) if cls.decimales else int(round(valor))
+
+    def detectar(self, imagen):
+        """
+        Detecta rostros en una imagen RGB.
+
+        Returns:
+            list: [(top, right, bottom, left), ...]
+        """
+        raise NotImplementedError
+
+
+class HogDetector(FaceDetector):
+    """HOG + SVM lineal de dlib (el detector por defecto de face_recognition)."""
+
+    motor = "hog"
+    parametro_defecto = 1
+    parametro_min = 0
+    parametro_max = 2  # Cada re-escalado cuadruplica el costo
+
+    def __init__(self, especificacion, upsample=1):
+        super().__init__(especificacion)
+        self.upsample = int(upsample)
+
+    def detectar(self, imagen):
+        return face_recognition.face_locations(imagen, number_of_times_to_upsample=self.upsample, model="hog")
+
+
+class YuNetDetector(FaceDetector):
+    """
+    Detector CNN ligero YuNet (cv2.FaceDetectorYN, OpenCV >= 4.8).
+
+    Cada hilo usa su propia instancia de la red: FaceDetectorYN guarda el
+    tamaño de entrada y no es seguro compartirlo.
+    """
+
+    motor = "yunet"
+    parametro_defecto = 0.6
+    parametro_min = 0.01
+    parametro_max = 0.99
+    decimales = 2
+
+    def __init__(self, especificacion, umbral=0.6, modelo=None):
+        super().__init__(especificacion)
+        self.umbral = float(umbral)
+        self.modelo = modelo or YUNET_MODEL_PATH
+        if not hasattr(cv2, "FaceDetectorYN"):
+            raise ValueError("YuNet requiere OpenCV >= 4.8 (cv2.FaceDetectorYN)")
+        if not os.path.isfile(self.modelo):
+            raise ValueError(f"No se encontró el modelo YuNet en {self.modelo} (ver YUNET_MODEL_PATH)")
+        self._local = threading.local()
+
+    def _red(self, ancho, alto):
+        red = getattr(self._local, "red", None)
+        if red is None:
+            red = cv2.FaceDetectorYN.create(self.modelo, "", (ancho, alto), self.umbral, 0.3, 5000)
+            self._local.red = red
+        red.setInputSize((ancho, alto))
+        return red
+
+    def detectar(self, imagen):
+        alto, ancho = imagen.shape[:2]
+        bgr = cv2.cvtColor(imagen, cv2.COLOR_RGB2BGR)
+        _, rostros = self._red(ancho, alto).detect(bgr)
+        if rostros is None:
+            return []
+        return [_caja(x, y, w, h, imagen.shape) for x, y, w, h in rostros[:, :4]]
+
+
+class HaarDetector(FaceDetector):
+    """Cascada Haar frontal de OpenCV: la opción más barata, con más falsos positivos."""
+
+    motor = "haar"
+    parametro_defecto = 5
+    parametro_min = 1
+    parametro_max = 20
+
+    def __init__(self, especificacion, vecinos=5, cascada=None):
+        super().__init__(especificacion)
+        self.vecinos = int(vecinos)
+        if not hasattr(cv2, "CascadeClassifier"):
+            raise ValueError("Haar requiere cv2.CascadeClassifier (OpenCV 4.x)")
+        carpeta = getattr(getattr(cv2, "data", None), "haarcascades", "")
+        self.cascada = cascada or os.path.join(carpeta, "haarcascade_frontalface_default.xml")
+        if cv2.CascadeClassifier(self.cascada).empty():
+            raise ValueError(f"No se pudo cargar la cascada Haar {self.cascada}")
+        self._local = threading.local()
+
+    def detectar(self, imagen):
+        clasificador = getattr(self._local, "clasificador", None)
+        if clasificador is None:
+            clasificador = self._local.clasificador = cv2.CascadeClassifier(self.cascada)
+        gris = cv2.equalizeHist(cv2.cvtColor(imagen, cv2.COLOR_RGB2GRAY))
+        rostros = clasificador.detectMultiScale(gris, scaleFactor=1.1, minNeighbors=self.vecinos, minSize=(30, 30))
+        return [_caja(x, y, w, h, imagen.shape) for x, y, w, h in rostros]
+
+
+MOTORES = {
+    "hog": HogDetector,
+    "yunet": YuNetDetector,
+    "haar": HaarDetector,
+}
+
+_detectores = {}
+_lock = threading.Lock()
+
+
+def obtener_detector(especificacion=None):
+    """
+    Devuelve el detector de una especificación ("hog", "hog:2", "yunet", "haar"...).
+
+    Raises:
+        ValueError: Motor desconocido, parámetro inválido o modelo no disponible
+    """
+    especificacion = (especificacion or DETECTOR_DEFECTO).strip().lower()
+    motor, _, parametro = especificacion.partition(":")
+    clase = MOTORES.get(motor)
+    if clase is None:
+        raise ValueError(f"Detector desconocido '{motor}'; opciones: {', '.join(MOTORES)}")
+    try:
+        valor = float(parametro) if parametro else clase.parametro_defecto
+    except ValueError:
+        valor = float("nan")
+    if not math.isfinite(valor):
+        raise ValueError(f"Parámetro inválido en detector '{especificacion}' (debe ser numérico)")
+
+    # La clave del cache es la especificación normalizada: su cantidad está acotada
+    normalizado = clase.normalizar(valor)
+    if not clase.parametro_min <= valor <= clase.parametro_max:
+        logging.warning(
+            f"⚠️ DEPURACIÓN: Parámetro de detector '{especificacion}' fuera de rango "
+            f"({clase.parametro_min}-{clase.parametro_max}); se usa {normalizado}"
+        )
+    especificacion = f"{motor}:{normalizado}"
+    detector = _detectores.get(especificacion)
+    if detector is not None:
+        return detector
+
+    try:
+        nuevo = clase(especificacion, normalizado)
+    except (TypeError, cv2.error) as e:
+        raise ValueError(f"Detector '{especificacion}' inválido: {e}")
+
+    with _lock:
+        detector = _detectores.setdefault(especificacion, nuevo)
+    if detector is nuevo:
+        logging.info(f"🔍 DEPURACIÓN: Detector de rostros '{especificacion}' listo")
+    return detector
@@ -0,0 +1,319 @@
+"""
+Índice aproximado de vecinos más cercanos (IVF) para identificación facial
+a nivel de toda la institución.
+
+Implementación en NumPy puro: un cuantizador grueso (k-means) reparte los
+encodings de 128 dimensiones en `nlist` listas invertidas; una búsqueda solo
+recorre las `nprobe` listas más cercanas a la consulta. `nprobe` es el control
+de recall/latencia: nprobe = nlist equivale a una búsqueda exacta.
+"""
+
+import json
+import os
+import threading
+import logging
+import numpy as np
+
+
+class _ListaInvertida:
+    """Bloque contiguo de vectores de una celda del índice (con capacidad doble)."""
+
+    def __init__(self, dim, capacidad=16):
+        self.vectores = np.empty((capacidad, dim), dtype=np.float32)
+        self.normas = np.empty(capacidad, dtype=np.float32)
+        self.ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def agregar(self, rostro_id, vector):
+        n = len(self.ids)
+        if n == len(self.vectores):
+            nuevos = np.empty((2 * n, self.vectores.shape[1]), dtype=np.float32)
+            nuevos[:n] = self.vectores
+            self.vectores = nuevos
+            normas = np.empty(2 * n, dtype=np.float32)
+            normas[:n] = self.normas
+            self.normas = normas
+        self.vectores[n] = vector
+        self.normas[n] = float(vector @ vector)
+        self.ids.append(rostro_id)
+        return n
+
+    def quitar(self, posicion):
+        """Quita la posición moviendo el último elemento a su lugar; retorna el id movido."""
+        ultimo = len(self.ids) - 1
+        movido = None
+        if posicion != ultimo:
+            self.vectores[posicion] = self.vectores[ultimo]
+            self.normas[posicion] = self.normas[ultimo]
+            movido = self.ids[ultimo]
+            self.ids[posicion] = movido
+        self.ids.pop()
+        return movido
+
+
+def _kmeans(datos, k, iteraciones=10, semilla=0):
+    """K-means (Lloyd) inicializado con k puntos aleatorios de la muestra."""
+    rng = np.random.default_rng(semilla)
+    n = len(datos)
+    centroides = datos[rng.choice(n, k, replace=False)].astype(np.float32)
+
+    for _ in range(iteraciones):
+        asignacion = _mas_cercano(datos, centroides)
+        sumas = np.zeros_like(centroides)
+        np.add.at(sumas, asignacion, datos)
+        conteos = np.bincount(asignacion, minlength=k)
+        vacios = conteos == 0
+        centroides[~vacios] = sumas[~vacios] / conteos[~vacios, None]
+        # Las celdas vacías se re-siembran con puntos aleatorios
+        if vacios.any():
+            centroides[vacios] = datos[rng.integers(n, size=int(vacios.sum()))]
+
+    return centroides
+
+
+def _mas_cercano(datos, centroides):
+    """Índice del centroide más cercano para cada fila de datos."""
+    c_normas = np.einsum("ij,ij->i", centroides, centroides)
+    return np.argmin(c_normas[None, :] - 2.0 * datos @ centroides.T, axis=1)
+
+
+class FaceIndex:
+    """
+    Índice IVF de encodings faciales con altas/bajas incrementales.
+
+    Mientras no está entrenado (pocas muestras) funciona como búsqueda
+    exacta sobre una única lista. Al superar `min_entrenamiento` vectores se
+    entrena el cuantizador automáticamente, y se vuelve a entrenar cuando la
+    cantidad de vectores se duplica.
+    """
+
+    def __init__(self, dim=128, nprobe=8, min_entrenamiento=2048):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.min_entrenamiento = min_entrenamiento
+
+        self._lock = threading.RLock()
+        self.centroides = None  # (nlist, dim) cuando está entrenado
+        self._c_normas = None
+        self._listas = [_ListaInvertida(dim)]
+        self._ubicacion = {}  # rostro_id -> (lista, posición)
+        self._entrenado_con = 0
+        self.modificado = False
+
+    def __len__(self):
+        return len(self._ubicacion)
+
+    @property
+    def nlist(self):
+        return len(self._listas)
+
+    # === Altas y bajas ===
+
+    def add(self, ids, vectores):
+        """Agrega o actualiza encodings (upsert por id)."""
+        vectores = np.asarray(vectores, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            for rostro_id in ids:
+                self._quitar(rostro_id)
+            celdas = self._asignar(vectores)
+            for rostro_id, vector, celda in zip(ids, vectores, celdas):
+                posicion = self._listas[celda].agregar(rostro_id, vector)
+                self._ubicacion[rostro_id] = (celda, posicion)
+            if len(ids):
+                self.modificado = True
+        return len(ids)
+
+    def remove(self, ids):
+        """Elimina encodings por id; retorna la cantidad eliminada."""
+        with self._lock:
+            eliminados = sum(1 for rostro_id in ids if self._quitar(rostro_id))
+            if eliminados:
+                self.modificado = True
+            return eliminados
+
+    def necesita_entrenamiento(self):
+        """Indica si conviene (re)entrenar el cuantizador."""
+        n = len(self)
+        if n < self.min_entrenamiento:
+            return False
+        return self.centroides is None or n >= 2 * self._entrenado_con
+
+    def entrenar(self, nlist=None, iteraciones=10):
+        """
+        Entrena el cuantizador grueso y redistribuye los vectores en las listas.
+
+        Args:
+            nlist: Número de celdas (por defecto ~4·√n)
+            iteraciones: Iteraciones de k-means
+        """
+        with self._lock:
+            ids, vectores = self._todos()
+        n = len(ids)
+        if n == 0:
+            return
+        nlist = int(nlist or max(1, min(4 * int(np.sqrt(n)), n // 8 or 1)))
+
+        # Muestra de entrenamiento (~64 puntos por celda)
+        rng = np.random.default_rng(0)
+        muestra = vectores if n <= 64 * nlist else vectores[rng.choice(n, 64 * nlist, replace=False)]
+        centroides = _kmeans(muestra, nlist, iteraciones)
+
+        with self._lock:
+            # Re-leer por si hubo cambios durante el entrenamiento
+            ids, vectores = self._todos()
+            self.centroides = centroides
+            self._c_normas = np.einsum("ij,ij->i", centroides, centroides)
+            self._listas = [_ListaInvertida(self.dim) for _ in range(nlist)]
+            self._ubicacion = {}
+            self._entrenado_con = len(ids)
+            self.modificado = True
+            if len(ids):
+                celdas = self._asignar(vectores)
+                for rostro_id, vector, celda in zip(ids, vectores, celdas):
+                    posicion = self._listas[celda].agregar(rostro_id, vector)
+                    self._ubicacion[rostro_id] = (celda, posicion)
+
+        logging.info(f"🧭 DEPURACIÓN: Índice IVF entrenado - {len(ids)} vectores en {nlist} listas")
+
+    # === Búsqueda ===
+
+    def search(self, consultas, k=1, nprobe=None):
+        """
+        Busca los k vecinos más cercanos de cada consulta.
+
+        Args:
+            consultas: Encodings a buscar (m x dim)
+            k: Vecinos por consulta
+            nprobe: Listas a recorrer (mayor = más recall, más latencia)
+
+        Returns:
+            list: Para cada consulta, lista de (id, distancia) ordenada
+
+        Raises:
+            ValueError: k menor que 1
+        """
+        if k < 1:
+            raise ValueError(f"k debe ser al menos 1 (recibido {k})")
+        consultas = np.asarray(consultas, dtype=np.float32).reshape(-1, self.dim)
+        resultados = []
+        with self._lock:
+            nprobe = max(1, min(int(nprobe or self.nprobe), self.nlist))
+            for consulta in consultas:
+                resultados.append(self._buscar(consulta, k, nprobe))
+        return resultados
+
+    def _buscar(self, consulta, k, nprobe):
+        if self.centroides is None:
+            celdas = [0]
+        else:
+            d_centroides = self._c_normas - 2.0 * (self.centroides @ consulta)
+            if nprobe < len(d_centroides):
+                celdas = np.argpartition(d_centroides, nprobe - 1)[:nprobe]
+            else:
+                celdas = range(len(d_centroides))
+
+        q_norma = float(consulta @ consulta)
+        candidatos_ids = []
+        candidatos_dist = []
+        for celda in celdas:
+            lista = self._listas[celda]
+            n = len(lista)
+            if n == 0:
+                continue
+            sq = lista.normas[:n] + q_norma - 2.0 * (lista.vectores[:n] @ consulta)
+            candidatos_dist.append(sq)
+            candidatos_ids.extend(lista.ids)
+
+        if not candidatos_ids:
+            return []
+        distancias = np.concatenate(candidatos_dist)
+        k = min(k, len(distancias))
+        mejores = np.argpartition(distancias, k - 1)[:k]
+        mejores = mejores[np.argsort(distancias[mejores])]
+        return [
+            (candidatos_ids[i], float(np.sqrt(max(distancias[i], 0.0))))
+            for i in mejores
+        ]
+
+    # === Persistencia ===
+
+    def save(self, path):
+        """Guarda el índice en disco de forma atómica (.npz)."""
+        with self._lock:
+            ids, vectores = self._todos()
+            centroides = self.centroides if self.centroides is not None else np.empty((0, self.dim), np.float32)
+            entrenado_con = self._entrenado_con
+            self.modificado = False
+
+        temporal = f"{path}.tmp"
+        with open(temporal, "wb") as f:
+            np.savez(
+                f,
+                vectores=vectores,
+                ids=np.array(json.dumps(ids)),
+                centroides=centroides,
+                entrenado_con=np.array(entrenado_con),
+            )
+        os.replace(temporal, path)
+        logging.info(f"💾 DEPURACIÓN: Índice guardado en {path} ({len(ids)} vectores)")
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Carga un índice guardado con save()."""
+        with np.load(path) as datos:
+            vectores = datos["vectores"]
+            ids = json.loads(str(datos["ids"]))
+            centroides = datos["centroides"]
+            entrenado_con = int(datos["entrenado_con"])
+
+        indice = cls(dim=vectores.shape[1], **kwargs)
+        if len(centroides):
+            indice.centroides = centroides.astype(np.float32)
+            indice._c_normas = np.einsum("ij,ij->i", indice.centroides, indice.centroides)
+            indice._listas = [_ListaInvertida(indice.dim) for _ in range(len(centroides))]
+            indice._entrenado_con = entrenado_con
+        indice.add(ids, vectores)
+        indice.modificado = False
+        logging.info(f"📂 DEPURACIÓN: Índice cargado desde {path} ({len(indice)} vectores)")
+        return indice
+
+    def stats(self):
+        """Obtiene estadísticas del índice."""
+        with self._lock:
+            tamanos = [len(lista) for lista in self._listas]
+            return {
+                "vectores": len(self),
+                "entrenado": self.centroides is not None,
+                "nlist": self.nlist,
+                "nprobe": self.nprobe,
+                "lista_max": max(tamanos) if tamanos else 0,
+                "lista_media": round(float(np.mean(tamanos)), 2) if tamanos else 0,
+            }
+
+    # === Internos (requieren self._lock) ===
+
+    def _asignar(self, vectores):
+        if self.centroides is None:
+            return np.zeros(len(vectores), dtype=np.intp)
+        return np.argmin(self._c_normas[None, :] - 2.0 * vectores @ self.centroides.T, axis=1)
+
+    def _quitar(self, rostro_id):
+        ubicacion = self._ubicacion.pop(rostro_id, None)
+        if ubicacion is None:
+            return False
+        celda, posicion = ubicacion
+        movido = self._listas[celda].quitar(posicion)
+        if movido is not None:
+            self._ubicacion[movido] = (celda, posicion)
+        return True
+
+    def _todos(self):
+        ids = []
+        bloques = []
+        for lista in self._listas:
+            ids.extend(lista.ids)
+            bloques.append(lista.vectores[:len(lista)])
+        vectores = np.concatenate(bloques) if bloques else np.empty((0, self.dim), np.float32)
+        return ids, np.ascontiguousarray(vectores, dtype=np.float32)
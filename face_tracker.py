@@ -0,0 +1,208 @@
+"""
+Seguimiento de rostros entre frames de un stream (IoU + centroide).
+
+Asigna un track_id estable a cada caja de rostro para que el encoding de
+128 dimensiones (la parte más costosa) solo se calcule cuando un track es
+nuevo o su identidad aún no está confirmada; una vez confirmada, el track
+reutiliza la identidad mientras siga visible.
+"""
+
+import itertools
+import time
+
+
+def _iou(a, b):
+    """Intersección sobre unión de dos cajas (top, right, bottom, left)."""
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    interseccion = max(0, right - left) * max(0, bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    union = area_a + area_b - interseccion
+    return interseccion / union if union > 0 else 0.0
+
+
+def _centro(caja):
+    return (caja[0] + caja[2]) / 2.0, (caja[1] + caja[3]) / 2.0
+
+
+def _tamano(caja):
+    return max(caja[1] - caja[3], caja[2] - caja[0], 1)
+
+
+class Track:
+    """Rostro seguido a lo largo de varios frames."""
+
+    def __init__(self, track_id, caja, ahora):
+        self.track_id = track_id
+        self.caja = tuple(caja)
+        self.creado = ahora
+        self.ultimo_visto = ahora
+        self.apariciones = 1
+
+        # Identidad
+        self.rostro_id = None
+        self.distancia = None
+        self.confirmaciones = 0
+        self.confirmado = False
+        self.ultimo_encoding = None  # Momento del último encoding calculado
+        self.encoding_pendiente = None  # Momento en que se pidió un encoding aún sin resultado
+        self.encodings = 0
+
+    def a_dict(self):
+        return {
+            "track_id": self.track_id,
+            "caja": list(self.caja),
+            "rostro_id": self.rostro_id,
+            "confirmado": self.confirmado,
+            "encodings": self.encodings,
+        }
+
+
+class FaceTracker:
+    """
+    Tracker de rostros por IoU con respaldo por distancia de centroides.
+
+    - iou_min: IoU mínima para asociar una caja a un track existente
+    - distancia_max: distancia de centroides (relativa al tamaño de la caja)
+      aceptada cuando la IoU no alcanza (movimientos entre frames espaciados)
+    - max_perdido: segundos sin ver un track antes de descartarlo; debe cubrir el
+      hueco máximo entre análisis (SalonData lo deriva de la compuerta de movimiento)
+    - confirmaciones: coincidencias necesarias para fijar la identidad
+    - reintento: segundos entre encodings de un track aún sin confirmar
+    - espera_pendiente: segundos tras los que un encoding pedido y sin
+      resultado (p.ej. perdido en un pool roto) se da por fallido
+    """
+
+    def __init__(self, iou_min=0.3, distancia_max=0.6, max_perdido=3.0, confirmaciones=1, reintento=2.0,
+                 espera_pendiente=10.0):
+        self.iou_min = iou_min
+        self.distancia_max = distancia_max
+        self.max_perdido = max_perdido
+        self.confirmaciones = confirmaciones
+        self.reintento = reintento
+        self.espera_pendiente = espera_pendiente
+
+        self.tracks = {}
+        self._ids = itertools.count(1)
+
+        # Estadísticas
+        self.tracks_creados = 0
+        self.encodings_calculados = 0
+        self.encodings_evitados = 0
+
+    def actualizar(self, face_locations, ahora=None):
+        """
+        Asocia las cajas detectadas con los tracks existentes.
+
+        Returns:
+            list: Track correspondiente a cada caja, en el mismo orden
+        """
+        ahora = time.monotonic() if ahora is None else ahora
+
+        # Descartar tracks perdidos
+        for track_id in [t for t, track in self.tracks.items() if ahora - track.ultimo_visto > self.max_perdido]:
+            del self.tracks[track_id]
+
+        # Pares candidatos ordenados por afinidad (IoU alta, luego centroide cercano)
+        candidatos = []
+        for i, caja in enumerate(face_locations):
+            for track in self.tracks.values():
+                iou = _iou(caja, track.caja)
+                if iou >= self.iou_min:
+                    candidatos.append((1.0 + iou, i, track))
+                    continue
+                (cy, cx), (ty, tx) = _centro(caja), _centro(track.caja)
+                distancia = ((cy - ty) ** 2 + (cx - tx) ** 2) ** 0.5 / _tamano(track.caja)
+                if distancia <= self.distancia_max:
+                    candidatos.append((1.0 - distancia, i, track))
+        candidatos.sort(key=lambda c: c[0], reverse=True)
+
+        asignados = [None] * len(face_locations)
+        usados = set()
+        for _, i, track in candidatos:
+            if asignados[i] is not None or track.track_id in usados:
+                continue
+            asignados[i] = track
+            usados.add(track.track_id)
+
+        for i, caja in enumerate(face_locations):
+            track = asignados[i]
+            if track is None:
+                track = Track(next(self._ids), caja, ahora)
+                self.tracks[track.track_id] = track
+                self.tracks_creados += 1
+                asignados[i] = track
+            else:
+                track.caja = tuple(caja)
+                track.ultimo_visto = ahora
+                track.apariciones += 1
+
+        return asignados
+
+    def necesita_encoding(self, track, ahora=None):
+        """True si el track es nuevo o su identidad aún no está confirmada."""
+        if track.confirmado:
+            return False
+        ahora = time.monotonic() if ahora is None else ahora
+        if track.encoding_pendiente is not None and ahora - track.encoding_pendiente < self.espera_pendiente:
+            return False
+        if track.ultimo_encoding is None:
+            return True
+        return ahora - track.ultimo_encoding >= self.reintento
+
+    def seleccionar_para_encoding(self, tracks, ahora=None):
+        """
+        Filtra los tracks que requieren encoding y cuenta los evitados.
+
+        Returns:
+            list: índices (posiciones en `tracks`) que deben codificarse
+        """
+        ahora = time.monotonic() if ahora is None else ahora
+        indices = [i for i, track in enumerate(tracks) if self.necesita_encoding(track, ahora)]
+        self.encodings_evitados += len(tracks) - len(indices)
+        return indices
+
+    def marcar_pendientes(self, tracks, ahora=None):
+        """Marca tracks con un encoding en curso para no volver a pedirlo."""
+        ahora = time.monotonic() if ahora is None else ahora
+        for track in tracks:
+            track.encoding_pendiente = ahora
+
+    def desmarcar_pendientes(self, tracks):
+        """Quita la marca cuando el encoding no llegó a enviarse."""
+        for track in tracks:
+            track.encoding_pendiente = None
+
+    def registrar_identidad(self, track, rostro_id, distancia=None, ahora=None):
+        """
+        Registra el resultado de comparar el encoding de un track.
+
+        Args:
+            rostro_id: Rostro reconocido o None si no hubo coincidencia
+        """
+        track.ultimo_encoding = time.monotonic() if ahora is None else ahora
+        track.encoding_pendiente = None
+        track.encodings += 1
+        self.encodings_calculados += 1
+
+        if rostro_id is None:
+            return
+        if rostro_id == track.rostro_id:
+            track.confirmaciones += 1
+        else:
+            track.rostro_id = rostro_id
+            track.confirmaciones = 1
+        track.distancia = distancia
+        if track.confirmaciones >= self.confirmaciones:
+            track.confirmado = True
+
+    def obtener_estado(self):
+        """Estadísticas del tracker."""
+        return {
+            "tracks_activos": len(self.tracks),
+            "tracks_confirmados": sum(1 for t in self.tracks.values() if t.confirmado),
+            "tracks_creados": self.tracks_creados,
+            "encodings_calculados": self.encodings_calculados,
+            "encodings_evitados": self.encodings_evitados,
+        }
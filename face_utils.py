@@ -2,13 +2,56 @@
 Utilidades para procesamiento de imágenes y reconocimiento facial.
 """
 
+import io
+import os
+import sys
+import struct
+import threading
+import weakref
 from os import listdir
 from os.path import isfile, join, splitext
+import numpy as np
+import cv2
 import face_recognition
+from face_detectors import obtener_detector
 from werkzeug.exceptions import BadRequest
 import logging
 
 
+# Lado mayor (px) al que se reducen las imágenes antes de detectar; 0 = sin reducir
+MAX_DIMENSION_DEFECTO = 1600
+
+# Decodificación JPEG reducida de OpenCV (libjpeg escala el IDCT, no decodifica completo)
+_FLAGS_REDUCIDOS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+class ImagenNoProcesable(ValueError):
+    """
+    La imagen no sirve para la operación pedida: no se puede decodificar, no
+    tiene rostros o tiene más de uno. Depende solo de sus bytes, así que
+    reenviar la misma imagen da siempre el mismo resultado.
+    """
+
+# Perfiles de costo del encoding: modelo de landmarks para alinear el rostro y
+# re-muestreos (jitters) promediados por la red. "rapido" equivale a los valores
+# por defecto de face_recognition; cada jitter adicional suma un pase completo.
+PERFILES_ENCODING = {
+    "rapido": {"model": "small", "num_jitters": 1},     # 5 puntos, sin re-muestreo (streams)
+    "preciso": {"model": "large", "num_jitters": 1},    # 68 puntos
+    "registro": {"model": "large", "num_jitters": 10},  # 68 puntos y 10 re-muestreos (enrolamiento)
+}
+PERFIL_DEFECTO = "rapido"
+# Cada re-muestreo es un encoding completo más: registro:20 ya cuesta ~20 veces rapido
+MAX_JITTERS = 20
+
+# Marcadores SOF (start of frame) que contienen las dimensiones del JPEG
+_MARCADORES_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
 def is_picture(filename):
     """Verifica si un archivo es una imagen válida."""
     image_extensions = {"png", "jpg", "jpeg", "gif"}
@@ -27,14 +70,188 @@ def remove_file_ext(filename):
     return splitext(filename.rsplit("/", 1)[-1])[0]
 
 
-def calc_face_encoding(image):
+def obtener_perfil(especificacion=None):
+    """
+    Parámetros de face_recognition.face_encodings para un perfil "nombre[:jitters]"
+    (p.ej. "rapido", "registro" o "registro:20"; a lo sumo MAX_JITTERS).
+
+    Raises:
+        ValueError: Perfil desconocido o jitters inválidos
+    """
+    nombre, _, jitters = (especificacion or PERFIL_DEFECTO).strip().lower().partition(":")
+    if nombre not in PERFILES_ENCODING:
+        raise ValueError(f"Perfil de encoding desconocido '{nombre}'; opciones: {', '.join(PERFILES_ENCODING)}")
+    parametros = dict(PERFILES_ENCODING[nombre])
+    if jitters:
+        if not jitters.isdigit() or not 1 <= int(jitters) <= MAX_JITTERS:
+            raise ValueError(f"Jitters inválidos en perfil '{especificacion}' (entero de 1 a {MAX_JITTERS})")
+        parametros["num_jitters"] = int(jitters)
+    return parametros
+
+
+def _leer_bytes(fuente):
+    """Bytes de una imagen dada como bytes, ruta o archivo (p.ej. FileStorage de Flask)."""
+    if isinstance(fuente, (bytes, bytearray, memoryview)):
+        return bytes(fuente)
+    if isinstance(fuente, (str, os.PathLike)):
+        with open(fuente, "rb") as f:
+            return f.read()
+    if hasattr(fuente, "seek"):
+        fuente.seek(0)
+    return fuente.read()
+
+
+def _orientacion_exif(tiff):
+    """Valor del tag Orientation (0x0112) de un bloque TIFF/EXIF; 1 si no está."""
+    if tiff[:2] == b"II":
+        orden = "<"
+    elif tiff[:2] == b"MM":
+        orden = ">"
+    else:
+        return 1
+    try:
+        offset = struct.unpack(orden + "I", tiff[4:8])[0]
+        entradas = struct.unpack(orden + "H", tiff[offset:offset + 2])[0]
+        for i in range(entradas):
+            entrada = tiff[offset + 2 + 12 * i:offset + 14 + 12 * i]
+            if struct.unpack(orden + "H", entrada[:2])[0] == 0x0112:
+                valor = struct.unpack(orden + "H", entrada[8:10])[0]
+                return valor if 1 <= valor <= 8 else 1
+    except struct.error:
+        pass
+    return 1
+
+
+def _cabecera_jpeg(datos):
+    """
+    Lee ancho, alto y orientación EXIF recorriendo los marcadores de un JPEG,
+    sin decodificar la imagen.
+
+    Returns:
+        tuple: (ancho, alto, orientación) o None si no es un JPEG válido
+    """
+    if datos[:2] != b"\xff\xd8":
+        return None
+    orientacion = 1
+    i = 2
+    while i + 4 <= len(datos):
+        if datos[i] != 0xFF:
+            return None
+        marcador = datos[i + 1]
+        if marcador == 0xFF:
+            i += 1
+            continue
+        if marcador == 0x01 or 0xD0 <= marcador <= 0xD8:
+            i += 2
+            continue
+        largo = struct.unpack(">H", datos[i + 2:i + 4])[0]
+        segmento = datos[i + 4:i + 2 + largo]
+        if marcador == 0xE1 and segmento[:6] == b"Exif\x00\x00":
+            orientacion = _orientacion_exif(segmento[6:])
+        elif marcador in _MARCADORES_SOF and len(segmento) >= 5:
+            alto, ancho = struct.unpack(">HH", segmento[1:5])
+            return ancho, alto, orientacion
+        i += 2 + largo
+    return None
+
+
+def _orientar(imagen, orientacion):
+    """Aplica la orientación EXIF (1-8) a una imagen."""
+    if orientacion == 2:
+        return cv2.flip(imagen, 1)
+    if orientacion == 3:
+        return cv2.rotate(imagen, cv2.ROTATE_180)
+    if orientacion == 4:
+        return cv2.flip(imagen, 0)
+    if orientacion == 5:
+        return cv2.transpose(imagen)
+    if orientacion == 6:
+        return cv2.rotate(imagen, cv2.ROTATE_90_CLOCKWISE)
+    if orientacion == 7:
+        return cv2.flip(cv2.transpose(imagen), -1)
+    if orientacion == 8:
+        return cv2.rotate(imagen, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return imagen
+
+
+def decodificar_imagen(fuente, max_dim=MAX_DIMENSION_DEFECTO):
+    """
+    Decodifica una imagen en RGB con su lado mayor limitado a `max_dim`.
+
+    Los JPEG se decodifican directamente a 1/2, 1/4 o 1/8 de su tamaño
+    (IMREAD_REDUCED_*), por lo que una foto de 12 MP nunca se expande
+    completa en memoria; el resto de formatos se decodifica y se reduce.
+    Se aplica la orientación EXIF, igual que la ve quien tomó la foto.
+
+    Args:
+        fuente: bytes, ruta o archivo de imagen
+        max_dim: Lado mayor máximo en píxeles (0/None = resolución original)
+
+    Returns:
+        tuple: (imagen RGB uint8, escala) donde escala = original / decodificada;
+            las coordenadas sobre la imagen se multiplican por escala para
+            llevarlas a la imagen original (ver escalar_ubicaciones)
+    """
+    datos = _leer_bytes(fuente)
+    cabecera = _cabecera_jpeg(datos)
+    ancho, alto, orientacion = cabecera if cabecera else (None, None, 1)
+
+    flags = cv2.IMREAD_COLOR
+    if max_dim and ancho:
+        for factor, flag in _FLAGS_REDUCIDOS:
+            if max(ancho, alto) / factor >= max_dim:
+                flags = flag
+                break
+
+    imagen = cv2.imdecode(np.frombuffer(datos, dtype=np.uint8), flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    if imagen is not None:
+        imagen = cv2.cvtColor(imagen, cv2.COLOR_BGR2RGB)
+    else:
+        # Formatos que OpenCV no decodifica (p.ej. GIF): respaldo con PIL
+        try:
+            imagen = face_recognition.load_image_file(io.BytesIO(datos))
+        except (OSError, ValueError) as e:
+            raise ImagenNoProcesable(f"Invalid image: {e}") from e
+    if not ancho:
+        alto, ancho = imagen.shape[:2]
+
+    lado = max(imagen.shape[:2])
+    if max_dim and lado > max_dim:
+        factor = max_dim / lado
+        imagen = cv2.resize(imagen, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+
+    escala = ancho / imagen.shape[1]
+    imagen = _orientar(imagen, orientacion)
+    logging.debug(
+        f"Imagen decodificada {ancho}x{alto} -> {imagen.shape[1]}x{imagen.shape[0]} "
+        f"(escala {escala:.2f}, orientación {orientacion})"
+    )
+    return imagen, escala
+
+
+def escalar_ubicaciones(face_locations, escala):
+    """Lleva cajas (top, right, bottom, left) de la imagen reducida a la original."""
+    if escala == 1:
+        return list(face_locations)
+    return [tuple(int(round(v * escala)) for v in caja) for caja in face_locations]
+
+
+def _codificar(imagen, detector=None, perfil=None):
+    """Detecta rostros con el detector indicado y calcula sus encodings con el perfil dado."""
+    face_locations = obtener_detector(detector).detectar(imagen)
+    if not face_locations:
+        return []
+    return face_recognition.face_encodings(imagen, known_face_locations=face_locations, **obtener_perfil(perfil))
+
+
+def calc_face_encoding(image, max_dim=MAX_DIMENSION_DEFECTO, detector=None, perfil=None):
     """Calcula la codificación facial de una imagen."""
-    loaded_image = face_recognition.load_image_file(image)
-    faces = face_recognition.face_encodings(loaded_image)
+    loaded_image, _ = decodificar_imagen(image, max_dim)
+    faces = _codificar(loaded_image, detector, perfil)
     if len(faces) > 1:
-        raise Exception("Found more than one face in the image.")
+        raise ImagenNoProcesable("Found more than one face in the image.")
     if not faces:
-        raise Exception("No face found in the image.")
+        raise ImagenNoProcesable("No face found in the image.")
     return faces[0]
 
 
@@ -56,29 +273,32 @@ def extract_image(request):
     return file
 
 
-def detect_faces_only(file_stream):
+def detect_faces_only(file_stream, max_dim=MAX_DIMENSION_DEFECTO, detector=None):
     """
     Detecta únicamente si existen rostros en una imagen sin hacer comparaciones.
     
     Args:
         file_stream: Archivo de imagen (puede ser un objeto file de Flask o ruta)
+        max_dim: Lado mayor al que se reduce la imagen antes de detectar
+        detector: Especificación del detector ("hog", "hog:2", "yunet", "haar")
     
     Returns:
         dict: {
             "faces_detected": int,     // Número de rostros encontrados
             "has_faces": bool,         // True si hay al menos un rostro
-            "face_locations": list     // Coordenadas de cada rostro encontrado
+            "face_locations": list     // Coordenadas de cada rostro en la imagen original
         }
     
     Raises:
-        Exception: Si hay error al procesar la imagen
+        ImagenNoProcesable: Si la imagen no se puede decodificar
+        Exception: Si hay otro error al procesar la imagen
     """
     try:
-        # Cargar la imagen
-        img = face_recognition.load_image_file(file_stream)
+        # Cargar la imagen (reducida)
+        img, escala = decodificar_imagen(file_stream, max_dim)
         
         # Detectar ubicaciones de rostros (más rápido que calcular encodings)
-        face_locations = face_recognition.face_locations(img)
+        face_locations = escalar_ubicaciones(obtener_detector(detector).detectar(img), escala)
         
         # Contar rostros detectados
         faces_count = len(face_locations)
@@ -91,35 +311,440 @@ def detect_faces_only(file_stream):
             "face_locations": face_locations
         }
         
+    except ImagenNoProcesable as e:
+        logging.error(f"Error en detección de rostros: {str(e)}")
+        raise ImagenNoProcesable(f"Error processing image: {str(e)}") from e
     except Exception as e:
         logging.error(f"Error en detección de rostros: {str(e)}")
         raise Exception(f"Error processing image: {str(e)}")
 
 
-def detect_faces_in_image(file_stream, rostros_a_comparar, recognition_threshold):
-    """Detecta y compara rostros en una imagen con rostros conocidos."""
-    img = face_recognition.load_image_file(file_stream)
-    uploaded_faces = face_recognition.face_encodings(img)
+def _arreglo_ids(ids):
+    """Ids como arreglo NumPy: int64 si todos son enteros, objetos en otro caso."""
+    ids = list(ids)
+    if all(isinstance(i, (int, np.integer)) and not isinstance(i, bool) for i in ids):
+        return np.array(ids, dtype=np.int64)
+    arreglo = np.empty(len(ids), dtype=object)
+    arreglo[:] = ids
+    return arreglo
 
-    logging.info(f"{len(uploaded_faces)} rostro(s) detectado(s) en imagen recibida.")
 
-    rostros_detectados = []
+class FaceGallery:
+    """
+    Galería de rostros conocidos apilada en una matriz contigua float32.
+
+    Permite comparar todos los rostros detectados contra todos los rostros
+    conocidos en una sola operación vectorizada, en lugar de llamar a
+    face_recognition.compare_faces / face_distance por cada par.
+
+    Es inmutable: aplicar_cambios() construye una galería nueva, de modo que
+    quien la reemplaza lo hace con una sola asignación y los lectores que
+    tengan la anterior siguen viendo un estado consistente. Cada rostro ocupa
+    512 bytes de encoding más su id, en lugar de los ~4-5 KB de la lista de
+    diccionarios con floats de Python que devuelve Laravel.
+    """
+
+    def __init__(self, ids, matrix):
+        self.ids = ids if isinstance(ids, np.ndarray) else _arreglo_ids(ids)
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if matrix.ndim == 2:
+            dim = matrix.shape[1]
+        else:
+            # Sin filas no se puede inferir la dimensión: la de dlib
+            dim = matrix.size // len(self.ids) if len(self.ids) else 128
+        self.matrix = matrix.reshape(len(self.ids), dim)
+        # Normas al cuadrado precalculadas: ||a - b||² = ||a||² + ||b||² - 2·a·b
+        self.sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        self.nbytes = self.matrix.nbytes + self.sq_norms.nbytes + self.ids.nbytes
+        if self.ids.dtype == object:
+            self.nbytes += sum(sys.getsizeof(i) for i in self.ids)
+
+    @classmethod
+    def from_rostros(cls, rostros):
+        """Construye la galería desde la lista de rostros devuelta por Laravel."""
+        rostros = [r for r in rostros if r.get("encoding") is not None]
+        if not rostros:
+            return cls([], np.empty((0, 128), dtype=np.float32))
+        matrix = np.array([r["encoding"] for r in rostros], dtype=np.float32)
+        return cls([r["id"] for r in rostros], matrix)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def id_de(self, indice):
+        """Id (tipo nativo de Python) del rostro en la fila indicada."""
+        valor = self.ids[indice]
+        return valor.item() if isinstance(valor, np.generic) else valor
+
+    def lista_ids(self):
+        """Ids de la galería como lista de Python."""
+        return self.ids.tolist()
+
+    def vector(self, fila):
+        """Encoding (float32) del rostro en la fila indicada."""
+        return self.matrix[fila]
+
+    # === Actualización incremental (ver laravel_utils.SincronizadorRostros) ===
+
+    def posiciones(self):
+        """Diccionario id -> fila (se construye en cada llamada; no se guarda)."""
+        return {rostro_id: fila for fila, rostro_id in enumerate(self.ids.tolist())}
+
+    def cambiados_en(self, rostros, posiciones=None):
+        """
+        Rostros de una descarga completa que son nuevos o cuyo encoding difiere
+        del de la galería (la comparación se hace en float32).
+        """
+        posiciones = self.posiciones() if posiciones is None else posiciones
+        cambiados = []
+        for rostro in rostros:
+            fila = posiciones.get(rostro.get("id"))
+            encoding = rostro.get("encoding")
+            if encoding is None:
+                if fila is not None:
+                    cambiados.append(rostro)
+            elif fila is None or not np.array_equal(self.vector(fila), np.asarray(encoding, dtype=np.float32)):
+                cambiados.append(rostro)
+        return cambiados
+
+    def aplicar_cambios(self, cambiados, eliminados):
+        """
+        Nueva galería con los rostros agregados/modificados y sin los eliminados.
+
+        Un rostro modificado sin encoding se quita de la galería.
+        """
+        nuevos = {r.get("id"): r.get("encoding") for r in cambiados}
+        quitar = set(eliminados) | set(nuevos)
+        conservar = [fila for fila, rostro_id in enumerate(self.ids.tolist()) if rostro_id not in quitar]
+        agregados = [(rostro_id, encoding) for rostro_id, encoding in nuevos.items() if encoding is not None]
+
+        ids = [self.ids[fila] for fila in conservar] + [rostro_id for rostro_id, _ in agregados]
+        matrix = np.empty((len(ids), self.matrix.shape[1]), dtype=np.float32)
+        matrix[:len(conservar)] = self.matrix[conservar]
+        if agregados:
+            matrix[len(conservar):] = np.array([encoding for _, encoding in agregados], dtype=np.float32)
+        return FaceGallery(ids, matrix)
+
+    def _matriz_y_normas(self):
+        return self.matrix, self.sq_norms
+
+    def distances(self, encodings):
+        """Calcula la matriz de distancias euclidianas (rostros x galería)."""
+        matrix, sq_norms = self._matriz_y_normas()
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, matrix.shape[1])
+        q_norms = np.einsum("ij,ij->i", queries, queries)
+        sq = q_norms[:, None] + sq_norms[None, :] - 2.0 * (queries @ matrix.T)
+        np.maximum(sq, 0.0, out=sq)
+        return np.sqrt(sq, out=sq)
 
-    if uploaded_faces:
-        for uploaded_face in uploaded_faces:
-            for rostro in rostros_a_comparar:
-                known_encoding = rostro["encoding"]
-                match = face_recognition.compare_faces(
-                    [known_encoding], uploaded_face, tolerance=recognition_threshold
-                )[0]
+    def match(self, encodings, recognition_threshold):
+        """
+        Asigna a cada rostro detectado su mejor coincidencia en la galería.
 
-                if match:
-                    distancia = face_recognition.face_distance(
-                        [known_encoding], uploaded_face
-                    )[0]
-                    rostros_detectados.append(
-                        {"id": rostro["id"], "dist": float(distancia)}
-                    )
+        La asignación es uno a uno: un mismo estudiante se asigna como máximo
+        a un rostro, resolviendo los conflictos por menor distancia.
+
+        Returns:
+            list: [{"id": ..., "dist": float}, ...] ordenada por rostro detectado
+        """
+        return [
+            {"id": self.id_de(indice), "dist": dist}
+            for _, indice, dist in self.match_indices(encodings, recognition_threshold)
+        ]
+
+    def match_indices(self, encodings, recognition_threshold):
+        """
+        Igual que match(), pero retorna (índice_rostro, índice_galería, distancia).
+        """
+        if len(encodings) == 0 or len(self) == 0:
+            return []
+
+        dist = self.distances(encodings)
+        candidatos = np.argwhere(dist <= recognition_threshold)
+        if candidatos.size == 0:
+            return []
+
+        # Asignación voraz por distancia ascendente
+        orden = np.argsort(dist[candidatos[:, 0], candidatos[:, 1]], kind="stable")
+        rostros_asignados = {}
+        galeria_usada = set()
+        for cara, indice in candidatos[orden]:
+            if cara in rostros_asignados or indice in galeria_usada:
+                continue
+            rostros_asignados[cara] = indice
+            galeria_usada.add(indice)
+
+        return [
+            (int(cara), int(indice), float(dist[cara, indice]))
+            for cara, indice in sorted(rostros_asignados.items())
+        ]
+
+
+class EncodingPool:
+    """
+    Encodings únicos del proceso, compartidos por todas las galerías.
+
+    Un mismo estudiante suele estar en varias matrículas: su encoding se
+    guarda una sola vez (una fila de la matriz del pool, identificada por el
+    id del rostro) y cada PooledGallery guarda solo los números de fila. Cada
+    fila cuenta cuántas galerías la usan y vuelve a la lista de libres cuando
+    se libera la última, así la memoria crece con los estudiantes distintos y
+    no con el total de inscripciones.
+
+    Una fila en uso nunca se modifica: si Laravel cambia el encoding de un
+    rostro, el nuevo ocupa otra fila y la anterior se libera cuando la dejan
+    de usar las galerías viejas. La matriz crece al doble cuando se llena
+    (se copia una vez) y no se achica; las filas libres se reutilizan.
+    """
+
+    def __init__(self, dim=128, capacidad=256):
+        self.dim = dim
+        self._lock = threading.RLock()  # liberar() puede llegar desde un finalizador en el mismo hilo
+        self._matrix = np.zeros((capacidad, dim), dtype=np.float32)
+        self._sq_norms = np.zeros(capacidad, dtype=np.float32)
+        self._refs = np.zeros(capacidad, dtype=np.int32)
+        self._ids = [None] * capacidad
+        self._fila_de = {}  # id del rostro -> fila vigente
+        self._libres = []
+        self._alto = 0  # Filas usadas alguna vez
+
+        # Estadísticas
+        self.reutilizados = 0
+
+    def __len__(self):
+        return len(self._fila_de)
+
+    def _fila_libre(self):
+        if self._libres:
+            return self._libres.pop()
+        if self._alto == len(self._refs):
+            capacidad = 2 * len(self._refs)
+            matrix = np.zeros((capacidad, self.dim), dtype=np.float32)
+            matrix[:self._alto] = self._matrix[:self._alto]
+            sq_norms = np.zeros(capacidad, dtype=np.float32)
+            sq_norms[:self._alto] = self._sq_norms[:self._alto]
+            refs = np.zeros(capacidad, dtype=np.int32)
+            refs[:self._alto] = self._refs[:self._alto]
+            # Los lectores que ya tomaron la matriz anterior siguen leyendo filas válidas
+            self._matrix, self._sq_norms, self._refs = matrix, sq_norms, refs
+            self._ids.extend([None] * (capacidad - len(self._ids)))
+        self._alto += 1
+        return self._alto - 1
+
+    def agregar(self, ids, matrix):
+        """
+        Reserva una referencia por rostro; reutiliza la fila si el id ya está
+        en el pool con el mismo encoding.
+
+        Returns:
+            np.ndarray: filas (int32) en el orden de ids
+        """
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(len(ids), self.dim)
+        filas = np.empty(len(ids), dtype=np.int32)
+        with self._lock:
+            for i, rostro_id in enumerate(ids):
+                fila = self._fila_de.get(rostro_id)
+                if fila is not None and np.array_equal(self._matrix[fila], matrix[i]):
+                    self.reutilizados += 1
+                else:
+                    fila = self._fila_libre()
+                    self._matrix[fila] = matrix[i]
+                    self._sq_norms[fila] = np.dot(matrix[i], matrix[i])
+                    self._ids[fila] = rostro_id
+                    self._fila_de[rostro_id] = fila
+                self._refs[fila] += 1
+                filas[i] = fila
+        return filas
+
+    def retener(self, filas):
+        """Suma una referencia a filas que ya están en uso."""
+        with self._lock:
+            np.add.at(self._refs, filas, 1)
+
+    def liberar(self, filas):
+        """Quita una referencia; las filas sin referencias quedan libres."""
+        with self._lock:
+            np.subtract.at(self._refs, filas, 1)
+            for fila in np.unique(filas).tolist():
+                if self._refs[fila] == 0:
+                    rostro_id = self._ids[fila]
+                    if self._fila_de.get(rostro_id) == fila:
+                        del self._fila_de[rostro_id]
+                    self._ids[fila] = None
+                    self._libres.append(fila)
+
+    def tomar(self, filas):
+        """Copia (matriz, normas²) de las filas indicadas para una comparación."""
+        matrix, sq_norms = self._matrix, self._sq_norms
+        return matrix[filas], sq_norms[filas]
+
+    def vector(self, fila):
+        """Encoding de una fila (vista de solo lectura sobre el pool)."""
+        return self._matrix[fila]
+
+    def stats(self):
+        """Rostros distintos, referencias y memoria ahorrada por compartirlos."""
+        bytes_fila = self.dim * 4 + 4
+        with self._lock:
+            distintos = len(self._fila_de)
+            en_uso = self._alto - len(self._libres)
+            referencias = int(self._refs[:self._alto].sum())
+            capacidad = len(self._refs)
+        return {
+            "rostros_distintos": distintos,
+            "filas_en_uso": en_uso,
+            "referencias": referencias,
+            "capacidad": capacidad,
+            "bytes": capacidad * bytes_fila,
+            "bytes_sin_compartir": referencias * bytes_fila,
+            "reutilizados": self.reutilizados,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def obtener_pool():
+    """Retorna el pool de encodings del proceso (lo crea si no existe)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = EncodingPool()
+        return _pool
+
+
+class PooledGallery(FaceGallery):
+    """
+    FaceGallery cuyos encodings viven en un EncodingPool compartido.
+
+    Solo guarda los ids y las filas del pool (4 bytes por rostro); las
+    referencias se devuelven al pool cuando la galería deja de usarse (la
+    recolecta Python), de modo que un lector que todavía la tenga sigue
+    viendo filas válidas. Se construye y actualiza igual que FaceGallery;
+    aplicar_cambios() reutiliza las filas de los rostros que no cambiaron.
+
+    La galería es inmutable y sus filas no cambian mientras las retiene, así
+    que la primera comparación junta sus filas en una matriz contigua y las
+    siguientes la reutilizan. Solo las galerías que se comparan (las de
+    salones con cámaras activas) pagan esa copia, que se va con la galería;
+    nbytes sigue contando el tamaño compacto que usa el caché de galerías.
+    """
+
+    def __init__(self, ids, matrix, pool=None):
+        ids = ids if isinstance(ids, np.ndarray) else _arreglo_ids(ids)
+        pool = pool if pool is not None else obtener_pool()
+        self._iniciar(ids, pool.agregar(ids.tolist(), matrix), pool)
+
+    @classmethod
+    def _desde_filas(cls, ids, filas, pool):
+        """Galería sobre filas ya retenidas en el pool."""
+        galeria = cls.__new__(cls)
+        galeria._iniciar(_arreglo_ids(ids), filas, pool)
+        return galeria
+
+    def _iniciar(self, ids, filas, pool):
+        self.ids = ids
+        self.filas = np.asarray(filas, dtype=np.int32)
+        self.pool = pool
+        self._densa = None  # (matriz, normas²) juntadas en la primera comparación
+        self.nbytes = self.filas.nbytes + self.ids.nbytes
+        if self.ids.dtype == object:
+            self.nbytes += sum(sys.getsizeof(i) for i in self.ids)
+        weakref.finalize(self, pool.liberar, self.filas)
+
+    @property
+    def matrix(self):
+        return self._matriz_y_normas()[0]
+
+    @property
+    def sq_norms(self):
+        return self._matriz_y_normas()[1]
+
+    def vector(self, fila):
+        return self.pool.vector(self.filas[fila])
+
+    def aplicar_cambios(self, cambiados, eliminados):
+        nuevos = {r.get("id"): r.get("encoding") for r in cambiados}
+        quitar = set(eliminados) | set(nuevos)
+        conservar = [fila for fila, rostro_id in enumerate(self.ids.tolist()) if rostro_id not in quitar]
+        agregados = [(rostro_id, encoding) for rostro_id, encoding in nuevos.items() if encoding is not None]
+
+        filas_conservadas = self.filas[conservar]
+        self.pool.retener(filas_conservadas)
+        filas_nuevas = self.pool.agregar(
+            [rostro_id for rostro_id, _ in agregados],
+            np.array([encoding for _, encoding in agregados], dtype=np.float32).reshape(len(agregados), self.pool.dim),
+        )
+        ids = [self.ids[fila] for fila in conservar] + [rostro_id for rostro_id, _ in agregados]
+        return PooledGallery._desde_filas(ids, np.concatenate([filas_conservadas, filas_nuevas]), self.pool)
+
+    def _matriz_y_normas(self):
+        densa = self._densa
+        if densa is None:
+            # Dos hilos pueden juntarla a la vez; el resultado es el mismo
+            densa = self._densa = self.pool.tomar(self.filas)
+        return densa
+
+
+def detect_faces_in_image(file_stream, rostros_a_comparar, recognition_threshold, max_dim=MAX_DIMENSION_DEFECTO,
+                          detector=None, perfil=None):
+    """
+    Detecta y compara rostros en una imagen con rostros conocidos.
+
+    Args:
+        rostros_a_comparar: FaceGallery (p.ej. del cache de galerías) o lista
+            de rostros de Laravel
+    """
+    img, _ = decodificar_imagen(file_stream, max_dim)
+    uploaded_faces = _codificar(img, detector, perfil)
+
+    logging.info(f"{len(uploaded_faces)} rostro(s) detectado(s) en imagen recibida.")
+
+    gallery = (
+        rostros_a_comparar if isinstance(rostros_a_comparar, FaceGallery)
+        else FaceGallery.from_rostros(rostros_a_comparar)
+    )
+    rostros_detectados = gallery.match(uploaded_faces, recognition_threshold)
 
     logging.info(f"{len(rostros_detectados)} coincidencias encontradas.")
     return {"count": len(uploaded_faces), "faces": rostros_detectados}
+
+
+def identify_faces_in_image(file_stream, indice, recognition_threshold, k=3, nprobe=None,
+                            max_dim=MAX_DIMENSION_DEFECTO, detector=None, perfil=None):
+    """
+    Identifica los rostros de una imagen contra el índice institucional (FaceIndex).
+
+    Returns:
+        dict: {
+            "count": int,            // Rostros detectados en la imagen
+            "faces": [               // Un elemento por rostro detectado
+                {
+                    "id": 123 | None,    // Mejor coincidencia dentro del umbral
+                    "dist": float | None,
+                    "candidatos": [{"id": 123, "dist": 0.41}, ...]
+                }
+            ]
+        }
+    """
+    img, _ = decodificar_imagen(file_stream, max_dim)
+    uploaded_faces = _codificar(img, detector, perfil)
+
+    logging.info(f"{len(uploaded_faces)} rostro(s) detectado(s) para identificación.")
+
+    resultados = indice.search(uploaded_faces, k=k, nprobe=nprobe) if uploaded_faces else []
+
+    rostros = []
+    for vecinos in resultados:
+        candidatos = [
+            {"id": rostro_id, "dist": dist}
+            for rostro_id, dist in vecinos
+            if dist <= recognition_threshold
+        ]
+        mejor = candidatos[0] if candidatos else {"id": None, "dist": None}
+        rostros.append({"id": mejor["id"], "dist": mejor["dist"], "candidatos": candidatos})
+
+    identificados = sum(1 for r in rostros if r["id"] is not None)
+    logging.info(f"{identificados} rostro(s) identificado(s) en el índice.")
+    return {"count": len(uploaded_faces), "faces": rostros}
@@ -0,0 +1,256 @@
+"""
+Galerías de rostros compartidas entre procesos por memory-map.
+
+Con varios workers web cada proceso descargaba y guardaba su propia copia de
+las galerías de cada matrícula. Aquí un único proceso dueño (el supervisor)
+publica cada galería como una matriz float32 cruda en un directorio (por
+defecto /dev/shm, es decir, en memoria) y los workers la mapean de solo
+lectura: todos leen las mismas páginas y solo el dueño consulta a Laravel.
+
+Archivos:
+
+- galerias.json: índice {matricula: {"version", "filas", "dim", "ids"}};
+  se reemplaza completo con os.replace, que es el cambio atómico de versión
+- <matricula>.<version>.f32: matriz filas × dim de esa versión
+- <matricula>.verificado: archivo vacío cuyo mtime es la última vez que el
+  dueño publicó o revalidó la galería; revalidar sin cambios solo lo toca,
+  sin reescribir el índice (que lleva todos los ids)
+
+Un worker compara el inodo/mtime del índice en cada consulta (una llamada a
+stat) y solo lo relee si cambió; si la versión de una matrícula cambió,
+mapea el archivo nuevo y reemplaza su galería con una sola asignación. El
+dueño borra las versiones anteriores a la previa; quien todavía tenga una
+mapeada la sigue leyendo (el archivo se libera al desmapearlo).
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import logging
+import numpy as np
+
+from face_utils import FaceGallery
+
+
+def directorio_por_defecto():
+    """/dev/shm/galerias si existe /dev/shm (memoria), si no el directorio temporal."""
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm/galerias"
+    return os.path.join(tempfile.gettempdir(), "galerias")
+
+
+class SharedGalleryStore:
+    """
+    Índice de versiones + matrices memory-mapped de las galerías por matrícula.
+
+    - dueno: el proceso que publica (uno solo por despliegue); los demás
+      solo adjuntan
+    """
+
+    INDICE = "galerias.json"
+
+    def __init__(self, path, dueno=False, dim=128):
+        self.path = path
+        self.dueno = dueno
+        self.dim = dim
+        self.path_indice = os.path.join(path, self.INDICE)
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._indice = {}
+        self._firma_indice = None
+        self._adjuntas = {}  # matricula -> (version, FaceGallery)
+
+        # Estadísticas
+        self.publicaciones = 0
+        self.recargas_indice = 0
+        self.adjuntadas = 0
+
+        self._leer_indice()
+        if dueno:
+            self._limpiar_huerfanos()
+
+    # === Dueño ===
+
+    def publicar(self, matricula_id, galeria):
+        """Escribe una versión nueva de la galería y la confirma en el índice."""
+        clave = str(matricula_id)
+        matriz = np.ascontiguousarray(galeria.matrix, dtype=np.float32).reshape(len(galeria), self.dim)
+        with self._lock:
+            anterior = self._indice.get(clave, {}).get("version", 0)
+            version = anterior + 1
+            path_matriz = self._path_matriz(clave, version)
+            temporal = f"{path_matriz}.tmp"
+            with open(temporal, "wb") as f:
+                f.write(matriz.tobytes())
+            os.replace(temporal, path_matriz)
+
+            self._indice[clave] = {
+                "version": version,
+                "filas": len(matriz),
+                "dim": self.dim,
+                "ids": galeria.lista_ids(),
+            }
+            self._sellar(clave)
+            self._escribir_indice()
+            self.publicaciones += 1
+
+            # Se conserva la versión previa para quien leyó el índice justo antes
+            viejo = self._path_matriz(clave, anterior - 1)
+            if os.path.exists(viejo):
+                os.remove(viejo)
+
+        logging.info(
+            f"📤 DEPURACIÓN: Galería de matrícula {matricula_id} publicada (versión {version}, "
+            f"{len(matriz)} rostro(s), {matriz.nbytes / 1024:.1f} KB)"
+        )
+        return version
+
+    def verificar(self, matricula_id):
+        """Marca la galería publicada como vigente (se revalidó sin cambios)."""
+        clave = str(matricula_id)
+        with self._lock:
+            if clave not in self._indice:
+                return False
+            self._sellar(clave)
+            return True
+
+    def publicada(self, matricula_id):
+        """{"version", "filas", "verificado"} de una matrícula publicada (o None)."""
+        clave = str(matricula_id)
+        with self._lock:
+            entrada = self._indice.get(clave)
+            if entrada is None:
+                return None
+            return {"version": entrada["version"], "filas": entrada["filas"], "verificado": self._verificado(clave)}
+
+    # === Workers ===
+
+    def obtener(self, matricula_id, max_edad=None):
+        """
+        Galería publicada de una matrícula, mapeada de solo lectura.
+
+        Args:
+            max_edad: Segundos desde la última verificación del dueño a partir
+                de los cuales la galería se considera vencida
+
+        Returns:
+            FaceGallery o None si no está publicada o está vencida
+        """
+        clave = str(matricula_id)
+        self._leer_indice()
+        with self._lock:
+            entrada = self._indice.get(clave)
+            adjunta = self._adjuntas.get(clave)
+        if entrada is None:
+            return None
+        if max_edad is not None and time.time() - self._verificado(clave) > max_edad:
+            return None
+        if adjunta is not None and adjunta[0] == entrada["version"]:
+            return adjunta[1]
+
+        try:
+            galeria = self._mapear(clave, entrada)
+        except (OSError, ValueError) as e:
+            # El dueño publicó otra versión entre la lectura del índice y el mapeo
+            logging.warning(f"⚠️ DEPURACIÓN: No se pudo mapear la galería de matrícula {matricula_id}: {e}")
+            return adjunta[1] if adjunta is not None else None
+        with self._lock:
+            self._adjuntas[clave] = (entrada["version"], galeria)
+            self.adjuntadas += 1
+        return galeria
+
+    def stats(self):
+        """Galerías publicadas y adjuntas en este proceso."""
+        with self._lock:
+            publicadas = len(self._indice)
+            filas = sum(e["filas"] for e in self._indice.values())
+            adjuntas = len(self._adjuntas)
+        return {
+            "directorio": self.path,
+            "dueno": self.dueno,
+            "publicadas": publicadas,
+            "bytes": filas * self.dim * 4,
+            "adjuntas": adjuntas,
+            "publicaciones": self.publicaciones,
+            "adjuntadas": self.adjuntadas,
+            "recargas_indice": self.recargas_indice,
+        }
+
+    # === Internos ===
+
+    def _path_matriz(self, clave, version):
+        return os.path.join(self.path, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', clave)}.{version}.f32")
+
+    def _path_sello(self, clave):
+        return os.path.join(self.path, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', clave)}.verificado")
+
+    def _sellar(self, clave):
+        path_sello = self._path_sello(clave)
+        with open(path_sello, "a"):
+            pass
+        os.utime(path_sello)
+
+    def _verificado(self, clave):
+        """Momento de la última verificación (0 si nunca se verificó)."""
+        try:
+            return os.stat(self._path_sello(clave)).st_mtime
+        except FileNotFoundError:
+            return 0.0
+
+    def _mapear(self, clave, entrada):
+        filas, dim = entrada["filas"], entrada["dim"]
+        if filas == 0:
+            matriz = np.empty((0, dim), dtype=np.float32)
+        else:
+            matriz = np.memmap(self._path_matriz(clave, entrada["version"]), dtype=np.float32, mode="r",
+                               shape=(filas, dim))
+        return FaceGallery(entrada["ids"], matriz)
+
+    def _leer_indice(self):
+        """Relee el índice si otro proceso lo reemplazó."""
+        try:
+            stat = os.stat(self.path_indice)
+        except FileNotFoundError:
+            return
+        firma = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if firma == self._firma_indice:
+            return
+        try:
+            with open(self.path_indice) as f:
+                indice = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"⚠️ DEPURACIÓN: Índice de galerías compartidas ilegible: {e}")
+            return
+        with self._lock:
+            self._indice = indice
+            self._firma_indice = firma
+            # Las galerías retiradas del índice dejan de estar adjuntas
+            for clave in [c for c in self._adjuntas if c not in indice]:
+                del self._adjuntas[clave]
+            self.recargas_indice += 1
+
+    def _escribir_indice(self):
+        temporal = f"{self.path_indice}.{os.getpid()}.tmp"
+        with open(temporal, "w") as f:
+            json.dump(self._indice, f)
+        os.replace(temporal, self.path_indice)
+        stat = os.stat(self.path_indice)
+        self._firma_indice = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _limpiar_huerfanos(self):
+        """Borra matrices que el índice ya no referencia (p.ej. tras un reinicio)."""
+        vigentes = set()
+        for clave, entrada in self._indice.items():
+            vigentes.add(os.path.basename(self._path_sello(clave)))
+            vigentes.add(os.path.basename(self._path_matriz(clave, entrada["version"])))
+            vigentes.add(os.path.basename(self._path_matriz(clave, entrada["version"] - 1)))
+        for archivo in os.listdir(self.path):
+            if archivo.endswith((".f32", ".verificado", ".tmp")) and archivo not in vigentes:
+                try:
+                    os.remove(os.path.join(self.path, archivo))
+                except OSError:
+                    pass
@@ -0,0 +1,94 @@
+"""
+Configuración de producción con gunicorn.
+
+    gunicorn -c gunicorn.conf.py
+
+- Los endpoints de imágenes ("/", "/identificar", "/encoding", "/detect",
+  "/faces") los atienden WEB_WORKERS procesos (por defecto uno por núcleo).
+  Con preload_app, main.py (y los modelos de dlib) se cargan una sola vez en
+  el master antes del fork y los workers los comparten copy-on-write.
+- Los streams, la sincronización con Laravel y el envío de asistencias
+  corren en un único proceso supervisor (SERVICE_ROLE=supervisor) que este
+  archivo lanza al arrancar, relanza si muere (con espera creciente si
+  muere apenas arranca) y detiene al salir. Los workers le reenvían
+  /salones y /sistema.
+- Las galerías por matrícula las descarga solo el supervisor y las publica
+  en SHARED_GALLERY_DIR (/dev/shm); los workers las mapean de solo lectura,
+  así la memoria no crece con WEB_WORKERS (ver gallery_store.py).
+"""
+
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Debe definirse antes de que preload_app importe main.py
+os.environ.setdefault("SERVICE_ROLE", "web")
+
+wsgi_app = "main:app"
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("WEB_WORKERS", "0")) or multiprocessing.cpu_count()
+preload_app = True
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+keepalive = 5
+
+# Vigilancia del supervisor: cada cuánto se revisa y la espera entre relanzamientos
+VIGILANCIA_INTERVALO = 5.0
+RELANZAR_ESPERA_MAX = 60.0
+
+_supervisor = None
+_apagando = threading.Event()
+_lock = threading.Lock()  # Un relanzamiento no se cruza con on_exit
+
+
+def _lanzar_supervisor(server):
+    global _supervisor
+    entorno = dict(os.environ, SERVICE_ROLE="supervisor")
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    _supervisor = subprocess.Popen([sys.executable, main_py], env=entorno)
+    server.log.info(f"Supervisor de salones iniciado (pid {_supervisor.pid})")
+
+
+def _vigilar_supervisor(server):
+    """Relanza el supervisor si termina; si muere apenas arranca, espera cada vez más."""
+    espera = VIGILANCIA_INTERVALO
+    iniciado = time.monotonic()
+    while not _apagando.wait(VIGILANCIA_INTERVALO):
+        codigo = _supervisor.poll()
+        if codigo is None:
+            continue
+        if time.monotonic() - iniciado > RELANZAR_ESPERA_MAX:
+            espera = VIGILANCIA_INTERVALO
+        server.log.error(f"Supervisor de salones terminó (código {codigo}); se relanza en {espera:g}s")
+        if _apagando.wait(espera):
+            return
+        with _lock:
+            if _apagando.is_set():
+                return
+            _lanzar_supervisor(server)
+        iniciado = time.monotonic()
+        espera = min(espera * 2, RELANZAR_ESPERA_MAX)
+
+
+def on_starting(server):
+    """Lanza el proceso supervisor de salones (uno solo por despliegue) y lo vigila."""
+    if os.getenv("START_SUPERVISOR", "1").strip().lower() not in ("1", "true", "yes", "on"):
+        server.log.info("Supervisor de salones externo (START_SUPERVISOR=0)")
+        return
+    _lanzar_supervisor(server)
+    threading.Thread(target=_vigilar_supervisor, args=(server,), daemon=True).start()
+
+
+def on_exit(server):
+    """Detiene el supervisor junto con gunicorn."""
+    with _lock:
+        _apagando.set()
+    if _supervisor is None or _supervisor.poll() is not None:
+        return
+    _supervisor.terminate()
+    try:
+        _supervisor.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        _supervisor.kill()
@@ -0,0 +1,148 @@
+"""
+Laravel simulado en memoria para las pruebas.
+
+Imita /api/biometricos/matricula/{id} con rostros versionados, bajas
+registradas, ETag/If-None-Match, updated_since y, opcionalmente, el formato
+binario de laravel_utils. Sirve los mismos rostros para cualquier matrícula.
+GET /api/camaras/activas devuelve `camaras`. POST
+/api/asistencias/registro-masivo responde `estado_asistencias` y guarda los
+cuerpos recibidos; un cuerpo que no tiene la forma que valida Laravel
+({"matricula_id", "rostros_detectados": [{"id", "dist"}], "captura"}) se
+rechaza con 422.
+"""
+
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from laravel_utils import codificar_rostros_binarios
+
+
+class LaravelSimulado:
+    """Laravel mínimo en memoria: rostros versionados y bajas registradas."""
+
+    def __init__(self, rostros=50, etag=True, cursor=True, binario=False):
+        self.usar_etag = etag
+        self.usar_cursor = cursor
+        self.binario = binario
+        self.version = 1
+        self.rostros = {
+            i: {"id": i, "encoding": [round(0.001 * i + 0.01 * d, 4) for d in range(128)], "version": 1}
+            for i in range(1, rostros + 1)
+        }
+        self.eliminados = {}  # id -> version de la baja
+        self.bytes_enviados = 0
+        self.peticiones = 0
+        self.estado_asistencias = 200
+        self.asistencias = []
+        self.camaras = []
+
+        simulado = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                simulado.atender(self)
+
+            def do_POST(self):
+                simulado.registrar_asistencias(self)
+
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.servidor.server_port}"
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+
+    def detener(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+    # === Cambios en la "base de datos" ===
+
+    def modificar(self, rostro_id):
+        self.version += 1
+        rostro = self.rostros[rostro_id]
+        rostro["encoding"] = [v + 0.5 for v in rostro["encoding"]]
+        rostro["version"] = self.version
+
+    def agregar(self, rostro_id):
+        self.version += 1
+        self.rostros[rostro_id] = {"id": rostro_id, "encoding": [0.2] * 128, "version": self.version}
+
+    def eliminar(self, rostro_id):
+        self.version += 1
+        del self.rostros[rostro_id]
+        self.eliminados[rostro_id] = self.version
+
+    # === HTTP ===
+
+    def registrar_asistencias(self, handler):
+        largo = int(handler.headers.get("Content-Length") or 0)
+        datos = json.loads(handler.rfile.read(largo))
+        self.asistencias.append(datos)
+        estado = self.estado_asistencias if self._registro_valido(datos) else 422
+        cuerpo = json.dumps({"success": estado < 400}).encode()
+        handler.send_response(estado)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(cuerpo)))
+        handler.end_headers()
+        handler.wfile.write(cuerpo)
+
+    @staticmethod
+    def _registro_valido(datos):
+        rostros = datos.get("rostros_detectados")
+        return (
+            set(datos) == {"matricula_id", "rostros_detectados", "captura"}
+            and isinstance(datos["captura"], str)
+            and isinstance(rostros, list)
+            and all(isinstance(r, dict) and set(r) == {"id", "dist"} for r in rostros)
+        )
+
+    def atender(self, handler):
+        if urlparse(handler.path).path == "/api/camaras/activas":
+            cuerpo = json.dumps({"success": True, "data": self.camaras}).encode()
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(cuerpo)))
+            handler.end_headers()
+            handler.wfile.write(cuerpo)
+            return
+        self.peticiones += 1
+        etag = f'"v{self.version}"'
+        if self.usar_etag and handler.headers.get("If-None-Match") == etag:
+            handler.send_response(304)
+            handler.send_header("ETag", etag)
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+
+        desde = parse_qs(urlparse(handler.path).query).get("updated_since")
+        if self.usar_cursor and desde:
+            desde = int(desde[0])
+            data = {
+                "delta": True,
+                "rostros": [r for r in self.rostros.values() if r["version"] > desde],
+                "eliminados": [i for i, v in self.eliminados.items() if v > desde],
+            }
+        else:
+            data = {"rostros": list(self.rostros.values())}
+        if self.usar_cursor:
+            data["cursor"] = str(self.version)
+
+        tipo = "application/json"
+        if self.binario and "application/octet-stream" in handler.headers.get("Accept", ""):
+            tipo = "application/octet-stream"
+            cuerpo = codificar_rostros_binarios(data.pop("rostros"), **data)
+        else:
+            cuerpo = json.dumps(data).encode()
+        self.bytes_enviados += len(cuerpo)
+        handler.send_response(200)
+        handler.send_header("Content-Type", tipo)
+        handler.send_header("Content-Length", str(len(cuerpo)))
+        if self.usar_etag:
+            handler.send_header("ETag", etag)
+        handler.end_headers()
+        handler.wfile.write(cuerpo)
@@ -1,20 +1,267 @@
 """
 Utilidades para comunicación con Laravel API.
+
+Formato binario de rostros
+--------------------------
+GET /api/biometricos/matricula/{id} se pide con
+"Accept: application/octet-stream, application/json;q=0.9". Si Laravel
+responde Content-Type application/octet-stream, el cuerpo es:
+
+    [uint32 LE: largo del encabezado][encabezado JSON][n × dim float32 LE]
+
+con el encabezado {"ids": [...], "dim": 128, "delta", "eliminados",
+"cursor"} (mismos campos que la respuesta JSON, sin los encodings) y una
+fila de la matriz por id, en el mismo orden. El encabezado se rellena con
+espacios hasta que la matriz empiece en un múltiplo de 4 bytes. Desde PHP:
+
+    $meta = json_encode([...]);
+    $meta .= str_repeat(' ', (4 - strlen($meta) % 4) % 4);
+    echo pack('V', strlen($meta)) . $meta . pack('g*', ...$floats);
+
+Los rostros sin encoding no viajan en la matriz (en un delta se informan
+en "eliminados"). Cualquier otra respuesta se interpreta como JSON.
 """
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+import numpy as np
 import requests
 import logging
+from requests.adapters import HTTPAdapter
+
+
+class LaravelClient:
+    """
+    Cliente HTTP compartido para Laravel con conexiones keep-alive.
+
+    Una sola `requests.Session` con un pool de conexiones por host evita abrir
+    un socket (y un handshake TLS) en cada llamada. Los GET, que son
+    idempotentes, se reintentan con backoff exponencial con jitter ante
+    errores de red o respuestas 429/5xx; los POST no se reintentan aquí.
+
+    - pool_size: conexiones reutilizables por host (≈ número de salones)
+    - timeout: (conexión, lectura) por defecto de cada llamada
+    - reintentos: reintentos adicionales de un GET
+    - plazo: segundos totales que puede durar un GET con sus reintentos; un
+      POST / que descarga una galería espera a lo sumo esto a Laravel
+    """
+
+    ESTADOS_REINTENTABLES = (429, 502, 503, 504)
+
+    def __init__(self, pool_size=10, timeout=(3.05, 10), reintentos=3, backoff_base=0.5, backoff_max=8.0,
+                 rostros_binarios=True, plazo=15.0):
+        self.timeout = timeout
+        # Pedir los rostros en formato binario (ver el docstring del módulo)
+        self.rostros_binarios = rostros_binarios
+        self.reintentos = reintentos
+        self.plazo = plazo
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = 0
+
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+        })
+        self.ajustar_pool(pool_size)
+
+        # Estadísticas
+        self.peticiones = 0
+        self.reintentos_realizados = 0
+        self.errores = 0
+
+    def ajustar_pool(self, pool_size):
+        """Agranda el pool de conexiones si hacen falta más (no lo achica)."""
+        with self._lock:
+            if pool_size <= self.pool_size:
+                return
+            self.pool_size = pool_size
+            anterior = self.session.adapters.get("http://")
+            adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            self.session.mount("http://", adaptador)
+            self.session.mount("https://", adaptador)
+            if anterior is not None:
+                # Las conexiones en uso se cierran al devolverse; las ociosas, ya
+                anterior.close()
+        logging.info(f"🔌 DEPURACIÓN: Pool HTTP de Laravel con {pool_size} conexión(es) por host")
+
+    def get(self, url, timeout=None, plazo=None, **kwargs):
+        """
+        GET con reintentos (backoff exponencial con jitter completo).
+
+        Ningún intento ni espera se extiende más allá de `plazo` segundos
+        desde la llamada (por defecto self.plazo; None en ambos = sin límite).
+        """
+        timeout = timeout or self.timeout
+        conexion, lectura = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        plazo = plazo or self.plazo
+        limite = time.monotonic() + plazo if plazo else None
+        intento = 0
+        while True:
+            self.peticiones += 1
+            if limite is not None:
+                restante = max(limite - time.monotonic(), 0.1)
+                timeout = (min(conexion, restante), min(lectura, restante))
+            try:
+                response = self.session.get(url, timeout=timeout, **kwargs)
+                if response.status_code not in self.ESTADOS_REINTENTABLES or intento >= self.reintentos:
+                    return response
+                motivo = f"HTTP {response.status_code}"
+                error = None
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if intento >= self.reintentos:
+                    self.errores += 1
+                    raise
+                motivo = type(e).__name__
+                error = e
+
+            espera = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** intento))
+            if limite is not None and time.monotonic() + espera + 0.5 >= limite:
+                # Sin tiempo para otro intento útil: se entrega el último resultado
+                logging.warning(f"⚠️ DEPURACIÓN: GET {url} falló ({motivo}); plazo de {plazo:g}s agotado")
+                if error is not None:
+                    self.errores += 1
+                    raise error
+                return response
+            intento += 1
+            self.reintentos_realizados += 1
+            logging.warning(
+                f"⚠️ DEPURACIÓN: GET {url} falló ({motivo}); reintento {intento}/{self.reintentos} en {espera:.2f}s"
+            )
+            time.sleep(espera)
+
+    def post(self, url, timeout=None, **kwargs):
+        """POST sin reintentos (no es idempotente)."""
+        self.peticiones += 1
+        try:
+            return self.session.post(url, timeout=timeout or self.timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            self.errores += 1
+            raise
+
+    def cerrar(self):
+        """Cierra las conexiones del pool."""
+        self.session.close()
+
+    def stats(self):
+        """Estadísticas de uso del cliente y del pool de conexiones."""
+        conexiones = 0
+        pools = self.session.get_adapter("http://").poolmanager.pools
+        for clave in pools.keys():
+            pool = pools.get(clave)
+            conexiones += pool.num_connections if pool is not None else 0
+        return {
+            "pool_size": self.pool_size,
+            "peticiones": self.peticiones,
+            "reintentos": self.reintentos_realizados,
+            "errores": self.errores,
+            "conexiones_abiertas": conexiones,
+        }
+
 
-def get_faces_from_laravel(matricula_id, laravel_api_url):
+_cliente = None
+_cliente_lock = threading.Lock()
+
+
+def obtener_cliente(pool_size=None):
+    """
+    Retorna el cliente Laravel compartido del proceso (lo crea si no existe).
+
+    Args:
+        pool_size: Si se indica, el pool se agranda al menos hasta ese tamaño
+    """
+    global _cliente
+    with _cliente_lock:
+        if _cliente is None:
+            _cliente = LaravelClient(pool_size=pool_size or 10)
+            return _cliente
+    if pool_size:
+        _cliente.ajustar_pool(pool_size)
+    return _cliente
+
+
+ACCEPT_BINARIO = "application/octet-stream, application/json;q=0.9"
+
+
+def _cabeceras_rostros(cliente):
+    """Cabecera Accept para pedir los rostros (binario si el cliente lo prefiere)."""
+    return {"Accept": ACCEPT_BINARIO} if getattr(cliente, "rostros_binarios", False) else {}
+
+
+def _es_binaria(response):
+    return response.headers.get("Content-Type", "").split(";")[0].strip() == "application/octet-stream"
+
+
+def codificar_rostros_binarios(rostros, **encabezado):
+    """
+    Cuerpo binario de una lista de rostros (lo que debe producir Laravel;
+    se usa en las pruebas y el benchmark). Los rostros sin encoding se omiten.
+    """
+    rostros = [r for r in rostros if r.get("encoding") is not None]
+    if rostros:
+        matriz = np.asarray([r["encoding"] for r in rostros], dtype="<f4").reshape(len(rostros), -1)
+    else:
+        # Un delta con solo bajas: sin filas
+        matriz = np.empty((0, 128), dtype="<f4")
+    meta = json.dumps(dict(encabezado, ids=[r["id"] for r in rostros], dim=matriz.shape[1])).encode()
+    meta += b" " * (-len(meta) % 4)
+    return struct.pack("<I", len(meta)) + meta + matriz.tobytes()
+
+
+def decodificar_rostros_binarios(cuerpo):
+    """
+    Interpreta un cuerpo binario de rostros sin crear un float de Python por
+    componente: la matriz es una vista float32 sobre los bytes recibidos.
+
+    Returns:
+        dict: el encabezado más "ids" y "matriz" (n × dim, float32); "rostros"
+        es una lista de {"id", "encoding"} donde cada encoding es una fila
+        (vista) de la matriz
+    """
+    if len(cuerpo) < 4:
+        raise ValueError("Respuesta binaria de rostros truncada")
+    (largo,) = struct.unpack_from("<I", cuerpo)
+    data = json.loads(cuerpo[4:4 + largo])
+    ids = data.get("ids", [])
+    dim = int(data.get("dim", 128))
+    inicio = 4 + largo
+    if len(cuerpo) - inicio != len(ids) * dim * 4:
+        raise ValueError(f"Respuesta binaria de rostros inválida: {len(ids)} id(s) × {dim} y "
+                         f"{len(cuerpo) - inicio} bytes de matriz")
+
+    matriz = np.frombuffer(cuerpo, dtype="<f4", offset=inicio).reshape(len(ids), dim)
+    if not matriz.flags.aligned or matriz.dtype != np.float32:
+        # Encabezado sin relleno o máquina big-endian: una sola copia
+        matriz = matriz.astype(np.float32)
+    data["matriz"] = matriz
+    data["rostros"] = [{"id": rostro_id, "encoding": fila} for rostro_id, fila in zip(ids, matriz)]
+    return data
+
+
+def _leer_rostros(response):
+    """Cuerpo de una respuesta de rostros, binaria o JSON, como diccionario."""
+    if _es_binaria(response):
+        return decodificar_rostros_binarios(response.content)
+    return response.json()
+
+
+def get_faces_from_laravel(matricula_id, laravel_api_url, cliente=None):
     """Obtiene los rostros registrados para una matrícula desde Laravel."""
     url = f"{laravel_api_url}/api/biometricos/matricula/{matricula_id}"
     logging.info(f"🔍 DEPURACIÓN: Solicitando rostros para matrícula ID {matricula_id}")
     logging.info(f"🌐 DEPURACIÓN: URL consulta: {url}")
     
     try:
-        response = requests.get(url, timeout=10)
+        cliente = cliente or obtener_cliente()
+        response = cliente.get(url, headers=_cabeceras_rostros(cliente))
         response.raise_for_status()
         
-        data = response.json()
+        data = _leer_rostros(response)
         rostros = data.get("rostros", [])
         
         # ✅ LOG DETALLADO DE ROSTROS OBTENIDOS
@@ -42,8 +289,224 @@ def get_faces_from_laravel(matricula_id, laravel_api_url):
         logging.error(f"❌ DEPURACIÓN: ERROR INESPERADO obteniendo rostros: {str(e)}")
         return []
 
-def reportar_asistencias(matricula_id, rostros_detectados, timestamp, laravel_api_url):
-    """Reporta las asistencias detectadas a Laravel."""
+def get_faces_delta_from_laravel(matricula_id, laravel_api_url, etag=None, cursor=None, huella=None, cliente=None):
+    """
+    Consulta condicional/incremental de los rostros de una matrícula.
+
+    - etag: se envía como If-None-Match; Laravel responde 304 si nada cambió
+    - cursor: se envía como updated_since; Laravel puede responder solo los
+      rostros modificados desde entonces ("delta": true) y los ids eliminados
+    - huella: sha1 del último cuerpo recibido; si el cuerpo es idéntico no se
+      vuelve a parsear (para servidores sin ETag)
+
+    Returns:
+        dict: {"estado": "sin_cambios" | "delta" | "completo", "rostros",
+               "eliminados", "etag", "cursor", "huella", "bytes"}; si la
+               respuesta fue binaria incluye además "ids" y "matriz"
+        None: si hubo un error de red o de formato
+    """
+    url = f"{laravel_api_url}/api/biometricos/matricula/{matricula_id}"
+    cliente = cliente or obtener_cliente()
+    headers = _cabeceras_rostros(cliente)
+    if etag:
+        headers["If-None-Match"] = etag
+    params = {"updated_since": cursor} if cursor else None
+
+    try:
+        response = cliente.get(url, headers=headers, params=params)
+        if response.status_code == 304:
+            return {"estado": "sin_cambios", "rostros": [], "eliminados": [], "etag": etag,
+                    "cursor": cursor, "huella": huella, "bytes": 0}
+        response.raise_for_status()
+
+        cuerpo = response.content
+        recibidos = int(response.headers.get("Content-Length") or len(cuerpo))
+        nueva_huella = hashlib.sha1(cuerpo).hexdigest()
+        nuevo_etag = response.headers.get("ETag")
+        if nueva_huella == huella:
+            return {"estado": "sin_cambios", "rostros": [], "eliminados": [], "etag": nuevo_etag or etag,
+                    "cursor": cursor, "huella": huella, "bytes": recibidos}
+
+        data = _leer_rostros(response)
+        resultado = {
+            "estado": "delta" if cursor and data.get("delta") else "completo",
+            "rostros": data.get("rostros", []),
+            "eliminados": data.get("eliminados", []),
+            "etag": nuevo_etag,
+            "cursor": data.get("cursor"),
+            "huella": nueva_huella,
+            "bytes": recibidos,
+        }
+        if "matriz" in data:
+            resultado["ids"] = data["ids"]
+            resultado["matriz"] = data["matriz"]
+        return resultado
+
+    except Exception as e:
+        logging.error(f"❌ DEPURACIÓN: Error en consulta incremental de rostros para matrícula {matricula_id}: {str(e)}")
+        return None
+
+
+class SincronizadorRostros:
+    """
+    Refresco incremental de las galerías de rostros por matrícula.
+
+    Recuerda por matrícula el ETag, el cursor updated_since y la huella del
+    último cuerpo, y aplica sobre la lista anterior solo los rostros
+    agregados, modificados o eliminados. Si nada cambió retorna la misma
+    lista (mismo objeto), así quien la tenga procesada puede reutilizarla.
+
+    En lugar de una lista puede recibir una galería compacta (p.ej.
+    face_utils.FaceGallery) que ofrezca posiciones(), cambiados_en() y
+    aplicar_cambios(); entonces los cambios se aplican sobre la galería.
+    Con galeria_vacia (función que crea una galería vacía) también la
+    primera descarga retorna una galería; si la respuesta es binaria, la
+    galería se construye directamente sobre la matriz recibida.
+    """
+
+    def __init__(self, laravel_api_url, cliente=None, galeria_vacia=None):
+        self.laravel_api_url = laravel_api_url
+        self.cliente = cliente
+        self.galeria_vacia = galeria_vacia
+        self._lock = threading.Lock()
+        self._estado = {}  # matricula_id -> {"etag", "cursor", "huella"}
+
+        # Estadísticas
+        self.consultas = 0
+        self.sin_cambios = 0
+        self.deltas = 0
+        self.completas = 0
+        self.errores = 0
+        self.bytes_recibidos = 0
+
+    def sincronizar(self, matricula_id, anteriores=None):
+        """
+        Actualiza la lista de rostros de una matrícula.
+
+        Args:
+            anteriores: Lista vigente de rostros o galería compacta (None =
+                descarga completa)
+
+        Returns:
+            tuple: (rostros, cambiados, eliminados) donde cambiados son los
+            rostros nuevos o modificados y eliminados sus ids; rostros es del
+            mismo tipo que anteriores (una lista si anteriores es None)
+        """
+        clave = str(matricula_id)
+        with self._lock:
+            estado = dict(self._estado.get(clave, {})) if anteriores is not None else {}
+        if anteriores is None and self.galeria_vacia is not None:
+            anteriores = self.galeria_vacia()
+
+        respuesta = get_faces_delta_from_laravel(
+            matricula_id, self.laravel_api_url,
+            etag=estado.get("etag"), cursor=estado.get("cursor"), huella=estado.get("huella"),
+            cliente=self.cliente,
+        )
+        self.consultas += 1
+        if respuesta is None:
+            self.errores += 1
+            # Ante un error se conserva la galería anterior
+            return (anteriores if anteriores is not None else []), [], []
+
+        self.bytes_recibidos += respuesta["bytes"]
+        with self._lock:
+            self._estado[clave] = {k: respuesta[k] for k in ("etag", "cursor", "huella")}
+
+        if respuesta["estado"] == "sin_cambios":
+            self.sin_cambios += 1
+            logging.info(f"✅ DEPURACIÓN: Rostros de matrícula {matricula_id} sin cambios ({respuesta['bytes']} bytes)")
+            return anteriores, [], []
+
+        if anteriores is not None and not isinstance(anteriores, list):
+            return self._aplicar_a_galeria(matricula_id, anteriores, respuesta)
+
+        previos = {r.get("id"): r for r in (anteriores or [])}
+        if respuesta["estado"] == "delta":
+            self.deltas += 1
+            cambiados = respuesta["rostros"]
+            eliminados = [i for i in respuesta["eliminados"] if i in previos]
+            actuales = dict(previos)
+            for rostro_id in eliminados:
+                del actuales[rostro_id]
+            for rostro in cambiados:
+                actuales[rostro.get("id")] = rostro
+        else:
+            self.completas += 1
+            actuales = {r.get("id"): r for r in respuesta["rostros"]}
+            cambiados = [
+                r for rostro_id, r in actuales.items()
+                if rostro_id not in previos or not np.array_equal(previos[rostro_id].get("encoding"), r.get("encoding"))
+            ]
+            eliminados = [rostro_id for rostro_id in previos if rostro_id not in actuales]
+
+        logging.info(
+            f"🔄 DEPURACIÓN: Rostros de matrícula {matricula_id} ({respuesta['estado']}): "
+            f"{len(cambiados)} nuevo(s)/modificado(s), {len(eliminados)} eliminado(s), "
+            f"{len(actuales)} en total ({respuesta['bytes']} bytes)"
+        )
+        if not cambiados and not eliminados and anteriores is not None:
+            return anteriores, [], []
+        return list(actuales.values()), cambiados, eliminados
+
+    def _aplicar_a_galeria(self, matricula_id, galeria, respuesta):
+        """Calcula y aplica los cambios de una respuesta sobre una galería compacta."""
+        posiciones = galeria.posiciones()
+        if respuesta["estado"] == "delta":
+            self.deltas += 1
+            cambiados = respuesta["rostros"]
+            eliminados = [i for i in respuesta["eliminados"] if i in posiciones]
+        else:
+            self.completas += 1
+            actuales = {r.get("id") for r in respuesta["rostros"]}
+            cambiados = galeria.cambiados_en(respuesta["rostros"], posiciones) if posiciones else respuesta["rostros"]
+            eliminados = [rostro_id for rostro_id in posiciones if rostro_id not in actuales]
+
+        if not cambiados and not eliminados:
+            logging.info(f"✅ DEPURACIÓN: Rostros de matrícula {matricula_id} sin cambios ({respuesta['bytes']} bytes)")
+            return galeria, [], []
+        if respuesta["estado"] == "completo" and "matriz" in respuesta:
+            # La matriz recibida ya es la galería completa: se usa sin copiarla
+            nueva = type(galeria)(respuesta["ids"], respuesta["matriz"])
+        else:
+            nueva = galeria.aplicar_cambios(cambiados, eliminados)
+        logging.info(
+            f"🔄 DEPURACIÓN: Rostros de matrícula {matricula_id} ({respuesta['estado']}): "
+            f"{len(cambiados)} nuevo(s)/modificado(s), {len(eliminados)} eliminado(s), "
+            f"{len(nueva)} en total ({respuesta['bytes']} bytes)"
+        )
+        return nueva, cambiados, eliminados
+
+    def olvidar(self, matricula_id):
+        """Descarta el estado de sincronización de una matrícula."""
+        with self._lock:
+            self._estado.pop(str(matricula_id), None)
+
+    def stats(self):
+        """Estadísticas del refresco incremental."""
+        return {
+            "consultas": self.consultas,
+            "sin_cambios": self.sin_cambios,
+            "deltas": self.deltas,
+            "completas": self.completas,
+            "errores": self.errores,
+            "bytes_recibidos": self.bytes_recibidos,
+        }
+
+
+# Respuestas 4xx que sí pueden resolverse reintentando
+ESTADOS_4XX_TRANSITORIOS = (408, 409, 423, 425, 429)
+
+
+def reportar_asistencias(matricula_id, rostros_detectados, timestamp, laravel_api_url, timeout=10, cliente=None):
+    """
+    Reporta las asistencias detectadas a Laravel.
+
+    Returns:
+        True: Laravel registró las asistencias
+        False: Error transitorio (red, timeout, 5xx, 429...); puede reintentarse
+        None: Laravel rechazó el registro (4xx); reintentarlo no sirve
+    """
     url = f"{laravel_api_url}/api/asistencias/registro-masivo"
     data = {
         "matricula_id": matricula_id,
@@ -52,7 +515,12 @@ def reportar_asistencias(matricula_id, rostros_detectados, timestamp, laravel_ap
     }
     logging.info(f"Enviando asistencias detectadas: {data}")
     try:
-        response = requests.post(url, json=data)
+        response = (cliente or obtener_cliente()).post(url, json=data, timeout=timeout)
+        if 400 <= response.status_code < 500 and response.status_code not in ESTADOS_4XX_TRANSITORIOS:
+            logging.error(
+                f"❌ Laravel rechazó las asistencias (HTTP {response.status_code}): {response.text[:200]}"
+            )
+            return None
         response.raise_for_status()
         logging.info("✔ Asistencias registradas correctamente.")
         return True
@@ -61,14 +529,20 @@ def reportar_asistencias(matricula_id, rostros_detectados, timestamp, laravel_ap
         return False
 
 
-def get_camaras_activas(laravel_api_url):
-    """Obtiene la lista de cámaras activas desde Laravel."""
+def get_camaras_activas(laravel_api_url, cliente=None):
+    """
+    Obtiene la lista de cámaras activas desde Laravel.
+
+    Returns:
+        list: Cámaras activas ([] si Laravel confirma que no hay ninguna)
+        None: Si no se pudo consultar (el llamador no debe tocar sus salones)
+    """
     url = f"{laravel_api_url}/api/camaras/activas"
     logging.info("🔍 DEPURACIÓN: Consultando cámaras activas desde Laravel")
     logging.info(f"🌐 DEPURACIÓN: URL consulta: {url}")
     
     try:
-        response = requests.get(url, timeout=10)
+        response = (cliente or obtener_cliente()).get(url)
         response.raise_for_status()
         
         data = response.json()
@@ -92,14 +566,14 @@ def get_camaras_activas(laravel_api_url):
             return camaras
         else:
             logging.error("❌ DEPURACIÓN: Respuesta de Laravel indica fallo")
-            return []
+            return None
             
     except requests.exceptions.Timeout:
         logging.error("❌ DEPURACIÓN: TIMEOUT obteniendo cámaras activas desde Laravel")
-        return []
+        return None
     except requests.exceptions.ConnectionError:
         logging.error("❌ DEPURACIÓN: ERROR DE CONEXIÓN obteniendo cámaras activas desde Laravel")
-        return []
+        return None
     except Exception as e:
         logging.error(f"❌ DEPURACIÓN: ERROR INESPERADO obteniendo cámaras activas: {str(e)}")
-        return []
+        return None
@@ -1,6 +1,13 @@
 import os
+import sys
+import json
+import signal
+import atexit
+import hashlib
+import threading
 from datetime import datetime
-from flask import Flask, jsonify, request
+import requests
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 from werkzeug.exceptions import BadRequest
 from dotenv import load_dotenv
@@ -13,16 +20,27 @@ from face_utils import (
     get_faces_dict, 
     extract_image, 
     detect_faces_only, 
-    detect_faces_in_image
+    detect_faces_in_image,
+    ImagenNoProcesable,
+    identify_faces_in_image,
+    obtener_perfil,
+    obtener_pool
 )
 from laravel_utils import (
     get_faces_from_laravel, 
-    reportar_asistencias
+    reportar_asistencias,
+    obtener_cliente
 )
 from stream_utils import (
     start_stream_processing
 )
-from salon_manager import SalonManager
+from face_detectors import obtener_detector
+from salon_manager import SalonManager, crear_cache_galerias, extraer_opciones_camara
+from cache_utils import LRUCache
+from face_index import FaceIndex
+from encoding_store import EncodingStore
+from gallery_store import SharedGalleryStore, directorio_por_defecto
+from asistencia_outbox import AsistenciaOutbox
 
 # === Configuración inicial ===
 
@@ -32,7 +50,56 @@ load_dotenv()
 LARAVEL_API_URL = os.getenv("LARAVEL_API_URL", "http://localhost:8000")
 RECOGNITION_THRESHOLD = float(os.getenv("MATCH_TOLERANCE", "0.6"))
 LOG_FILE_PATH = os.getenv("LOG_FILE", "reconocimiento.log")
+IMAGE_MAX_DIM = int(os.getenv("IMAGE_MAX_DIM", "1600"))
+FACE_DETECTOR = os.getenv("FACE_DETECTOR", "hog")
+STREAM_FACE_DETECTOR = os.getenv("STREAM_FACE_DETECTOR", FACE_DETECTOR)
+RECOGNITION_ENCODING_PROFILE = os.getenv("RECOGNITION_ENCODING_PROFILE", "rapido")
+ENROL_ENCODING_PROFILE = os.getenv("ENROL_ENCODING_PROFILE", "rapido")
+STREAM_ENCODING_PROFILE = os.getenv("STREAM_ENCODING_PROFILE", "rapido")
+IMAGE_CACHE_TTL = int(os.getenv("IMAGE_CACHE_TTL", "600"))
+IMAGE_CACHE_ENTRIES = int(os.getenv("IMAGE_CACHE_ENTRIES", "1024"))
 STREAM_URL = os.getenv("STREAM_URL", "http://<direccion_ip>:81/stream")
+GALLERY_CACHE_TTL = int(os.getenv("GALLERY_CACHE_TTL", "1800"))
+GALLERY_CACHE_MAX_MB = int(os.getenv("GALLERY_CACHE_MAX_MB", "256"))
+GALLERY_REFRESH_INTERVAL = float(os.getenv("GALLERY_REFRESH_INTERVAL", "300"))
+STREAM_DETECTION_INTERVAL = float(os.getenv("STREAM_DETECTION_INTERVAL", "1.0"))
+STREAM_CAPTURE_MODE = os.getenv("STREAM_CAPTURE_MODE", "stream").strip().lower()
+STREAM_SNAPSHOT_INTERVAL = float(os.getenv("STREAM_SNAPSHOT_INTERVAL", "1.0"))
+DETECTION_WORKERS = int(os.getenv("DETECTION_WORKERS", "0")) or None
+MOTION_THRESHOLD = float(os.getenv("MOTION_THRESHOLD", "0.01"))
+MOTION_PIXEL_THRESHOLD = int(os.getenv("MOTION_PIXEL_THRESHOLD", "25"))
+STREAM_RECOGNITION = os.getenv("STREAM_RECOGNITION", "1").strip().lower() in ("1", "true", "yes", "on")
+STREAM_CPU_BUDGET = float(os.getenv("STREAM_CPU_BUDGET", "0.25"))
+ATTENDANCE_WINDOW = float(os.getenv("ATTENDANCE_WINDOW", "3600"))
+ATTENDANCE_OUTBOX_PATH = os.getenv("ATTENDANCE_OUTBOX_PATH", "asistencias_outbox.db")
+INDEX_PATH = os.getenv("INDEX_PATH", "/root/faces/indice_ivf.npz")
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", "8"))
+INDEX_MAX_K = int(os.getenv("INDEX_MAX_K", "20"))
+LARAVEL_POOL_SIZE = int(os.getenv("LARAVEL_POOL_SIZE", "32"))
+LARAVEL_HTTP_BUDGET = float(os.getenv("LARAVEL_HTTP_BUDGET", "15"))
+LARAVEL_BINARY_ENCODINGS = os.getenv("LARAVEL_BINARY_ENCODINGS", "1").strip().lower() in ("1", "true", "yes", "on")
+REGISTRATION_WORKERS = int(os.getenv("REGISTRATION_WORKERS", "8"))
+CAMERA_SYNC_INTERVAL = float(os.getenv("CAMERA_SYNC_INTERVAL", "300"))
+SHARED_GALLERY_DIR = os.getenv("SHARED_GALLERY_DIR", directorio_por_defecto())
+FLASK_DEBUG = os.getenv("FLASK_DEBUG", "0").strip().lower() in ("1", "true", "yes", "on")
+
+# Rol del proceso:
+# - completo: todo en un proceso (python main.py, desarrollo)
+# - web: worker de gunicorn para los endpoints de imágenes; /salones y /sistema
+#   se reenvían al supervisor (ver gunicorn.conf.py)
+# - supervisor: proceso único con los streams, la sincronización y el envío de asistencias
+SERVICE_ROLE = os.getenv("SERVICE_ROLE", "completo").strip().lower()
+SUPERVISOR_HOST = os.getenv("SUPERVISOR_HOST", "127.0.0.1")
+SUPERVISOR_PORT = int(os.getenv("SUPERVISOR_PORT", "8081"))
+SUPERVISOR_URL = os.getenv("SUPERVISOR_URL", f"http://{SUPERVISOR_HOST}:{SUPERVISOR_PORT}")
+
+# Con el reloader de Flask este módulo se importa también en el proceso padre,
+# que solo vigila archivos: ahí no deben abrirse streams ni hilos
+ES_PADRE_RELOADER = (
+    SERVICE_ROLE == "completo" and FLASK_DEBUG and __name__ == "__main__"
+    and os.environ.get("WERKZEUG_RUN_MAIN") != "true"
+)
+SUPERVISAR = SERVICE_ROLE in ("completo", "supervisor") and not ES_PADRE_RELOADER
 
 # Configurar logging para archivo y consola
 logger = logging.getLogger()
@@ -59,19 +126,236 @@ logger.addHandler(console_handler)
 app = Flask(__name__)
 CORS(app)
 
+# Detectores por defecto: se validan al arrancar y se crean antes del fork de los workers
+obtener_detector(FACE_DETECTOR)
+obtener_detector(STREAM_FACE_DETECTOR)
+for perfil in (RECOGNITION_ENCODING_PROFILE, ENROL_ENCODING_PROFILE, STREAM_ENCODING_PROFILE):
+    obtener_perfil(perfil)
+
+# Cliente HTTP keep-alive compartido para todas las llamadas a Laravel
+laravel_client = obtener_cliente(LARAVEL_POOL_SIZE)
+laravel_client.rostros_binarios = LARAVEL_BINARY_ENCODINGS
+laravel_client.plazo = LARAVEL_HTTP_BUDGET or None
+atexit.register(laravel_client.cerrar)
+
+# Cache de rostros por matrícula compartido entre "/" y los salones
+galerias = crear_cache_galerias(
+    ttl=GALLERY_CACHE_TTL,
+    max_bytes=GALLERY_CACHE_MAX_MB * 1024 * 1024
+)
+
+# Resultados de /encoding y /detect por contenido de la imagen: los reintentos y
+# re-validaciones de la misma foto no vuelven a pasar por dlib
+resultados_imagenes = LRUCache(
+    ttl=IMAGE_CACHE_TTL,
+    max_entries=IMAGE_CACHE_ENTRIES,
+    sizeof=lambda resultado: len(json.dumps(resultado[0])),
+    # Solo los resultados que dependen de la imagen; un error transitorio se recalcula
+    cachear=lambda resultado: resultado[2],
+    nombre="resultados_imagenes"
+)
+
+# Índice institucional para identificación sin matrícula
+face_index = FaceIndex(nprobe=INDEX_NPROBE)
+indice_mtime = None  # st_mtime_ns de INDEX_PATH cuando se cargó
+indice_lock = threading.Lock()
+
+
+def recargar_indice():
+    """
+    Retorna el índice vigente; lo vuelve a leer si INDEX_PATH cambió en disco.
+
+    Solo el proceso que supervisa alimenta y guarda el índice; los workers
+    web lo leen de INDEX_PATH cada vez que el supervisor lo reemplaza.
+    """
+    global face_index, indice_mtime
+    try:
+        mtime = os.stat(INDEX_PATH).st_mtime_ns
+    except OSError:
+        return face_index
+    if mtime == indice_mtime:
+        return face_index
+    with indice_lock:
+        if mtime != indice_mtime:
+            try:
+                face_index = FaceIndex.load(INDEX_PATH, nprobe=INDEX_NPROBE)
+                logging.info(f"🗂️ DEPURACIÓN: Índice cargado de {INDEX_PATH}: {face_index.stats()['vectores']} vector(es)")
+            except Exception as e:
+                logging.warning(f"⚠️ DEPURACIÓN: No se pudo cargar el índice {INDEX_PATH}: {e}")
+            # Un archivo ilegible no se reintenta hasta que vuelva a cambiar
+            indice_mtime = mtime
+    return face_index
+
+
+recargar_indice()
+
+# Outbox de asistencias: el request solo encola; un hilo envía en lotes a Laravel
+# (los workers web solo encolan; envía el proceso que supervisa)
+outbox = AsistenciaOutbox(ATTENDANCE_OUTBOX_PATH, LARAVEL_API_URL)
+if SUPERVISAR:
+    outbox.iniciar()
+    atexit.register(outbox.detener)
+
+# Galerías compartidas por memory-map entre el supervisor (las publica y es el
+# único que consulta a Laravel) y los workers web (las mapean de solo lectura)
+galerias_compartidas = None
+if SERVICE_ROLE in ("web", "supervisor") and SHARED_GALLERY_DIR:
+    galerias_compartidas = SharedGalleryStore(SHARED_GALLERY_DIR, dueno=SERVICE_ROLE == "supervisor")
+
 # Inicializar SalonManager
 salon_manager = SalonManager(
     laravel_api_url=LARAVEL_API_URL,
-    recognition_threshold=RECOGNITION_THRESHOLD
+    recognition_threshold=RECOGNITION_THRESHOLD,
+    galerias=galerias,
+    indice=face_index,
+    indice_path=INDEX_PATH if SUPERVISAR else None,  # Solo un proceso escribe el índice
+    intervalo_deteccion=STREAM_DETECTION_INTERVAL,
+    intervalo_refresco=GALLERY_REFRESH_INTERVAL,
+    registro_workers=REGISTRATION_WORKERS,
+    intervalo_sincronizacion=CAMERA_SYNC_INTERVAL,
+    detection_workers=DETECTION_WORKERS,
+    outbox=outbox,
+    cliente=laravel_client,
+    supervisar=SUPERVISAR,
+    compartidas=galerias_compartidas,
+    dueno_url=SUPERVISOR_URL if SERVICE_ROLE == "web" else None,
+    opciones_por_defecto={
+        "umbral_movimiento": MOTION_THRESHOLD,
+        "umbral_pixel_movimiento": MOTION_PIXEL_THRESHOLD,
+        "reconocimiento": STREAM_RECOGNITION,
+        "presupuesto_cpu": STREAM_CPU_BUDGET,
+        "ventana_asistencia": ATTENDANCE_WINDOW,
+        "detector": STREAM_FACE_DETECTOR,
+        "perfil_encoding": STREAM_ENCODING_PROFILE,
+        "modo_captura": STREAM_CAPTURE_MODE,
+        "intervalo_captura": STREAM_SNAPSHOT_INTERVAL
+    }
 )
 
-# Iniciar auto-sincronización con Laravel para obtener cámaras activas
-salon_manager.iniciar_auto_sincronizacion()
+if SUPERVISAR:
+    atexit.register(salon_manager.guardar_indice)
+    # Iniciar auto-sincronización con Laravel para obtener cámaras activas
+    salon_manager.iniciar_auto_sincronizacion()
 
 # === Variables ===
 
 faces_dict = {}  # (No usado si se consulta desde Laravel)
 persistent_faces = "/root/faces"
+encoding_store = None  # Almacén memory-mapped de encodings de /root/faces
+
+
+def cargar_rostros_locales():
+    """Sincroniza el almacén de /root/faces; solo se codifican imágenes nuevas o modificadas."""
+    global encoding_store, faces_dict
+    try:
+        encoding_store = EncodingStore(persistent_faces)
+        faces_dict = encoding_store.sincronizar(
+            lambda path: calc_face_encoding(path, IMAGE_MAX_DIM, perfil=ENROL_ENCODING_PROFILE),
+            perfil=ENROL_ENCODING_PROFILE,
+        )
+        logging.info(f"📁 DEPURACIÓN: Rostros locales cargados: {len(faces_dict)}")
+    except Exception as e:
+        logging.warning(f"⚠️ DEPURACIÓN: No se pudieron cargar rostros persistentes: {e}")
+        faces_dict = {}
+
+
+def actualizar_rostros_locales(forzar=False):
+    """Alinea faces_dict con el almacén: otro worker pudo agregar o quitar rostros."""
+    if encoding_store is not None and (encoding_store.recargar() or forzar):
+        faces_dict.clear()
+        faces_dict.update(encoding_store.como_dict())
+    return faces_dict
+
+
+if SERVICE_ROLE == "web":
+    # Con preload_app se carga una vez en el master y los workers heredan el memory-map
+    cargar_rostros_locales()
+
+# === Reenvío al supervisor (rol web) ===
+
+RUTAS_SUPERVISOR = ("/salones", "/sistema")
+supervisor_session = requests.Session()
+
+
+@app.before_request
+def reenviar_al_supervisor():
+    """
+    En el rol web, /salones y /sistema los atiende el proceso supervisor.
+
+    Los workers no tienen streams ni salones propios: reenvían la petición
+    tal cual y devuelven la respuesta del supervisor.
+    """
+    if SERVICE_ROLE != "web" or not request.path.startswith(RUTAS_SUPERVISOR):
+        return None
+    
+    headers = {}
+    if request.content_type:
+        headers["Content-Type"] = request.content_type
+    try:
+        respuesta = supervisor_session.request(
+            request.method,
+            f"{SUPERVISOR_URL}{request.full_path.rstrip('?')}",
+            data=request.get_data(),
+            headers=headers,
+            timeout=(3.05, 120),
+        )
+    except requests.exceptions.RequestException as e:
+        logging.error(f"❌ DEPURACIÓN: Supervisor no disponible en {SUPERVISOR_URL}: {str(e)}")
+        return jsonify({"error": "Supervisor de salones no disponible", "details": str(e)}), 503
+    
+    return Response(
+        respuesta.content,
+        status=respuesta.status_code,
+        content_type=respuesta.headers.get("Content-Type", "application/json"),
+    )
+
+# === Parámetros de las peticiones de imágenes ===
+
+
+def detector_de_peticion():
+    """Detector elegido con ?detector=... (por defecto FACE_DETECTOR)."""
+    especificacion = request.args.get("detector") or FACE_DETECTOR
+    try:
+        obtener_detector(especificacion)
+    except ValueError as e:
+        raise BadRequest(str(e))
+    return especificacion
+
+
+def perfil_de_peticion(defecto):
+    """Perfil de encoding elegido con ?perfil=... (por defecto el del endpoint)."""
+    especificacion = request.args.get("perfil") or defecto
+    try:
+        obtener_perfil(especificacion)
+    except ValueError as e:
+        raise BadRequest(str(e))
+    return especificacion
+
+
+def respuesta_cacheada(endpoint, datos, parametros, calcular):
+    """
+    Responde desde el cache de resultados por contenido.
+
+    calcular() -> (cuerpo, status, cacheable) solo se ejecuta si la misma
+    imagen (mismos bytes, parámetros y reducción) no se procesó antes; las
+    subidas simultáneas de la misma imagen esperan un único cálculo. Con
+    cacheable=False (un error que no depende de la imagen) la respuesta no se
+    guarda y la próxima subida se recalcula. El encabezado X-Cache indica HIT
+    o MISS.
+    """
+    clave = (endpoint, hashlib.blake2b(datos, digest_size=16).hexdigest(), *parametros, IMAGE_MAX_DIM)
+    calculado = []
+
+    def cargar():
+        calculado.append(True)
+        return calcular()
+
+    cuerpo, status, _ = resultados_imagenes.get(clave, cargar)
+    respuesta = jsonify(cuerpo)
+    respuesta.status_code = status
+    respuesta.headers["X-Cache"] = "MISS" if calculado else "HIT"
+    return respuesta
+
 
 # === Endpoints ===
 
@@ -87,13 +371,17 @@ def web_recognize():
     Parámetros:
     - matricula_id (query parameter, requerido): ID de la matrícula para buscar rostros registrados
     - file (form-data, requerido): Imagen a procesar (formatos: png, jpg, jpeg, gif)
+    - detector (query parameter, opcional): hog, hog:N, yunet o haar (por defecto: FACE_DETECTOR)
+    - perfil (query parameter, opcional): rapido, preciso o registro[:N] (por defecto: RECOGNITION_ENCODING_PROFILE)
     
     Proceso:
     1. Extrae la imagen del request
-    2. Obtiene los rostros registrados para la matrícula desde Laravel
+    2. Obtiene los rostros registrados para la matrícula (cache compartido
+       con los salones; solo consulta Laravel si no están en cache o expiraron)
     3. Detecta rostros en la imagen subida
     4. Compara con rostros conocidos usando el umbral de reconocimiento
-    5. Si encuentra coincidencias, registra las asistencias en Laravel
+    5. Si encuentra coincidencias, encola las asistencias en el outbox local;
+       un hilo las envía a Laravel en lotes (con reintentos si Laravel falla)
     
     Respuesta exitosa (200):
     {
@@ -104,7 +392,7 @@ def web_recognize():
                 "dist": 0.45           // Distancia facial (menor = mayor similitud)
             }
         ],
-        "asistencia_reportada": true,  // Si se pudo registrar en Laravel
+        "asistencia_reportada": true,  // Si quedó encolada para registrarse en Laravel
         "timestamp": "2025-07-03T10:30:00"
     }
     
@@ -125,14 +413,16 @@ def web_recognize():
 
     if file and is_picture(file.filename):
         logging.info(f"Inicio de proceso para matrícula {matricula_id}")
-        rostros = get_faces_from_laravel(matricula_id, LARAVEL_API_URL)
-        resultado = detect_faces_in_image(file, rostros, RECOGNITION_THRESHOLD)
+        galeria = salon_manager.obtener_rostros(matricula_id)
+        resultado = detect_faces_in_image(
+            file, galeria, RECOGNITION_THRESHOLD, IMAGE_MAX_DIM, detector=detector_de_peticion(),
+            perfil=perfil_de_peticion(RECOGNITION_ENCODING_PROFILE)
+        )
 
         timestamp = datetime.now().isoformat()
 
         if resultado["faces"]:
-            enviado = reportar_asistencias(matricula_id, resultado["faces"], timestamp, LARAVEL_API_URL)
-            resultado["asistencia_reportada"] = enviado
+            resultado["asistencia_reportada"] = outbox.encolar(matricula_id, resultado["faces"], timestamp)
         else:
             resultado["asistencia_reportada"] = False
 
@@ -143,6 +433,80 @@ def web_recognize():
     raise BadRequest("Invalid file")
 
 
+@app.route("/identificar", methods=["POST"])
+def identificar_rostros():
+    """
+    Endpoint para identificar rostros contra todos los estudiantes de la institución.
+    
+    Método: POST
+    URL: /identificar
+    
+    Parámetros:
+    - file (form-data, requerido): Imagen a procesar (formatos: png, jpg, jpeg, gif)
+    - k (query parameter, opcional): Candidatos por rostro, de 1 a INDEX_MAX_K (por defecto: 3)
+    - nprobe (query parameter, opcional): Listas del índice a recorrer (al menos 1); mayor
+      valor = más precisión y más latencia (por defecto: INDEX_NPROBE)
+    - detector (query parameter, opcional): hog, hog:N, yunet o haar (por defecto: FACE_DETECTOR)
+    - perfil (query parameter, opcional): rapido, preciso o registro[:N] (por defecto: RECOGNITION_ENCODING_PROFILE)
+    
+    Proceso:
+    1. Extrae la imagen del request
+    2. Calcula la codificación de cada rostro detectado
+    3. Busca los vecinos más cercanos en el índice institucional (IVF)
+    4. Filtra los candidatos con el umbral de reconocimiento
+    
+    Respuesta exitosa (200):
+    {
+        "count": 1,
+        "faces": [
+            {
+                "id": 123,                                  // Mejor coincidencia (o null)
+                "dist": 0.41,
+                "candidatos": [{"id": 123, "dist": 0.41}]
+            }
+        ],
+        "indice": {"vectores": 24000, "nlist": 620, "nprobe": 8, ...}
+    }
+    
+    Ejemplo de uso:
+    curl -X POST "http://localhost:8080/identificar?k=3&nprobe=16" \
+         -F "file=@imagen.jpg"
+    
+    Errores:
+    - 400: Archivo inválido, o k / nprobe fuera de rango
+
+    Notas:
+    - El índice se alimenta con los rostros de cada matrícula descargada desde
+      Laravel y se guarda en INDEX_PATH
+    - No es un padrón completo: solo contiene las matrículas cuyas galerías ya
+      se descargaron (las de cámaras activas y las consultadas en "/"). Un
+      estudiante que solo está en matrículas sin cámara ni consultas no se
+      encuentra; Laravel no ofrece un listado de todas las matrículas
+    """
+    file = extract_image(request)
+    if not (file and is_picture(file.filename)):
+        raise BadRequest("Invalid file")
+
+    try:
+        k = int(request.args.get("k", 3))
+        nprobe = int(request.args["nprobe"]) if "nprobe" in request.args else None
+    except ValueError:
+        raise BadRequest("'k' and 'nprobe' must be integers")
+    if not 1 <= k <= INDEX_MAX_K:
+        raise BadRequest(f"'k' must be between 1 and {INDEX_MAX_K}")
+    if nprobe is not None and nprobe < 1:
+        raise BadRequest("'nprobe' must be at least 1")
+
+    # El supervisor es quien alimenta el índice; los demás roles lo releen de disco
+    indice = face_index if SUPERVISAR else recargar_indice()
+    resultado = identify_faces_in_image(
+        file, indice, RECOGNITION_THRESHOLD, k=k, nprobe=nprobe, max_dim=IMAGE_MAX_DIM,
+        detector=detector_de_peticion(), perfil=perfil_de_peticion(RECOGNITION_ENCODING_PROFILE)
+    )
+    resultado["indice"] = indice.stats()
+    return jsonify(resultado)
+
+
 @app.route("/encoding", methods=["POST"])
 def encode_face():
     """
@@ -153,6 +517,8 @@ def encode_face():
     
     Parámetros:
     - file (form-data, requerido): Imagen con un solo rostro (formatos: png, jpg, jpeg, gif)
+    - detector (query parameter, opcional): hog, hog:N, yunet o haar (por defecto: FACE_DETECTOR)
+    - perfil (query parameter, opcional): rapido, preciso o registro[:N] (por defecto: ENROL_ENCODING_PROFILE)
     
     Proceso:
     1. Extrae la imagen del request
@@ -184,15 +550,26 @@ def encode_face():
     - La imagen debe contener exactamente un rostro
     - La codificación resultante puede usarse para comparaciones futuras
     - El array tiene exactamente 128 elementos (estándar de face_recognition)
+    - Reenviar la misma imagen responde desde cache (encabezado X-Cache: HIT)
     """
     file = extract_image(request)
+    detector = detector_de_peticion()
+    perfil = perfil_de_peticion(ENROL_ENCODING_PROFILE)
     if file and is_picture(file.filename):
-        try:
-            encoding = calc_face_encoding(file)
-            return jsonify({"encoding": encoding.tolist()})
-        except Exception as e:
-            logging.error(f"Error en encoding: {str(e)}")
-            return jsonify({"error": str(e)}), 400
+        datos = file.read()
+
+        def calcular():
+            try:
+                encoding = calc_face_encoding(datos, IMAGE_MAX_DIM, detector, perfil)
+                return {"encoding": encoding.tolist()}, 200, True
+            except ImagenNoProcesable as e:
+                logging.error(f"Error en encoding: {str(e)}")
+                return {"error": str(e)}, 400, True
+            except Exception as e:
+                logging.error(f"Error en encoding: {str(e)}")
+                return {"error": str(e)}, 400, False
+
+        return respuesta_cacheada("encoding", datos, (detector, perfil), calcular)
     return jsonify({"error": "Invalid image"}), 400
 
 
@@ -206,6 +583,7 @@ def detect_faces():
     
     Parámetros:
     - file (form-data, requerido): Imagen a analizar (formatos: png, jpg, jpeg, gif)
+    - detector (query parameter, opcional): hog, hog:N, yunet o haar (por defecto: FACE_DETECTOR)
     
     Proceso:
     1. Extrae la imagen del request
@@ -240,15 +618,24 @@ def detect_faces():
     - Útil para validar si una imagen tiene rostros antes de procesamiento
     - Las coordenadas están en formato (top, right, bottom, left) en píxeles
     - Puede detectar múltiples rostros sin problema
+    - Reenviar la misma imagen responde desde cache (encabezado X-Cache: HIT)
     """
     file = extract_image(request)
+    detector = detector_de_peticion()
     if file and is_picture(file.filename):
-        try:
-            resultado = detect_faces_only(file)
-            return jsonify(resultado)
-        except Exception as e:
-            logging.error(f"Error en detección: {str(e)}")
-            return jsonify({"error": str(e)}), 400
+        datos = file.read()
+
+        def calcular():
+            try:
+                return detect_faces_only(datos, IMAGE_MAX_DIM, detector), 200, True
+            except ImagenNoProcesable as e:
+                logging.error(f"Error en detección: {str(e)}")
+                return {"error": str(e)}, 400, True
+            except Exception as e:
+                logging.error(f"Error en detección: {str(e)}")
+                return {"error": str(e)}, 400, False
+
+        return respuesta_cacheada("detect", datos, (detector,), calcular)
     return jsonify({"error": "Invalid image"}), 400
 
 
@@ -278,7 +665,7 @@ def web_faces():
     
     Proceso:
     1. Guarda la imagen en /root/faces/<id>.jpg
-    2. Calcula y almacena la codificación facial
+    2. Calcula la codificación facial y la guarda en el almacén en disco
     3. Actualiza el diccionario en memoria
     
     Respuesta (200):
@@ -299,7 +686,7 @@ def web_faces():
     - id (query parameter, requerido): ID del rostro a eliminar
     
     Proceso:
-    1. Elimina la entrada del diccionario en memoria
+    1. Elimina la entrada del diccionario en memoria y del almacén en disco
     2. Borra el archivo físico /root/faces/<id>.jpg
     
     Respuesta (200):
@@ -318,26 +705,37 @@ def web_faces():
     - Los archivos se guardan en formato JPG independientemente del formato original
     """
     if request.method == "GET":
-        return jsonify(list(faces_dict.keys()))
+        return jsonify(list(actualizar_rostros_locales().keys()))
 
     file = extract_image(request)
     if "id" not in request.args:
         raise BadRequest("Missing 'id' parameter!")
 
+    rostro_id = request.args.get("id")
+    path_imagen = f"{persistent_faces}/{rostro_id}.jpg"
+
     if request.method == "POST":
         app.logger.info("%s loaded", file.filename)
-        file.save(f"{persistent_faces}/{request.args.get('id')}.jpg")
+        file.save(path_imagen)
         try:
-            new_encoding = calc_face_encoding(file)
-            faces_dict.update({request.args.get("id"): new_encoding})
+            new_encoding = calc_face_encoding(path_imagen, IMAGE_MAX_DIM, perfil=ENROL_ENCODING_PROFILE)
+            if encoding_store is not None:
+                encoding_store.put(rostro_id, new_encoding, path_imagen, perfil=ENROL_ENCODING_PROFILE)
+                actualizar_rostros_locales(forzar=True)
+            else:
+                faces_dict.update({rostro_id: new_encoding})
         except Exception as exception:
             raise BadRequest(exception)
 
     elif request.method == "DELETE":
-        faces_dict.pop(request.args.get("id"))
+        actualizar_rostros_locales()
+        faces_dict.pop(rostro_id)
+        if encoding_store is not None:
+            encoding_store.remove(rostro_id)
+            actualizar_rostros_locales(forzar=True)
         # Importar remove aquí para evitar conflicto con imports
         from os import remove
-        remove(f"{persistent_faces}/{request.args.get('id')}.jpg")
+        remove(path_imagen)
 
     return jsonify(list(faces_dict.keys()))
 
@@ -376,6 +774,43 @@ def health_check():
     )
 
 
+@app.route("/cache", methods=["GET", "DELETE"])
+def estado_cache():
+    """
+    Estadísticas de los caches del proceso que atiende la petición.
+    
+    Métodos: GET (estadísticas), DELETE (vacía el cache de resultados)
+    URL: /cache
+    
+    Respuesta (200):
+    {
+        "pid": 1234,                     // Worker que respondió (cada worker tiene su cache)
+        "resultados_imagenes": {         // /encoding y /detect por contenido de la imagen
+            "entradas": 42, "bytes": 51234, "hits": 120, "misses": 42, "hit_ratio": 0.7407, ...
+        },
+        "galerias": {"entradas": 12, "hits": 900, "misses": 15, ...}, // Rostros por matrícula
+        "pool_encodings": {              // Encodings únicos compartidos por las galerías
+            "rostros_distintos": 850, "referencias": 1930, "bytes": 528384, "bytes_sin_compartir": 1003600, ...
+        },
+        "galerias_compartidas": {        // null con SERVICE_ROLE=completo
+            "directorio": "/dev/shm/galerias", "dueno": false, "publicadas": 12, "adjuntas": 3, ...
+        }
+    }
+    
+    Ejemplo:
+    curl -X GET "http://localhost:8080/cache"
+    """
+    if request.method == "DELETE":
+        resultados_imagenes.clear()
+    return jsonify({
+        "pid": os.getpid(),
+        "resultados_imagenes": resultados_imagenes.stats(),
+        "galerias": galerias.stats(),
+        "pool_encodings": obtener_pool().stats(),
+        "galerias_compartidas": galerias_compartidas.stats() if galerias_compartidas is not None else None,
+    })
+
+
 @app.route("/salones", methods=["GET", "POST", "DELETE"])
 def gestionar_salones():
     """
@@ -415,7 +850,8 @@ def gestionar_salones():
     {
         "matricula_id": "salon_101",           // ID único del salón
         "stream_url": "http://192.168.1.100:81/stream",  // URL del stream ESP32
-        "codigo_matricula": "20256A"          // Código legible (opcional)
+        "codigo_matricula": "20256A",         // Código legible (opcional)
+        "opciones": {"umbral_movimiento": 0.02}  // Opciones de la cámara (opcional)
     }
     
     IMPORTANTE: Los salones registrados manualmente pueden ser sobrescritos
@@ -459,12 +895,13 @@ def gestionar_salones():
         matricula_id = data["matricula_id"]
         stream_url = data["stream_url"]
         codigo_matricula = data.get("codigo_matricula")
+        opciones = extraer_opciones_camara(data)
         
         # Advertencia sobre uso manual
         logging.warning(f"⚠️ Registro manual de salón {matricula_id}. Se recomienda usar auto-sincronización.")
         
         # Registrar salón
-        if salon_manager.registrar_salon(matricula_id, stream_url, codigo_matricula):
+        if salon_manager.registrar_salon(matricula_id, stream_url, codigo_matricula, opciones):
             return jsonify({
                 "success": True,
                 "message": f"Salón {matricula_id} registrado manualmente",
@@ -514,7 +951,10 @@ def obtener_estado_salon(matricula_id):
         "ultimo_cache": "2025-07-13T10:30:00",     // Última actualización del cache
         "monitoreando": true,                      // Si está monitoreando activamente
         "detecciones_hoy": 12,                     // Detecciones realizadas hoy
-        "ultima_deteccion": "2025-07-13T11:45:00"  // Última detección exitosa
+        "ultima_deteccion": "2025-07-13T11:45:00", // Última detección exitosa
+        "frames_analizados": 340,                  // Frames enviados a detección
+        "frames_omitidos_sin_movimiento": 2100,    // Frames omitidos por escena estática
+        ...
     }
     
     Error (404):
@@ -597,9 +1037,11 @@ def sincronizar_sistema():
     Proceso:
     1. Consulta el endpoint /api/camaras/activas en Laravel
     2. Compara con salones actuales del microservicio
-    3. Registra nuevas cámaras automáticamente
-    4. Desregistra cámaras que ya no están activas
-    5. Actualiza URLs de stream si cambiaron
+    3. Registra nuevas cámaras automáticamente (monitoreo inmediato; las
+       galerías se cargan en paralelo y se activan al llegar)
+    4. Desregistra cámaras que ya no están activas (detiene sus hilos)
+    5. Actualiza URLs de stream si cambiaron (sin perder la galería)
+    Si Laravel no responde, los salones en ejecución no se modifican.
     
     Respuesta exitosa (200):
     {
@@ -611,7 +1053,10 @@ def sincronizar_sistema():
             "nuevos": ["2"],
             "eliminados": ["1"], 
             "actualizados": ["5"]
-        }
+        },
+        "galerias_cargadas": 1,     // Galerías de salones nuevos ya cargadas
+        "galerias_pendientes": 0,   // Siguen cargando (el salón ya monitorea)
+        "duracion_segundos": 0.84
     }
     
     Error (500):
@@ -629,36 +1074,30 @@ def sincronizar_sistema():
     - Verificación manual del estado
     
     Nota:
-    La sincronización también ocurre automáticamente cada 5 minutos.
+    La sincronización también ocurre automáticamente cada 5 minutos (CAMERA_SYNC_INTERVAL).
     """
     global salon_manager
     
     try:
-        # Obtener estado anterior
-        salones_antes = set(salon_manager.obtener_salones_activos())
+        # Realizar sincronización (reconcilia altas, bajas y cambios de URL)
+        resultado = salon_manager.sincronizar_con_laravel()
         
-        # Realizar sincronización
-        exito = salon_manager.sincronizar_con_laravel()
-        
-        if exito:
-            # Obtener estado posterior
-            salones_despues = set(salon_manager.obtener_salones_activos())
-            
-            # Calcular cambios
-            nuevos = salones_despues - salones_antes
-            eliminados = salones_antes - salones_despues
-            # Para detectar actualizados necesitaríamos más lógica, por simplicidad lo omitimos
+        if resultado["exito"]:
+            salones_despues = salon_manager.obtener_salones_activos()
             
             return jsonify({
                 "success": True,
                 "message": "Sincronización completada",
-                "salones_activos": list(salones_despues),
+                "salones_activos": salones_despues,
                 "total": len(salones_despues),
                 "cambios": {
-                    "nuevos": list(nuevos),
-                    "eliminados": list(eliminados),
-                    "actualizados": []  # Por implementar si es necesario
-                }
+                    "nuevos": resultado["nuevos"],
+                    "eliminados": resultado["eliminados"],
+                    "actualizados": resultado["actualizados"]
+                },
+                "galerias_cargadas": resultado["galerias_cargadas"],
+                "galerias_pendientes": resultado["galerias_pendientes"],
+                "duracion_segundos": resultado["duracion_segundos"]
             })
         else:
             return jsonify({
@@ -673,6 +1112,36 @@ def sincronizar_sistema():
         }), 500
 
 
+@app.route("/sistema/galerias/<matricula_id>", methods=["POST"])
+def publicar_galeria(matricula_id):
+    """
+    Publica la galería de una matrícula en la memoria compartida.
+    
+    Método: POST
+    URL: /sistema/galerias/<matricula_id>
+    
+    Lo llaman los workers web cuando una matrícula no está publicada o su
+    versión venció; el supervisor la obtiene de su cache (o de Laravel) y la
+    publica en SHARED_GALLERY_DIR.
+    
+    Parámetros:
+    - matricula_id (path parameter): ID de la matrícula
+    - refrescar (query parameter, opcional): 1 para revalidar contra Laravel
+    
+    Respuesta (200):
+    {
+        "matricula_id": "456",
+        "publicada": {"version": 3, "filas": 42, "verificado": 1752489000.5}  // null si está vacía
+    }
+    
+    Ejemplo:
+    curl -X POST "http://localhost:8081/sistema/galerias/456"
+    """
+    refrescar = request.args.get("refrescar", "").strip().lower() in ("1", "true", "yes", "on")
+    publicada = salon_manager.publicar_galeria(matricula_id, refrescar=refrescar)
+    return jsonify({"matricula_id": matricula_id, "publicada": publicada})
+
+
 @app.route("/sistema/estado", methods=["GET"])
 def estado_sistema():
     """
@@ -697,6 +1166,11 @@ def estado_sistema():
             }
         ],
         "ultima_sincronizacion": "2025-07-14T10:30:00",
+        "deteccion": {"workers": 4, "en_vuelo": 2, "camaras": 3},  // Pool de detección
+        "outbox_asistencias": {"pendientes": 0, "descartadas": 0, "enviados": 120, "latencia_envio_media_ms": 85.3, ...},
+        "laravel_http": {"pool_size": 32, "peticiones": 540, "conexiones_abiertas": 3, ...},
+        "refresco_rostros": {"consultas": 90, "sin_cambios": 84, "deltas": 5, "bytes_recibidos": 81234, ...},
+        "tareas": {"tareas": 42, "en_curso": 0, "ejecuciones": 310, "errores": 0, ...},  // Tareas periódicas
         "version": "2.0.0"
     }
     
@@ -725,6 +1199,11 @@ def estado_sistema():
         "salones_totales": len(salones_info),
         "salones_monitoreando": salones_monitoreando,
         "salones": salones_info,
+        "deteccion": salon_manager.scheduler.obtener_estado(),
+        "outbox_asistencias": outbox.stats(),
+        "laravel_http": laravel_client.stats(),
+        "refresco_rostros": salon_manager.sincronizador.stats(),
+        "tareas": salon_manager.tareas.obtener_estado(),
         "version": "2.0.0-auto-sync"
     })
 
@@ -745,17 +1224,26 @@ if __name__ == "__main__":
     logging.info(f"🌐 DEPURACIÓN: Laravel API URL: {LARAVEL_API_URL}")
     logging.info(f"🎯 DEPURACIÓN: Umbral de reconocimiento: {RECOGNITION_THRESHOLD}")
     logging.info(f"📝 DEPURACIÓN: Archivo de log: {LOG_FILE_PATH}")
-    
-    try:
-        faces_dict = get_faces_dict(persistent_faces)
-        logging.info(f"📁 DEPURACIÓN: Rostros locales cargados: {len(faces_dict)}")
-    except Exception as e:
-        logging.warning(f"⚠️ DEPURACIÓN: No se pudieron cargar rostros persistentes: {e}")
-        faces_dict = {}
+    logging.info(f"🧩 DEPURACIÓN: Rol del proceso: {SERVICE_ROLE}")
+    
+    if SERVICE_ROLE == "supervisor":
+        # Proceso dedicado a streams y sincronización; recibe /salones y /sistema de los workers
+        logging.info(f"🌐 DEPURACIÓN: Supervisor escuchando en {SUPERVISOR_HOST}:{SUPERVISOR_PORT}")
+        # gunicorn lo detiene con SIGTERM: salir limpio para vaciar el outbox y guardar el índice
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        app.run(host=SUPERVISOR_HOST, port=SUPERVISOR_PORT, threaded=True, debug=False, use_reloader=False)
+        raise SystemExit(0)
+    
+    if not ES_PADRE_RELOADER:
+        cargar_rostros_locales()
 
     logging.info("🌐 DEPURACIÓN: Iniciando servidor Flask en puerto 8080")
     logging.info("✅ DEPURACIÓN: Microservicio listo para recibir conexiones")
     logging.info("🔄 DEPURACIÓN: Auto-sincronización con Laravel iniciada")
-    logging.info("👁️ DEPURACIÓN: Modo SOLO DETECCIÓN activado (sin comparaciones)")
+    if STREAM_RECOGNITION:
+        logging.info(f"👁️ DEPURACIÓN: Reconocimiento en streams activado (presupuesto {STREAM_CPU_BUDGET} núcleo(s) por cámara)")
+    else:
+        logging.info("👁️ DEPURACIÓN: Modo SOLO DETECCIÓN activado (sin comparaciones)")
     
-    app.run(host="0.0.0.0", port=8080, debug=True, use_reloader=True)
+    # Desarrollo: para producción usar gunicorn -c gunicorn.conf.py
+    app.run(host="0.0.0.0", port=8080, threaded=True, debug=FLASK_DEBUG, use_reloader=FLASK_DEBUG)
@@ -2,71 +2,215 @@
 Gestión de salones, streams y rostros asociados.
 """
 
+import math
 import threading
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
 import cv2
+import requests
 import face_recognition
-from laravel_utils import get_faces_from_laravel, get_camaras_activas, reportar_asistencias
+from laravel_utils import (
+    get_faces_from_laravel, get_camaras_activas, reportar_asistencias, obtener_cliente, SincronizadorRostros
+)
+from cache_utils import LRUCache
+from stream_utils import FrameGrabber, SnapshotGrabber, MotionGate, MODOS_CAPTURA, url_captura_esp32
+from detection_scheduler import DetectionScheduler
+from face_tracker import FaceTracker
+from face_utils import FaceGallery, PooledGallery, obtener_perfil, PERFIL_DEFECTO
+from face_detectors import obtener_detector, DETECTOR_DEFECTO
+from task_scheduler import TaskScheduler
+
+
+# Opciones por cámara que pueden venir en el registro de Laravel o en POST /salones
+OPCIONES_CAMARA = (
+    "umbral_movimiento",        # Fracción de píxeles que deben cambiar para analizar (0.0 = siempre)
+    "umbral_pixel_movimiento",  # Diferencia mínima (0-255) para contar un píxel como cambiado
+    "refresco_movimiento",      # Segundos máximos sin analizar aunque la escena esté quieta
+    "reconocimiento",           # Comparar rostros del stream con la galería y registrar asistencias
+    "presupuesto_cpu",          # Fracción de un núcleo que puede consumir la cámara (0 = sin límite)
+    "ventana_asistencia",       # Segundos durante los que no se repite la asistencia de un rostro
+    "detector",                 # Detector de rostros: hog, hog:N, yunet o haar
+    "perfil_encoding",          # Costo del encoding: rapido, preciso o registro[:jitters]
+    "modo_captura",             # stream (MJPEG continuo) o snapshot (sondeo de la foto fija)
+    "intervalo_captura",        # Segundos entre fotos en modo snapshot
+    "url_captura",              # URL de la foto fija (por defecto /capture del ESP32 según url_stream)
+)
+
+# Segundos extra que un track sobrevive además del hueco máximo entre análisis
+MARGEN_TRACKER = 3.0
+
+# Segundos entre fotos en modo snapshot si la cámara no indica uno válido
+INTERVALO_CAPTURA_DEFECTO = 1.0
+
+
+def _como_bool(valor):
+    """Interpreta booleanos que pueden venir como texto o número desde JSON/.env."""
+    if isinstance(valor, str):
+        return valor.strip().lower() in ("1", "true", "si", "sí", "yes", "on")
+    return bool(valor)
+
+
+def extraer_opciones_camara(camara):
+    """Obtiene las opciones por cámara desde el registro de Laravel."""
+    anidadas = camara.get("opciones") or {}
+    opciones = {}
+    for clave in OPCIONES_CAMARA:
+        valor = camara.get(clave, anidadas.get(clave))
+        if valor is not None:
+            opciones[clave] = valor
+    return opciones
+
+
+def segundos_hasta_medianoche():
+    """Segundos hasta la próxima medianoche local (cierre diario de estadísticas)."""
+    ahora = datetime.now()
+    manana = (ahora + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (manana - ahora).total_seconds()
+
+
+def crear_cache_galerias(ttl=1800, max_bytes=256 * 1024 * 1024):
+    """Crea el cache compartido de galerías (FaceGallery) por matrícula."""
+    return LRUCache(
+        ttl=ttl,
+        max_bytes=max_bytes,
+        sizeof=lambda galeria: galeria.nbytes,
+        cachear=len,  # Una galería vacía puede ser un error de red: no se cachea
+        revalidar=True,  # El loader recibe la galería anterior para el refresco incremental
+        nombre="galerias",
+    )
+
 
 class SalonData:
-    def __init__(self, matricula_id, stream_url, laravel_api_url, recognition_threshold, codigo_matricula=None):
+    def __init__(self, matricula_id, stream_url, laravel_api_url, recognition_threshold, codigo_matricula=None,
+                 obtener_rostros=None, intervalo_deteccion=1.0, scheduler=None, opciones=None, reportar=None,
+                 intervalo_refresco=1800, cargar_al_iniciar=True, tareas=None):
         self.matricula_id = matricula_id
         self.stream_url = stream_url
         self.laravel_api_url = laravel_api_url
         self.recognition_threshold = recognition_threshold
         self.codigo_matricula = codigo_matricula or f"MAT_{matricula_id}"
+        # Función (matricula_id, refrescar) -> rostros; normalmente SalonManager.obtener_rostros
+        self.obtener_rostros = obtener_rostros
         
-        # Cache de rostros
-        self.rostros_cache = []
+        # Galería compacta (FaceGallery); se reemplaza completa en cada actualización
+        self.galeria = FaceGallery.from_rostros([])
         self.ultimo_cache_rostros = None
         
         # Estado de monitoreo
         self.monitoreando = False
+        self._detenido = threading.Event()  # Despierta a los hilos al detener el monitoreo
         self.stream_thread = None
         self.cache_thread = None
+        self.grabber = None
+        # Planificador de tareas periódicas (TaskScheduler); sin él se usa un hilo propio
+        self.tareas = tareas
+        self._tarea_refresco = None
+        # Planificador central de detección (DetectionScheduler); sin él se usa un hilo propio
+        self.scheduler = scheduler
+        # Pausa mínima entre análisis; siempre se analiza el frame más reciente
+        self.intervalo_deteccion = intervalo_deteccion
+        # Segundos entre revalidaciones (incrementales) de la galería
+        self.intervalo_refresco = intervalo_refresco
+        self._ultimo_seq = 0
+        self._ultimo_analisis = None
+        
+        # Opciones por cámara (ver OPCIONES_CAMARA)
+        self.opciones = dict(opciones or {})
+        
+        # Compuerta de movimiento: omite la detección si la escena no cambió
+        self.motion_gate = MotionGate(
+            umbral_area=float(self.opciones.get("umbral_movimiento", 0.01)),
+            umbral_pixel=int(self.opciones.get("umbral_pixel_movimiento", 25)),
+            refresco_max=float(self.opciones.get("refresco_movimiento", 30.0))
+        )
+        
+        # Detector de rostros de la cámara (ver face_detectors)
+        self.detector = self.opciones.get("detector") or DETECTOR_DEFECTO
+        try:
+            obtener_detector(self.detector)
+        except ValueError as e:
+            logging.warning(f"⚠️ DEPURACIÓN: {e}; matrícula {matricula_id} usa '{DETECTOR_DEFECTO}'")
+            self.detector = DETECTOR_DEFECTO
+        self.perfil_encoding = self.opciones.get("perfil_encoding") or PERFIL_DEFECTO
+        try:
+            obtener_perfil(self.perfil_encoding)
+        except ValueError as e:
+            logging.warning(f"⚠️ DEPURACIÓN: {e}; matrícula {matricula_id} usa '{PERFIL_DEFECTO}'")
+            self.perfil_encoding = PERFIL_DEFECTO
+        self._configurar_captura(self.opciones)
+        
+        # Seguimiento de rostros entre frames: cada persona se codifica una vez por aparición
+        self.tracker = self._nuevo_tracker()
+        
+        # Reconocimiento en el stream y registro de asistencias
+        self.reconocimiento = _como_bool(self.opciones.get("reconocimiento", True))
+        self.presupuesto_cpu = float(self.opciones.get("presupuesto_cpu") or 0) or None
+        self.ventana_asistencia = float(self.opciones.get("ventana_asistencia", 3600))
+        self.asistencias_reportadas = {}  # rostro_id -> momento del último reporte
+        # Función (matricula_id, rostros, timestamp); normalmente AsistenciaOutbox.encolar
+        self.reportar = reportar
         
         # Estadísticas
         self.detecciones_hoy = 0
         self.ultima_deteccion = None
+        self.frames_analizados = 0
+        self.frames_con_rostros = 0
+        self.latencia_ultima_ms = None
+        self.latencia_max_ms = None
+        self.rostros_reconocidos = 0
+        self.asistencias_enviadas = 0
+        self.encodings_diferidos = 0
         
         # Inicializar
         logging.info(f"🏫 DEPURACIÓN: Inicializando SalonData para matrícula {matricula_id}")
-        self.cargar_rostros()
+        if cargar_al_iniciar:
+            self.cargar_rostros()
+        # Sin carga inicial el stream arranca con la galería vacía; cargar_rostros
+        # la reemplaza en caliente cuando llegan los rostros
         self.iniciar_monitoreo()
 
-    def cargar_rostros(self):
-        """Carga rostros desde Laravel con logs detallados."""
+    def cargar_rostros(self, refrescar=False):
+        """Carga rostros (desde el cache compartido o Laravel) con logs detallados."""
         logging.info(f"🔄 DEPURACIÓN: Iniciando carga de rostros para matrícula {self.matricula_id}")
         
         try:
             # ✅ AQUÍ SE OBTIENEN LOS ROSTROS - LOG PRINCIPAL
-            rostros = get_faces_from_laravel(self.matricula_id, self.laravel_api_url)
+            if self.obtener_rostros is not None:
+                galeria = self.obtener_rostros(self.matricula_id, refrescar=refrescar)
+            else:
+                galeria = PooledGallery.from_rostros(get_faces_from_laravel(self.matricula_id, self.laravel_api_url) or [])
             
-            if rostros:
-                self.rostros_cache = rostros
+            if galeria is not None and galeria is self.galeria:
+                logging.info(f"✅ DEPURACIÓN: Rostros de matrícula {self.matricula_id} sin cambios")
+                self.ultimo_cache_rostros = datetime.now()
+            elif galeria is not None and len(galeria):
+                # Reemplazo atómico: el pipeline de reconocimiento toma la referencia vigente
+                self.galeria = galeria
                 self.ultimo_cache_rostros = datetime.now()
                 
                 logging.info(f"✅ DEPURACIÓN: CACHE DE ROSTROS ACTUALIZADO EXITOSAMENTE")
-                logging.info(f"📊 DEPURACIÓN: Matrícula {self.matricula_id} ahora tiene {len(rostros)} rostros en cache")
+                logging.info(
+                    f"📊 DEPURACIÓN: Matrícula {self.matricula_id} ahora tiene {len(galeria)} rostros en cache "
+                    f"({galeria.nbytes / 1024:.1f} KB)"
+                )
                 logging.info(f"⏰ DEPURACIÓN: Última actualización: {self.ultimo_cache_rostros}")
                 
                 # Mostrar IDs de rostros cargados en cache
-                if len(rostros) <= 5:  # Si son pocos, mostrar todos
-                    ids_rostros = [str(r.get("id", "SIN_ID")) for r in rostros]
+                ids_rostros = [str(i) for i in galeria.ids[:5].tolist()]
+                if len(galeria) <= 5:  # Si son pocos, mostrar todos
                     logging.info(f"🎯 DEPURACIÓN: IDs en cache: {', '.join(ids_rostros)}")
                 else:  # Si son muchos, mostrar solo los primeros 5
-                    ids_primeros = [str(r.get("id", "SIN_ID")) for r in rostros[:5]]
-                    logging.info(f"🎯 DEPURACIÓN: Primeros 5 IDs en cache: {', '.join(ids_primeros)}... (+{len(rostros)-5} más)")
+                    logging.info(f"🎯 DEPURACIÓN: Primeros 5 IDs en cache: {', '.join(ids_rostros)}... (+{len(galeria)-5} más)")
                 
             else:
                 logging.warning(f"⚠️ DEPURACIÓN: NO se pudieron cargar rostros para matrícula {self.matricula_id}")
-                self.rostros_cache = []
+                self.galeria = FaceGallery.from_rostros([])
                 
         except Exception as e:
             logging.error(f"❌ DEPURACIÓN: ERROR CRÍTICO cargando rostros para matrícula {self.matricula_id}: {str(e)}")
-            self.rostros_cache = []
+            self.galeria = FaceGallery.from_rostros([])
 
     def iniciar_monitoreo(self):
         """Inicia el monitoreo del stream."""
@@ -75,84 +219,216 @@ class SalonData:
             return
         
         self.monitoreando = True
+        self._detenido.clear()
         logging.info(f"🎯 DEPURACIÓN: INICIANDO MONITOREO DE STREAM para matrícula {self.matricula_id}")
         logging.info(f"📹 DEPURACIÓN: URL del stream: {self.stream_url}")
         
-        # Thread para monitoreo de stream
-        self.stream_thread = threading.Thread(target=self._monitorear_stream)
-        self.stream_thread.daemon = True
-        self.stream_thread.start()
+        # Captura continua: solo conserva el último frame del stream
+        self.grabber = self._crear_grabber()
+        self.grabber.iniciar()
         
-        # Thread para actualización de cache cada 30 minutos
-        self.cache_thread = threading.Thread(target=self._cache_thread)
-        self.cache_thread.daemon = True
-        self.cache_thread.start()
+        if self.scheduler is not None:
+            # La detección la ejecuta el pool compartido de SalonManager
+            self.scheduler.registrar(
+                self.matricula_id, self, presupuesto_cpu=self.presupuesto_cpu, detector=self.detector,
+                perfil_encoding=self.perfil_encoding
+            )
+        else:
+            # Thread de detección propio sobre el frame más reciente
+            self.stream_thread = threading.Thread(target=self._monitorear_stream)
+            self.stream_thread.daemon = True
+            self.stream_thread.start()
+        
+        # Revalidación periódica de la galería (con jitter para no sincronizar a todos los salones)
+        if self.tareas is not None:
+            self._tarea_refresco = self.tareas.programar(
+                self._refrescar_galeria, self.intervalo_refresco, jitter=0.2,
+                nombre=f"galeria-{self.matricula_id}"
+            )
+        else:
+            self.cache_thread = threading.Thread(target=self._cache_thread)
+            self.cache_thread.daemon = True
+            self.cache_thread.start()
         
         logging.info(f"✅ DEPURACIÓN: Threads de monitoreo iniciados para matrícula {self.matricula_id}")
 
     def _monitorear_stream(self):
-        """Monitorea el stream y detecta rostros SIN COMPARAR."""
+        """Detecta rostros SIN COMPARAR sobre el frame más reciente (modo sin planificador)."""
         logging.info(f"👁️ DEPURACIÓN: INICIANDO MONITOREO ACTIVO del stream {self.stream_url}")
         
-        cap = None
-        frames_procesados = 0
-        frames_con_rostros = 0
-        
         try:
-            cap = cv2.VideoCapture(self.stream_url)
-            if not cap.isOpened():
-                logging.error(f"❌ DEPURACIÓN: NO se pudo abrir el stream {self.stream_url}")
-                return
-            
-            logging.info(f"📹 DEPURACIÓN: Stream abierto correctamente - {self.stream_url}")
-            
             while self.monitoreando:
-                ret, frame = cap.read()
-                if not ret:
-                    logging.error(f"❌ DEPURACIÓN: Error leyendo frame del stream {self.stream_url}")
-                    time.sleep(1)
+                # Siempre el frame más fresco; los intermedios se descartan en el grabber
+                capturado = self.grabber.obtener_frame(self._ultimo_seq, timeout=5)
+                if capturado is None:
                     continue
+                seq, frame, timestamp = capturado
+                self._ultimo_seq = seq
                 
-                frames_procesados += 1
+                # Escena sin cambios desde el último análisis: no se detecta
+                if not self.motion_gate.hay_cambio(frame):
+                    if self.intervalo_deteccion:
+                        time.sleep(self.intervalo_deteccion)
+                    continue
                 
-                # Procesar solo cada 10 frames para reducir carga
-                if frames_procesados % 10 == 0:
-                    # ✅ AQUÍ SE DETECTAN ROSTROS - LOG PRINCIPAL
-                    rostros_detectados = self._detectar_rostros_solamente(frame)
-                    
-                    if rostros_detectados > 0:
-                        frames_con_rostros += 1
-                        
-                        # 🎯 LOG DETALLADO DE DETECCIÓN
-                        logging.info(f"👤 DEPURACIÓN: ¡ROSTRO(S) DETECTADO(S) EN STREAM!")
-                        logging.info(f"📊 DEPURACIÓN: Matrícula: {self.matricula_id}")
-                        logging.info(f"📊 DEPURACIÓN: Cantidad de rostros: {rostros_detectados}")
-                        logging.info(f"📊 DEPURACIÓN: Frame #{frames_procesados}")
-                        logging.info(f"📊 DEPURACIÓN: Frames con rostros hasta ahora: {frames_con_rostros}")
-                        logging.info(f"⏰ DEPURACIÓN: Timestamp: {datetime.now()}")
-                        
-                        # Actualizar estadísticas
-                        self.detecciones_hoy += 1
-                        self.ultima_deteccion = datetime.now()
-                        
-                        # Pausa para evitar spam de logs
-                        time.sleep(2)
-                    
-                    # Log periódico de estado (cada 100 frames)
-                    if frames_procesados % 100 == 0:
-                        logging.info(f"📈 DEPURACIÓN: Estado del stream {self.matricula_id} - Frames: {frames_procesados}, Con rostros: {frames_con_rostros}")
+                # ✅ AQUÍ SE DETECTAN ROSTROS - LOG PRINCIPAL
+                face_locations = self._detectar_rostros_solamente(frame)
+                self.procesar_deteccion(seq, timestamp, face_locations, frame)
                 
-                # Pequeña pausa para no sobrecargar
-                time.sleep(0.1)
+                # Pausa entre análisis; al despertar se toma el frame más reciente
+                if self.intervalo_deteccion:
+                    time.sleep(self.intervalo_deteccion)
                 
         except Exception as e:
             logging.error(f"❌ DEPURACIÓN: ERROR CRÍTICO en monitoreo de stream {self.matricula_id}: {str(e)}")
         
         finally:
-            if cap:
-                cap.release()
+            self.grabber.detener()
             logging.info(f"🔚 DEPURACIÓN: Monitoreo terminado para matrícula {self.matricula_id}")
 
+    def frame_pendiente(self):
+        """Indica si hay un frame nuevo listo para analizar (usado por el planificador)."""
+        if not self.monitoreando or self.grabber is None:
+            return False
+        if self._ultimo_analisis is not None and time.monotonic() - self._ultimo_analisis < self.intervalo_deteccion:
+            return False
+        return self.grabber.hay_frame_nuevo(self._ultimo_seq)
+
+    def tomar_frame(self):
+        """
+        Toma el frame más reciente sin bloquear (usado por el planificador).
+        
+        Retorna None si la compuerta de movimiento determina que la escena no
+        cambió desde el último frame analizado.
+        """
+        capturado = self.grabber.obtener_frame(self._ultimo_seq, timeout=0)
+        if capturado is None:
+            return None
+        self._ultimo_seq = capturado[0]
+        self._ultimo_analisis = time.monotonic()
+        if not self.motion_gate.hay_cambio(capturado[1]):
+            return None
+        return capturado
+
+    def procesar_deteccion(self, seq, timestamp, face_locations, frame=None):
+        """
+        Procesa el resultado de la detección de un frame: estadísticas, tracking
+        y, si el reconocimiento está activo, encoding de los tracks sin identidad.
+        """
+        rostros_detectados = len(face_locations)
+        self.frames_analizados += 1
+        
+        # Asociar cada rostro con su track (persona seguida entre frames); un
+        # cambio de stream reemplaza el tracker, este resultado sigue con el suyo
+        tracker = self.tracker
+        tracks = tracker.actualizar(face_locations)
+        tracks_nuevos = sum(1 for track in tracks if track.apariciones == 1)
+        
+        # Latencia frame -> decisión (acotada por el tiempo de detección)
+        latencia_ms = (time.monotonic() - timestamp) * 1000
+        self.latencia_ultima_ms = round(latencia_ms, 1)
+        self.latencia_max_ms = max(self.latencia_max_ms or 0, self.latencia_ultima_ms)
+        
+        if rostros_detectados > 0:
+            self.frames_con_rostros += 1
+            
+            # 🎯 LOG DETALLADO DE DETECCIÓN
+            logging.info(f"👤 DEPURACIÓN: ¡ROSTRO(S) DETECTADO(S) EN STREAM!")
+            logging.info(f"📊 DEPURACIÓN: Matrícula: {self.matricula_id}")
+            logging.info(f"📊 DEPURACIÓN: Cantidad de rostros: {rostros_detectados} ({tracks_nuevos} nuevo(s) en escena)")
+            logging.info(f"📊 DEPURACIÓN: Frame #{seq} (latencia {self.latencia_ultima_ms} ms)")
+            logging.info(f"📊 DEPURACIÓN: Frames con rostros hasta ahora: {self.frames_con_rostros}")
+            logging.info(f"⏰ DEPURACIÓN: Timestamp: {datetime.now()}")
+            
+            # Actualizar estadísticas
+            self.detecciones_hoy += 1
+            self.ultima_deteccion = datetime.now()
+        
+        # Solo se codifican los tracks nuevos o sin identidad confirmada
+        if self.reconocimiento and frame is not None and tracks:
+            self._reconocer(tracker, frame, face_locations, tracks)
+        
+        # Log periódico de estado (cada 100 frames analizados)
+        if self.frames_analizados % 100 == 0:
+            logging.info(f"📈 DEPURACIÓN: Estado del stream {self.matricula_id} - Analizados: {self.frames_analizados}, Con rostros: {self.frames_con_rostros}, Descartados: {self.grabber.frames_descartados}")
+
+    def _reconocer(self, tracker, frame, face_locations, tracks):
+        """Calcula encodings de los tracks que lo necesitan y los compara con la galería."""
+        if not len(self.galeria):
+            return
+        
+        indices = tracker.seleccionar_para_encoding(tracks)
+        if not indices:
+            return
+        
+        cajas = [face_locations[i] for i in indices]
+        seleccion = [tracks[i] for i in indices]
+        
+        def _al_codificar(encodings):
+            self._identificar(tracker, seleccion, encodings)
+        
+        if self.scheduler is not None:
+            # El encoding corre en el pool y se descuenta del presupuesto de CPU de la cámara;
+            # mientras tanto los frames siguientes no vuelven a pedirlo para los mismos tracks
+            tracker.marcar_pendientes(seleccion)
+            if not self.scheduler.solicitar_encodings(self.matricula_id, frame, cajas, _al_codificar):
+                tracker.desmarcar_pendientes(seleccion)
+                self.encodings_diferidos += len(cajas)
+        else:
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            _al_codificar(face_recognition.face_encodings(
+                rgb_frame, known_face_locations=cajas, **obtener_perfil(self.perfil_encoding)
+            ))
+
+    def _identificar(self, tracker, tracks, encodings):
+        """Asigna identidades a los tracks y reporta las asistencias nuevas."""
+        galeria = self.galeria
+        
+        # Un rostro ya confirmado en otro track visible no puede asignarse de nuevo
+        # (copia: el hilo de detección puede estar actualizando los tracks)
+        ocupados = {
+            track.rostro_id for track in list(tracker.tracks.values())
+            if track.confirmado and track not in tracks
+        }
+        coincidencias = {
+            cara: (galeria.id_de(indice), dist)
+            for cara, indice, dist in galeria.match_indices(encodings, self.recognition_threshold)
+        }
+        
+        ahora = time.monotonic()
+        nuevas_asistencias = []
+        for i, track in enumerate(tracks):
+            rostro_id, dist = coincidencias.get(i, (None, None))
+            if rostro_id in ocupados:
+                rostro_id, dist = None, None
+            
+            tracker.registrar_identidad(track, rostro_id, dist)
+            if rostro_id is None or not track.confirmado:
+                continue
+            
+            self.rostros_reconocidos += 1
+            ultimo = self.asistencias_reportadas.get(rostro_id)
+            if ultimo is None or ahora - ultimo >= self.ventana_asistencia:
+                self.asistencias_reportadas[rostro_id] = ahora
+                nuevas_asistencias.append({"id": rostro_id, "dist": dist})
+        
+        if nuevas_asistencias:
+            logging.info(f"🎓 DEPURACIÓN: {len(nuevas_asistencias)} asistencia(s) reconocida(s) en stream - Matrícula {self.matricula_id}")
+            self._reportar_asistencias(nuevas_asistencias)
+
+    def _reportar_asistencias(self, rostros):
+        """Envía las asistencias a Laravel sin bloquear el pipeline de detección."""
+        timestamp = datetime.now().isoformat()
+        self.asistencias_enviadas += len(rostros)
+        if self.reportar is not None:
+            self.reportar(self.matricula_id, rostros, timestamp)
+            return
+        threading.Thread(
+            target=reportar_asistencias,
+            args=(self.matricula_id, rostros, timestamp, self.laravel_api_url),
+            daemon=True
+        ).start()
+
     def _detectar_rostros_solamente(self, frame):
         """Detecta rostros en un frame SIN HACER COMPARACIONES."""
         try:
@@ -160,28 +436,158 @@ class SalonData:
             rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             
             # Detectar ubicaciones de rostros (más rápido que encodings)
-            face_locations = face_recognition.face_locations(rgb_frame)
-            
-            return len(face_locations)
+            return obtener_detector(self.detector).detectar(rgb_frame)
             
         except Exception as e:
             logging.error(f"❌ DEPURACIÓN: Error detectando rostros: {str(e)}")
-            return 0
+            return []
+
+    def _refrescar_galeria(self):
+        """Revalida la galería (consulta condicional: si nada cambió Laravel no reenvía rostros)."""
+        if self.monitoreando:
+            logging.info(f"🔄 DEPURACIÓN: ACTUALIZACIÓN AUTOMÁTICA DE CACHE - matrícula {self.matricula_id}")
+            self.cargar_rostros(refrescar=True)
 
     def _cache_thread(self):
-        """Thread para actualizar cache de rostros cada 30 minutos."""
+        """Thread para revalidar el cache de rostros (modo sin planificador de tareas)."""
         logging.info(f"🔄 DEPURACIÓN: INICIANDO THREAD DE CACHE para matrícula {self.matricula_id}")
         
         while self.monitoreando:
-            time.sleep(1800)  # 30 minutos
-            if self.monitoreando:  # Verificar que sigue activo
-                logging.info(f"🔄 DEPURACIÓN: ACTUALIZACIÓN AUTOMÁTICA DE CACHE - matrícula {self.matricula_id}")
-                self.cargar_rostros()
+            self._detenido.wait(self.intervalo_refresco)
+            self._refrescar_galeria()
 
-    def detener_monitoreo(self):
-        """Detiene el monitoreo del salón."""
+    def reiniciar_estadisticas_diarias(self):
+        """Cierre del día: reinicia contadores diarios y olvida asistencias fuera de la ventana."""
+        self.detecciones_hoy = 0
+        ahora = time.monotonic()
+        self.asistencias_reportadas = {
+            rostro_id: momento for rostro_id, momento in self.asistencias_reportadas.items()
+            if ahora - momento < self.ventana_asistencia
+        }
+
+    def detener_monitoreo(self, timeout=5.0):
+        """Detiene el monitoreo del salón y espera (acotado) a que terminen sus hilos."""
         logging.info(f"🛑 DEPURACIÓN: DETENIENDO MONITOREO para matrícula {self.matricula_id}")
         self.monitoreando = False
+        self._detenido.set()
+        if self.tareas is not None:
+            self.tareas.cancelar(self._tarea_refresco)
+        if self.scheduler is not None:
+            self.scheduler.desregistrar(self.matricula_id)
+        if self.grabber:
+            self.grabber.detener(timeout)
+        for hilo in (self.stream_thread, self.cache_thread):
+            if hilo is not None and hilo is not threading.current_thread():
+                hilo.join(timeout)
+
+    def cambiar_stream(self, stream_url, timeout=5.0):
+        """
+        Cambia la URL del stream sin detener el salón.
+
+        Se abre un grabber nuevo y se reemplaza el anterior; la galería, las
+        asistencias reportadas y las estadísticas se conservan. Los tracks se
+        descartan porque pertenecen a la escena anterior.
+        """
+        if stream_url == self.stream_url:
+            return False
+        logging.info(f"🔀 DEPURACIÓN: Stream de matrícula {self.matricula_id}: {self.stream_url} -> {stream_url}")
+        self.stream_url = stream_url
+        if not self.monitoreando:
+            return True
+        
+        self._reemplazar_grabber(timeout)
+        return True
+
+    def cambiar_captura(self, opciones, timeout=5.0):
+        """
+        Aplica modo_captura, intervalo_captura y url_captura sin detener el salón.
+
+        Returns:
+            bool: True si la forma de captura cambió
+        """
+        anterior = (self.modo_captura, self.intervalo_captura, self._url_captura)
+        self._configurar_captura(opciones)
+        if (self.modo_captura, self.intervalo_captura, self._url_captura) == anterior:
+            return False
+        self.tracker.max_perdido = self._max_perdido_tracker()
+        logging.info(
+            f"🔀 DEPURACIÓN: Captura de matrícula {self.matricula_id}: {anterior[0]} -> {self.modo_captura}"
+            + (f" cada {self.intervalo_captura:g}s" if self.modo_captura == "snapshot" else "")
+        )
+        if self.monitoreando:
+            self._reemplazar_grabber(timeout)
+        return True
+
+    def _configurar_captura(self, opciones):
+        """
+        Lee las opciones de captura; un modo desconocido vuelve a "stream" y un
+        intervalo inválido al de defecto, sin interrumpir la sincronización.
+        """
+        modo = str(opciones.get("modo_captura") or "stream").strip().lower()
+        if modo not in MODOS_CAPTURA:
+            logging.warning(
+                f"⚠️ DEPURACIÓN: Modo de captura '{modo}' desconocido ({', '.join(MODOS_CAPTURA)}); "
+                f"matrícula {self.matricula_id} usa 'stream'"
+            )
+            modo = "stream"
+        self.modo_captura = modo
+        intervalo = opciones.get("intervalo_captura") or INTERVALO_CAPTURA_DEFECTO
+        try:
+            intervalo = float(intervalo)
+        except (TypeError, ValueError):
+            intervalo = float("nan")
+        if not math.isfinite(intervalo):
+            logging.warning(
+                f"⚠️ DEPURACIÓN: Intervalo de captura '{opciones.get('intervalo_captura')}' inválido; "
+                f"matrícula {self.matricula_id} usa {INTERVALO_CAPTURA_DEFECTO:g}s"
+            )
+            intervalo = INTERVALO_CAPTURA_DEFECTO
+        self.intervalo_captura = max(intervalo, 0.1)
+        self._url_captura = opciones.get("url_captura") or None
+
+    def _nuevo_tracker(self):
+        return FaceTracker(max_perdido=self._max_perdido_tracker())
+
+    def _max_perdido_tracker(self):
+        """
+        Segundos que un track sobrevive sin ser visto.
+
+        Con la escena quieta la compuerta de movimiento puede omitir frames
+        hasta `refresco_max` segundos, y entre análisis pasan al menos
+        `intervalo_deteccion` (o `intervalo_captura` en modo snapshot). Un
+        track debe sobrevivir a ese hueco para no recodificar a quien sigue
+        sentado en el mismo lugar.
+        """
+        intervalo = self.intervalo_deteccion or 0.0
+        if self.modo_captura == "snapshot":
+            intervalo = max(intervalo, self.intervalo_captura)
+        return self.motion_gate.refresco_max + 2 * intervalo + MARGEN_TRACKER
+
+    @property
+    def url_captura(self):
+        """URL que sondea el modo snapshot."""
+        return self._url_captura or url_captura_esp32(self.stream_url)
+
+    def _crear_grabber(self):
+        """Grabber según el modo de captura de la cámara."""
+        # Con planificador, cada frame nuevo despierta al despachador
+        aviso = self.scheduler.notificar if self.scheduler is not None else None
+        if self.modo_captura == "snapshot":
+            return SnapshotGrabber(self.url_captura, intervalo=self.intervalo_captura, al_llegar_frame=aviso)
+        return FrameGrabber(self.stream_url, al_llegar_frame=aviso)
+
+    def _reemplazar_grabber(self, timeout):
+        """Abre un grabber nuevo y detiene el anterior; los tracks son de la escena anterior."""
+        nuevo = self._crear_grabber()
+        nuevo.iniciar()
+        anterior = self.grabber
+        self._ultimo_seq = 0
+        self.grabber = nuevo
+        # Un tracker nuevo en una sola asignación: el hilo de detección puede
+        # estar recorriendo los tracks del anterior
+        self.tracker = self._nuevo_tracker()
+        if anterior:
+            anterior.detener(timeout)
 
     def obtener_estado(self):
         """Obtiene el estado actual del salón."""
@@ -189,21 +595,103 @@ class SalonData:
             "matricula_id": self.matricula_id,
             "codigo_matricula": self.codigo_matricula,
             "stream_url": self.stream_url,
-            "rostros_cargados": len(self.rostros_cache),
+            "rostros_cargados": len(self.galeria),
+            "galeria_bytes": self.galeria.nbytes,
             "ultimo_cache": self.ultimo_cache_rostros.isoformat() if self.ultimo_cache_rostros else None,
             "monitoreando": self.monitoreando,
             "detecciones_hoy": self.detecciones_hoy,
-            "ultima_deteccion": self.ultima_deteccion.isoformat() if self.ultima_deteccion else None
+            "ultima_deteccion": self.ultima_deteccion.isoformat() if self.ultima_deteccion else None,
+            "frames_analizados": self.frames_analizados,
+            "frames_con_rostros": self.frames_con_rostros,
+            "latencia_ultima_ms": self.latencia_ultima_ms,
+            "latencia_max_ms": self.latencia_max_ms,
+            "detector": self.detector,
+            "perfil_encoding": self.perfil_encoding,
+            "modo_captura": self.modo_captura,
+            "url_captura": self.url_captura if self.modo_captura == "snapshot" else None,
+            **(self.grabber.obtener_estado() if self.grabber else {}),
+            **self.motion_gate.obtener_estado(),
+            **self.tracker.obtener_estado(),
+            "reconocimiento": self.reconocimiento,
+            "rostros_reconocidos": self.rostros_reconocidos,
+            "asistencias_enviadas": self.asistencias_enviadas,
+            "encodings_diferidos": self.encodings_diferidos,
+            "planificacion": self.scheduler.obtener_estado_camara(self.matricula_id) if self.scheduler else None
         }
 
 
 class SalonManager:
-    def __init__(self, laravel_api_url, recognition_threshold):
+    """
+    Salones monitoreados y galerías de rostros por matrícula.
+
+    Con supervisar=False solo se ofrecen las galerías (obtener_rostros): no
+    se crean el pool de detección ni el planificador de tareas. Es el modo de
+    los workers web, donde los streams los atiende un proceso supervisor.
+    """
+
+    def __init__(self, laravel_api_url, recognition_threshold, galerias=None, indice=None, indice_path=None,
+                 intervalo_deteccion=1.0, detection_workers=None, opciones_por_defecto=None, outbox=None,
+                 cliente=None, intervalo_refresco=1800, registro_workers=8, espera_galerias=60.0,
+                 intervalo_sincronizacion=300, supervisar=True, compartidas=None, dueno_url=None):
         self.laravel_api_url = laravel_api_url
+        # Cliente HTTP keep-alive compartido (LaravelClient)
+        self.cliente = cliente or obtener_cliente()
+        # Refresco incremental (ETag / updated_since) de las galerías; los
+        # encodings de un estudiante inscrito en varias matrículas se guardan
+        # una sola vez en el pool del proceso (PooledGallery)
+        self.sincronizador = SincronizadorRostros(
+            laravel_api_url, cliente=self.cliente, galeria_vacia=lambda: PooledGallery.from_rostros([])
+        )
+        self.intervalo_refresco = intervalo_refresco
         self.recognition_threshold = recognition_threshold
+        self.intervalo_deteccion = intervalo_deteccion
+        # Opciones de cámara aplicadas cuando Laravel no indica otras
+        self.opciones_por_defecto = dict(opciones_por_defecto or {})
+        # Outbox de asistencias (AsistenciaOutbox) compartido con el endpoint "/"
+        self.outbox = outbox
+        
+        # Pool de detección compartido por todos los salones (un proceso por núcleo)
+        self.supervisar = supervisar
+        self.scheduler = None
+        if supervisar:
+            self.scheduler = DetectionScheduler(workers=detection_workers)
+            self.scheduler.iniciar()
+        self.galerias = galerias if galerias is not None else crear_cache_galerias()
+        
+        # Galerías compartidas entre procesos (SharedGalleryStore): sin dueno_url
+        # este proceso las publica; con dueno_url las lee y le pide al dueño
+        # (p.ej. el supervisor) las que faltan, sin consultar a Laravel
+        self.compartidas = compartidas
+        self.dueno_url = dueno_url
+        self._sesion_dueno = requests.Session() if dueno_url else None
+        
+        # Índice institucional (FaceIndex) alimentado con cada galería descargada
+        self.indice = indice
+        self.indice_path = indice_path
+        self._entrenando_indice = False
         self.salones = {}
+        # La sincronización periódica y POST /sistema/sincronizar no se solapan
+        self._sincronizacion_lock = threading.Lock()
+        # Verificar, construir e insertar un salón es un solo paso: dos registros
+        # simultáneos de la misma matrícula no dejan un SalonData huérfano
+        self._registro_lock = threading.Lock()
         self.auto_sync_active = False
         
+        # Carga de galerías de salones nuevos en paralelo (acotada para no saturar Laravel)
+        self._pool_registro = ThreadPoolExecutor(max_workers=registro_workers, thread_name_prefix="galeria")
+        # Segundos que una sincronización espera a que carguen las galerías nuevas
+        self.espera_galerias = espera_galerias
+        
+        # Tareas periódicas (refresco de galerías, sincronización, cierre diario): un temporizador
+        # y hilos a demanda, para que una tarea esperando a Laravel no frene a las demás
+        self.tareas = None
+        self.intervalo_sincronizacion = intervalo_sincronizacion
+        self._tarea_sincronizacion = None
+        if supervisar:
+            self.tareas = TaskScheduler()
+            self.tareas.iniciar()
+            self.tareas.programar(self._cierre_diario, segundos_hasta_medianoche, jitter=0, nombre="cierre-diario")
+        
         logging.info(f"🏢 DEPURACIÓN: SalonManager inicializado")
         logging.info(f"🌐 DEPURACIÓN: Laravel API URL: {laravel_api_url}")
         logging.info(f"🎯 DEPURACIÓN: Umbral de reconocimiento: {recognition_threshold}")
@@ -213,85 +701,323 @@ class SalonManager:
         if self.auto_sync_active:
             logging.warning("⚠️ Auto-sincronización ya está activa")
             return
+        if not self.supervisar:
+            logging.warning("⚠️ Auto-sincronización no disponible: este proceso no supervisa salones")
+            return
         
         self.auto_sync_active = True
         logging.info("🔄 DEPURACIÓN: INICIANDO AUTO-SINCRONIZACIÓN CON LARAVEL")
         
-        # Realizar sincronización inicial
+        # Realizar sincronización inicial; el índice se guarda ya para que los
+        # workers web no esperen a la primera sincronización periódica
         self.sincronizar_con_laravel()
+        self.guardar_indice()
         
-        # Thread para sincronización cada 5 minutos
-        sync_thread = threading.Thread(target=self._sync_worker)
-        sync_thread.daemon = True
-        sync_thread.start()
+        # Sincronización periódica en el planificador de tareas
+        self._tarea_sincronizacion = self.tareas.programar(
+            self._sincronizacion_periodica, self.intervalo_sincronizacion, jitter=0.1, nombre="sincronizacion"
+        )
         
         logging.info("✅ DEPURACIÓN: Auto-sincronización iniciada correctamente")
 
-    def _sync_worker(self):
-        """Worker thread para sincronización automática."""
-        while self.auto_sync_active:
-            time.sleep(300)  # 5 minutos
-            if self.auto_sync_active:
-                logging.info("🔄 DEPURACIÓN: SINCRONIZACIÓN AUTOMÁTICA CADA 5 MINUTOS")
-                self.sincronizar_con_laravel()
+    def detener_auto_sincronizacion(self):
+        """Detiene la sincronización automática."""
+        self.auto_sync_active = False
+        if self.tareas is not None:
+            self.tareas.cancelar(self._tarea_sincronizacion)
+        self._tarea_sincronizacion = None
+
+    def _sincronizacion_periodica(self):
+        """Tarea de sincronización automática."""
+        if self.auto_sync_active:
+            logging.info(f"🔄 DEPURACIÓN: SINCRONIZACIÓN AUTOMÁTICA CADA {self.intervalo_sincronizacion:g} SEGUNDOS")
+            self.sincronizar_con_laravel()
+            self.guardar_indice()
+
+    def _cierre_diario(self):
+        """Tarea de medianoche: reinicia las estadísticas diarias de todos los salones."""
+        logging.info("📅 DEPURACIÓN: Cierre diario de estadísticas de salones")
+        for salon in list(self.salones.values()):
+            salon.reiniciar_estadisticas_diarias()
 
     def sincronizar_con_laravel(self):
-        """Sincroniza salones con cámaras activas de Laravel."""
+        """
+        Sincroniza salones con cámaras activas de Laravel.
+
+        Reconcilia el conjunto de cámaras activas con los salones en ejecución:
+        registra las nuevas, detiene las que ya no están activas y cambia en
+        caliente la URL de las que cambiaron. Los salones nuevos empiezan a
+        monitorear de inmediato; sus galerías se cargan en paralelo y la
+        sincronización espera como máximo `espera_galerias` segundos.
+
+        Si Laravel no responde no se toca ningún salón. Una sincronización
+        pedida mientras corre otra espera a que termine.
+
+        Returns:
+            dict: exito, camaras, nuevos, eliminados, actualizados,
+            galerias_cargadas, galerias_pendientes y duracion_segundos
+        """
+        with self._sincronizacion_lock:
+            return self._sincronizar_con_laravel()
+
+    def _sincronizar_con_laravel(self):
         logging.info("🔄 DEPURACIÓN: INICIANDO SINCRONIZACIÓN CON LARAVEL")
+        inicio = time.monotonic()
+        resultado = {
+            "exito": False,
+            "camaras": 0,
+            "nuevos": [],
+            "eliminados": [],
+            "actualizados": [],
+            "galerias_cargadas": 0,
+            "galerias_pendientes": 0,
+            "duracion_segundos": None,
+        }
+        cargas = []  # Futures de las galerías de los salones nuevos de esta sincronización
         
         try:
             # ✅ OBTENER CÁMARAS ACTIVAS
-            camaras = get_camaras_activas(self.laravel_api_url)
+            camaras = get_camaras_activas(self.laravel_api_url, cliente=self.cliente)
+            
+            if camaras is None:
+                logging.warning("⚠️ DEPURACIÓN: No se obtuvieron cámaras activas de Laravel; salones sin cambios")
+                resultado["duracion_segundos"] = round(time.monotonic() - inicio, 3)
+                return resultado
+            
+            # Una conexión keep-alive por salón para los refrescos simultáneos
+            self.cliente.ajustar_pool(len(camaras))
+            
+            deseadas = {str(camara.get("matricula_id")): camara for camara in camaras}
             
-            if not camaras:
-                logging.warning("⚠️ DEPURACIÓN: No se obtuvieron cámaras activas de Laravel")
-                return False
+            # ✅ DETENER SALONES CUYA CÁMARA YA NO ESTÁ ACTIVA (en paralelo, cada uno espera a sus hilos)
+            sobrantes = [m for m in list(self.salones) if m not in deseadas]
+            for matricula_id, eliminado in zip(sobrantes, self._pool_registro.map(self.desregistrar_salon, sobrantes)):
+                if eliminado:
+                    resultado["eliminados"].append(matricula_id)
             
             # Procesar cada cámara
-            for camara in camaras:
-                matricula_id = str(camara.get("matricula_id"))
+            for matricula_id, camara in deseadas.items():
                 stream_url = camara.get("url_stream")
                 codigo_matricula = camara.get("matricula", {}).get("codigo_matricula", f"MAT_{matricula_id}")
+                opciones = extraer_opciones_camara(camara)
                 
                 logging.info(f"🔄 DEPURACIÓN: Procesando cámara - Matrícula: {matricula_id}, Stream: {stream_url}")
                 
-                if matricula_id not in self.salones:
+                salon = self.salones.get(matricula_id)
+                if salon is None:
                     # ✅ REGISTRAR NUEVO SALÓN
                     logging.info(f"➕ DEPURACIÓN: REGISTRANDO NUEVO SALÓN - Matrícula: {matricula_id}")
-                    self.registrar_salon(matricula_id, stream_url, codigo_matricula)
+                    carga = self._registrar_salon(matricula_id, stream_url, codigo_matricula, opciones)
+                    if carga is not None:
+                        resultado["nuevos"].append(matricula_id)
+                        cargas.append(carga)
+                    continue
+                
+                # ✅ ACTUALIZAR SALÓN EXISTENTE (sin perder galería ni estadísticas)
+                actualizado = False
+                if stream_url and salon.cambiar_stream(stream_url):
+                    actualizado = True
+                if salon.cambiar_captura({**self.opciones_por_defecto, **opciones}):
+                    actualizado = True
+                if codigo_matricula and codigo_matricula != salon.codigo_matricula:
+                    salon.codigo_matricula = codigo_matricula
+                    actualizado = True
+                if actualizado:
+                    resultado["actualizados"].append(matricula_id)
                 else:
-                    logging.info(f"✅ DEPURACIÓN: Salón ya existe - Matrícula: {matricula_id}")
+                    logging.info(f"✅ DEPURACIÓN: Salón sin cambios - Matrícula: {matricula_id}")
             
-            logging.info(f"✅ DEPURACIÓN: SINCRONIZACIÓN COMPLETADA - {len(camaras)} cámara(s) procesada(s)")
-            return True
+            # Esperar (acotado) las galerías de los salones nuevos, que ya están monitoreando
+            if cargas:
+                terminadas, pendientes = wait(cargas, timeout=self.espera_galerias)
+                resultado["galerias_cargadas"] = len(terminadas)
+                resultado["galerias_pendientes"] = len(pendientes)
+            
+            resultado["exito"] = True
+            resultado["camaras"] = len(camaras)
+            resultado["duracion_segundos"] = round(time.monotonic() - inicio, 3)
+            logging.info(
+                f"✅ DEPURACIÓN: SINCRONIZACIÓN COMPLETADA - {len(camaras)} cámara(s): "
+                f"{len(resultado['nuevos'])} nueva(s), {len(resultado['eliminados'])} eliminada(s), "
+                f"{len(resultado['actualizados'])} actualizada(s) en {resultado['duracion_segundos']}s"
+            )
+            return resultado
             
         except Exception as e:
             logging.error(f"❌ DEPURACIÓN: ERROR EN SINCRONIZACIÓN: {str(e)}")
-            return False
+            resultado["duracion_segundos"] = round(time.monotonic() - inicio, 3)
+            return resultado
 
-    def registrar_salon(self, matricula_id, stream_url, codigo_matricula=None):
-        """Registra un nuevo salón."""
-        if matricula_id in self.salones:
-            logging.warning(f"⚠️ DEPURACIÓN: Salón {matricula_id} ya está registrado")
-            return False
-        
+    def registrar_salon(self, matricula_id, stream_url, codigo_matricula=None, opciones=None):
+        """
+        Registra un nuevo salón.
+
+        El monitoreo empieza de inmediato; la galería de rostros se carga en el
+        pool de registro y se intercambia en caliente al terminar.
+        """
+        return self._registrar_salon(matricula_id, stream_url, codigo_matricula, opciones) is not None
+
+    def _registrar_salon(self, matricula_id, stream_url, codigo_matricula=None, opciones=None):
+        """Registra un salón; retorna el Future de la carga de su galería o None si falló."""
+        with self._registro_lock:
+            if matricula_id in self.salones:
+                logging.warning(f"⚠️ DEPURACIÓN: Salón {matricula_id} ya está registrado")
+                return None
+            salon_data = self._crear_salon(matricula_id, stream_url, codigo_matricula, opciones)
+            if salon_data is None:
+                return None
+            self.salones[matricula_id] = salon_data
+        carga = self._cargar_galeria(salon_data)
+        logging.info(f"✅ DEPURACIÓN: Salón {matricula_id} registrado exitosamente")
+        return carga
+
+    def _crear_salon(self, matricula_id, stream_url, codigo_matricula=None, opciones=None):
+        """SalonData nuevo (ya monitoreando) o None si no se pudo crear."""
         logging.info(f"➕ DEPURACIÓN: REGISTRANDO SALÓN - Matrícula: {matricula_id}")
         
         try:
-            salon_data = SalonData(
+            return SalonData(
                 matricula_id=matricula_id,
                 stream_url=stream_url,
                 laravel_api_url=self.laravel_api_url,
                 recognition_threshold=self.recognition_threshold,
-                codigo_matricula=codigo_matricula
+                codigo_matricula=codigo_matricula,
+                obtener_rostros=self.obtener_rostros,
+                intervalo_deteccion=self.intervalo_deteccion,
+                intervalo_refresco=self.intervalo_refresco,
+                scheduler=self.scheduler,
+                opciones={**self.opciones_por_defecto, **(opciones or {})},
+                reportar=self.outbox.encolar if self.outbox is not None else None,
+                cargar_al_iniciar=False,
+                tareas=self.tareas
             )
-            
-            self.salones[matricula_id] = salon_data
-            logging.info(f"✅ DEPURACIÓN: Salón {matricula_id} registrado exitosamente")
-            return True
-            
         except Exception as e:
             logging.error(f"❌ DEPURACIÓN: Error registrando salón {matricula_id}: {str(e)}")
+            return None
+
+    def _cargar_galeria(self, salon_data):
+        """Carga la galería de un salón en el pool de registro; retorna el Future."""
+        return self._pool_registro.submit(salon_data.cargar_rostros)
+
+    def obtener_rostros(self, matricula_id, refrescar=False):
+        """
+        Obtiene los rostros de una matrícula a través del cache compartido.
+
+        Si la matrícula tiene un salón monitoreando, reutiliza la misma entrada
+        del cache; solicitudes concurrentes de la misma matrícula comparten una
+        única descarga desde Laravel. Al expirar o refrescar se hace una
+        consulta incremental sobre la galería anterior.
+
+        Returns:
+            PooledGallery: galería de la matrícula sobre el pool de encodings
+            (FaceGallery mapeada de la memoria compartida si el proceso lee
+            las galerías de un dueño)
+        """
+        if self.compartidas is not None and self.dueno_url:
+            galeria = self._obtener_compartida(matricula_id, refrescar)
+            if galeria is not None:
+                return galeria
+        return self.galerias.get(
+            str(matricula_id),
+            lambda anteriores: self._descargar_rostros(matricula_id, anteriores),
+            refrescar=refrescar,
+        )
+
+    def _obtener_compartida(self, matricula_id, refrescar=False):
+        """
+        Galería publicada por el dueño; si falta o venció se la pide al dueño.
+
+        Retorna None si el dueño no responde y no hay versión publicada, o si
+        la publicó pero no se pudo mapear (se descarga localmente como último
+        recurso).
+        """
+        galeria = None if refrescar else self.compartidas.obtener(matricula_id, max_edad=self.galerias.ttl)
+        if galeria is not None:
+            return galeria
+        try:
+            respuesta = self._sesion_dueno.post(
+                f"{self.dueno_url}/sistema/galerias/{matricula_id}",
+                params={"refrescar": "1"} if refrescar else None,
+                timeout=(3.05, 120),
+            )
+            respuesta.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"⚠️ DEPURACIÓN: Dueño de galerías no disponible ({self.dueno_url}): {str(e)}")
+            galeria = self.compartidas.obtener(matricula_id)
+            if galeria is None:
+                logging.warning(f"⚠️ DEPURACIÓN: Matrícula {matricula_id} se descargará desde este proceso")
+            return galeria
+        try:
+            publicada = respuesta.json().get("publicada")
+        except ValueError:
+            publicada = True  # Respuesta ilegible: se intenta mapear igual
+        if publicada is None:
+            return FaceGallery.from_rostros([])  # El dueño confirmó que está vacía
+
+        # El dueño pudo publicar otra versión justo entre su respuesta y el mapeo
+        for _ in range(2):
+            galeria = self.compartidas.obtener(matricula_id)
+            if galeria is not None:
+                return galeria
+        logging.warning(f"⚠️ DEPURACIÓN: Galería publicada de matrícula {matricula_id} no disponible; "
+                        f"se descargará desde este proceso")
+        return None
+
+    def publicar_galeria(self, matricula_id, refrescar=False):
+        """
+        Obtiene la galería (cache/Laravel) y se asegura de que esté publicada.
+
+        Returns:
+            dict: {"version", "filas", "verificado"} o None si está vacía
+        """
+        galeria = self.obtener_rostros(matricula_id, refrescar=refrescar)
+        if self.compartidas is None or not len(galeria):
+            return None
+        publicada = self.compartidas.publicada(matricula_id)
+        if publicada is None:
+            self.compartidas.publicar(matricula_id, galeria)
+            publicada = self.compartidas.publicada(matricula_id)
+        return publicada
+
+    def _descargar_rostros(self, matricula_id, anteriores=None):
+        """Actualiza la galería desde Laravel y aplica los cambios al índice institucional."""
+        galeria, cambiados, eliminados = self.sincronizador.sincronizar(matricula_id, anteriores)
+        
+        if self.compartidas is not None and not self.dueno_url and len(galeria):
+            # Sin cambios solo se renueva la marca de verificación
+            if galeria is not anteriores or not self.compartidas.verificar(matricula_id):
+                self.compartidas.publicar(matricula_id, galeria)
+        
+        if self.indice is not None and (cambiados or eliminados):
+            sin_encoding = [r.get("id") for r in cambiados if r.get("encoding") is None]
+            self.indice.remove(eliminados + sin_encoding)
+            validos = [r for r in cambiados if r.get("encoding") is not None]
+            self.indice.add([r["id"] for r in validos], [r["encoding"] for r in validos])
+            if self.indice.necesita_entrenamiento() and not self._entrenando_indice:
+                self._entrenando_indice = True
+                threading.Thread(target=self._entrenar_indice, daemon=True).start()
+        
+        return galeria
+
+    def _entrenar_indice(self):
+        """Entrena el índice en segundo plano y lo guarda en disco."""
+        try:
+            self.indice.entrenar()
+            self.guardar_indice()
+        except Exception as e:
+            logging.error(f"❌ DEPURACIÓN: Error entrenando índice: {str(e)}")
+        finally:
+            self._entrenando_indice = False
+
+    def guardar_indice(self):
+        """Guarda el índice institucional en disco si tuvo cambios."""
+        if self.indice is None or not self.indice_path or not self.indice.modificado:
+            return False
+        try:
+            self.indice.save(self.indice_path)
+            return True
+        except Exception as e:
+            logging.error(f"❌ DEPURACIÓN: Error guardando índice: {str(e)}")
             return False
 
     def obtener_salones_activos(self):
@@ -308,15 +1034,16 @@ class SalonManager:
         """Refresca rostros de un salón específico."""
         if matricula_id in self.salones:
             logging.info(f"🔄 DEPURACIÓN: REFRESCANDO ROSTROS MANUALMENTE - Matrícula: {matricula_id}")
-            self.salones[matricula_id].cargar_rostros()
+            self.salones[matricula_id].cargar_rostros(refrescar=True)
             return True
         return False
 
     def desregistrar_salon(self, matricula_id):
         """Desregistra un salón."""
-        if matricula_id in self.salones:
-            logging.info(f"🛑 DEPURACIÓN: DESREGISTRANDO SALÓN - Matrícula: {matricula_id}")
-            self.salones[matricula_id].detener_monitoreo()
-            del self.salones[matricula_id]
-            return True
-        return False
+        salon = self.salones.pop(matricula_id, None)
+        if salon is None:
+            return False
+        logging.info(f"🛑 DEPURACIÓN: DESREGISTRANDO SALÓN - Matrícula: {matricula_id}")
+        salon.detener_monitoreo()
+        self.sincronizador.olvidar(matricula_id)
+        return True
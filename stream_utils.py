@@ -3,19 +3,31 @@ Utilidades para procesamiento de streams de video.
 """
 
 import cv2
-import face_recognition
 import threading
 import time
 import logging
+from urllib.parse import urlsplit, urlunsplit
 
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
 
-def process_stream(stream_url):
+from face_detectors import obtener_detector
+
+
+# Formas de obtener frames de una cámara (opción por cámara "modo_captura")
+MODOS_CAPTURA = ("stream", "snapshot")
+
+
+def process_stream(stream_url, detector=None):
     """
     Procesa el stream para detectar rostros cada segundo.
     
     Args:
         stream_url: URL del stream de video
+        detector: Especificación del detector ("hog", "hog:2", "yunet", "haar")
     """
+    detector = obtener_detector(detector)
     cap = cv2.VideoCapture(stream_url)
 
     if not cap.isOpened():
@@ -33,7 +45,7 @@ def process_stream(stream_url):
             rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
             # Detectar rostros en el frame
-            face_locations = face_recognition.face_locations(rgb_frame)
+            face_locations = detector.detectar(rgb_frame)
             faces_count = len(face_locations)
 
             if faces_count > 0:
@@ -48,16 +60,318 @@ def process_stream(stream_url):
     cap.release()
 
 
-def start_stream_processing(stream_url):
+def start_stream_processing(stream_url, detector=None):
     """
     Inicia el procesamiento de stream en un hilo separado.
     
     Args:
         stream_url: URL del stream de video
+        detector: Especificación del detector (por defecto HOG)
         
     Returns:
         threading.Thread: El hilo creado para procesar el stream
     """
-    stream_thread = threading.Thread(target=process_stream, args=(stream_url,), daemon=True)
+    stream_thread = threading.Thread(target=process_stream, args=(stream_url, detector), daemon=True)
     stream_thread.start()
     return stream_thread
+
+
+class FrameGrabber:
+    """
+    Captura continua de un stream en un buffer de un solo frame.
+
+    Un hilo dedicado vacía el stream con cap.read() tan rápido como llegan
+    los frames y conserva solo el más reciente, de modo que el buffer interno
+    de OpenCV nunca acumula atraso. Los consumidores siempre reciben el frame
+    más fresco; los frames sobrescritos sin haber sido consumidos se cuentan
+    como descartados.
+
+    - al_llegar_frame: función sin argumentos que se llama con cada frame
+      nuevo (p.ej. DetectionScheduler.notificar, para despachar sin sondeo)
+    """
+
+    def __init__(self, stream_url, espera_reconexion=5.0, al_llegar_frame=None):
+        self.stream_url = stream_url
+        self.espera_reconexion = espera_reconexion
+        self.al_llegar_frame = al_llegar_frame
+
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._timestamp = None
+        self._consumido = True
+        self._activo = False
+        self._thread = None
+
+        # Estadísticas
+        self.frames_capturados = 0
+        self.frames_descartados = 0
+        self.conectado = False
+
+    def iniciar(self):
+        """Inicia el hilo de captura."""
+        if self._activo:
+            return
+        self._activo = True
+        self._thread = threading.Thread(target=self._capturar, daemon=True)
+        self._thread.start()
+
+    def detener(self, timeout=None):
+        """Detiene el hilo de captura y espera a que termine."""
+        self._activo = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread and timeout is not None:
+            self._thread.join(timeout)
+
+    def hay_frame_nuevo(self, ultimo_seq):
+        """Indica si hay un frame más nuevo que ultimo_seq."""
+        return self._seq > ultimo_seq
+
+    def obtener_frame(self, ultimo_seq=0, timeout=None):
+        """
+        Espera un frame más nuevo que ultimo_seq y lo retorna.
+
+        Returns:
+            tuple: (seq, frame, timestamp) o None si no llegó a tiempo
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > ultimo_seq or not self._activo, timeout):
+                return None
+            if self._seq <= ultimo_seq:
+                return None
+            self._consumido = True
+            return self._seq, self._frame, self._timestamp
+
+    def _capturar(self):
+        """Hilo de captura: abre el stream y publica siempre el último frame."""
+        while self._activo:
+            cap = cv2.VideoCapture(self.stream_url)
+            if not cap.isOpened():
+                logging.error(f"❌ DEPURACIÓN: NO se pudo abrir el stream {self.stream_url}")
+                cap.release()
+                time.sleep(self.espera_reconexion)
+                continue
+
+            self.conectado = True
+            logging.info(f"📹 DEPURACIÓN: Stream abierto correctamente - {self.stream_url}")
+
+            try:
+                while self._activo:
+                    ret, frame = cap.read()
+                    if not ret:
+                        logging.error(f"❌ DEPURACIÓN: Error leyendo frame del stream {self.stream_url}")
+                        break
+
+                    self._publicar(frame)
+            finally:
+                self.conectado = False
+                cap.release()
+
+            if self._activo:
+                time.sleep(self.espera_reconexion)
+
+    def _publicar(self, frame):
+        """Reemplaza el último frame y avisa a los consumidores."""
+        with self._cond:
+            if not self._consumido:
+                self.frames_descartados += 1
+            self._frame = frame
+            self._seq += 1
+            self._timestamp = time.monotonic()
+            self._consumido = False
+            self.frames_capturados += 1
+            self._cond.notify_all()
+        if self.al_llegar_frame is not None:
+            self.al_llegar_frame()
+
+    def obtener_estado(self):
+        """Estadísticas de captura."""
+        return {
+            "conectado": self.conectado,
+            "frames_capturados": self.frames_capturados,
+            "frames_descartados": self.frames_descartados,
+        }
+
+
+def url_captura_esp32(stream_url):
+    """
+    URL de la foto fija correspondiente a un stream de ESP32-CAM.
+
+    El firmware CameraWebServer sirve el MJPEG en http://<ip>:81/stream y un
+    JPEG suelto en http://<ip>/capture (puerto 80). En otras URLs solo se
+    reemplaza /stream por /capture conservando el puerto.
+    """
+    partes = urlsplit(stream_url)
+    ruta = partes.path[:-len("/stream")] if partes.path.endswith("/stream") else partes.path.rstrip("/")
+    host = partes.netloc
+    if partes.port == 81 and partes.path.endswith("/stream"):
+        host = host.rsplit(":", 1)[0]
+    return urlunsplit((partes.scheme, host, f"{ruta}/capture", "", ""))
+
+
+_sesion_capturas = None
+_sesion_capturas_lock = threading.Lock()
+
+
+def obtener_sesion_capturas():
+    """
+    Sesión HTTP keep-alive compartida por todas las cámaras en modo snapshot.
+
+    Un pool por cámara (host) con una sola conexión reutilizable: el ESP32
+    atiende pocas conexiones a la vez y abrir una por foto le cuesta un
+    handshake TCP por cada captura.
+    """
+    global _sesion_capturas
+    with _sesion_capturas_lock:
+        if _sesion_capturas is None:
+            sesion = requests.Session()
+            adaptador = HTTPAdapter(pool_connections=256, pool_maxsize=1, max_retries=0)
+            sesion.mount("http://", adaptador)
+            sesion.mount("https://", adaptador)
+            _sesion_capturas = sesion
+        return _sesion_capturas
+
+
+class SnapshotGrabber(FrameGrabber):
+    """
+    Captura por sondeo de la foto fija de la cámara (p.ej. /capture del ESP32-CAM).
+
+    En lugar de mantener el MJPEG abierto y decodificar cada frame (el ESP32
+    transmite a su máxima tasa aunque el análisis use uno de cada muchos),
+    pide un JPEG cada `intervalo` segundos por la sesión keep-alive
+    compartida, con timeout de conexión y de lectura. Misma interfaz que
+    FrameGrabber: los consumidores reciben siempre la última foto.
+    """
+
+    def __init__(self, url_captura, intervalo=1.0, timeout=(2.0, 5.0), espera_reconexion=5.0, sesion=None,
+                 al_llegar_frame=None):
+        super().__init__(url_captura, espera_reconexion=espera_reconexion, al_llegar_frame=al_llegar_frame)
+        self.intervalo = intervalo
+        self.timeout = timeout
+        self.sesion = sesion or obtener_sesion_capturas()
+
+        # Estadísticas
+        self.errores_captura = 0
+        self.bytes_recibidos = 0
+        self.latencia_captura_ms = None
+
+    def _capturar(self):
+        """Hilo de sondeo: pide una foto por intervalo y la publica como último frame."""
+        while self._activo:
+            inicio = time.monotonic()
+            espera = self.intervalo
+            try:
+                frame = self._pedir_foto()
+                if frame is None:
+                    espera = max(self.intervalo, self.espera_reconexion)
+                else:
+                    self._publicar(frame)
+            except Exception as e:
+                # Un error inesperado no debe terminar el sondeo: se reintenta como una foto fallida
+                logging.exception(f"❌ DEPURACIÓN: Error inesperado capturando foto de {self.stream_url}: {str(e)}")
+                self.errores_captura += 1
+                espera = max(self.intervalo, self.espera_reconexion)
+
+            restante = espera - (time.monotonic() - inicio)
+            with self._cond:
+                self._cond.wait_for(lambda: not self._activo, max(0.0, restante))
+
+    def _pedir_foto(self):
+        """GET de la foto y decodificación a BGR; None si la cámara no respondió."""
+        inicio = time.monotonic()
+        try:
+            respuesta = self.sesion.get(self.stream_url, timeout=self.timeout)
+            respuesta.raise_for_status()
+            if not respuesta.content:
+                raise ValueError("la respuesta está vacía")
+            frame = cv2.imdecode(np.frombuffer(respuesta.content, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                raise ValueError("la respuesta no es una imagen válida")
+        except (requests.exceptions.RequestException, ValueError, cv2.error) as e:
+            self.errores_captura += 1
+            # Solo se registra el cambio de estado, no cada intento fallido
+            if self.conectado or self.errores_captura == 1:
+                logging.error(f"❌ DEPURACIÓN: Error obteniendo foto de {self.stream_url}: {str(e)}")
+            self.conectado = False
+            return None
+
+        self.latencia_captura_ms = round((time.monotonic() - inicio) * 1000, 1)
+        self.bytes_recibidos += len(respuesta.content)
+        if not self.conectado:
+            logging.info(f"📸 DEPURACIÓN: Cámara respondiendo en modo snapshot - {self.stream_url}")
+        self.conectado = True
+        return frame
+
+    def obtener_estado(self):
+        """Estadísticas de captura (incluye las del sondeo)."""
+        return {
+            **super().obtener_estado(),
+            "intervalo_captura": self.intervalo,
+            "errores_captura": self.errores_captura,
+            "bytes_recibidos": self.bytes_recibidos,
+            "latencia_captura_ms": self.latencia_captura_ms,
+        }
+
+
+class MotionGate:
+    """
+    Compuerta de movimiento barata para evitar detecciones innecesarias.
+
+    Compara una versión reducida en escala de grises del frame con la del
+    último frame analizado. Si la fracción de píxeles que cambiaron es menor
+    que `umbral_area`, la escena se considera estática y el frame se omite.
+    Cada `refresco_max` segundos se deja pasar un frame aunque no haya cambios.
+    """
+
+    def __init__(self, umbral_area=0.01, umbral_pixel=25, ancho=160, refresco_max=30.0):
+        self.umbral_area = umbral_area
+        self.umbral_pixel = umbral_pixel
+        self.ancho = ancho
+        self.refresco_max = refresco_max
+        self._referencia = None
+        self._ultimo_paso = None
+
+        # Estadísticas
+        self.omitidos = 0
+        self.aceptados = 0
+        self.ultimo_cambio = None
+
+    def _reducir(self, frame):
+        alto = max(1, int(frame.shape[0] * self.ancho / frame.shape[1]))
+        pequeno = cv2.resize(frame, (self.ancho, alto), interpolation=cv2.INTER_AREA)
+        if pequeno.ndim == 3:
+            pequeno = cv2.cvtColor(pequeno, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(pequeno, (5, 5), 0)
+
+    def hay_cambio(self, frame):
+        """Retorna True si el frame debe analizarse."""
+        reducido = self._reducir(frame)
+        ahora = time.monotonic()
+
+        if self._referencia is None or self._referencia.shape != reducido.shape:
+            cambio = 1.0
+        else:
+            diferencia = cv2.absdiff(reducido, self._referencia)
+            cambio = float((diferencia > self.umbral_pixel).mean())
+        self.ultimo_cambio = round(cambio, 4)
+
+        vencido = self._ultimo_paso is None or ahora - self._ultimo_paso >= self.refresco_max
+        if cambio < self.umbral_area and not vencido:
+            self.omitidos += 1
+            return False
+
+        # La referencia es siempre el último frame analizado
+        self._referencia = reducido
+        self._ultimo_paso = ahora
+        self.aceptados += 1
+        return True
+
+    def obtener_estado(self):
+        """Contadores de la compuerta."""
+        return {
+            "frames_omitidos_sin_movimiento": self.omitidos,
+            "frames_con_movimiento": self.aceptados,
+            "ultimo_cambio": self.ultimo_cambio,
+            "umbral_movimiento": self.umbral_area,
+        }
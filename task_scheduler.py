@@ -0,0 +1,200 @@
+"""
+Planificador compartido de tareas periódicas.
+
+Un único hilo temporizador mantiene un heap con la próxima ejecución de cada
+tarea y entrega las vencidas a un pool de hilos. Así la cantidad de hilos no
+crece con los salones: refrescar galerías, sincronizar cámaras o cerrar las
+estadísticas del día son entradas del heap, no hilos dormidos. El pool crea
+un hilo solo cuando todos los que tiene están ocupados: con tareas rápidas
+basta uno, y una tarea bloqueada en la red (la sincronización o un refresco
+esperando a Laravel hasta su plazo) no atrasa a las demás.
+
+Cada tarea puede cancelarse en cualquier momento y su intervalo lleva un
+jitter aleatorio para que las tareas equivalentes (p.ej. el refresco de 40
+galerías) no golpeen a Laravel en el mismo segundo.
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Tarea:
+    """Tarea periódica programada en un TaskScheduler."""
+
+    def __init__(self, funcion, intervalo, jitter, nombre):
+        self.funcion = funcion
+        self.intervalo = intervalo
+        self.jitter = jitter
+        self.nombre = nombre
+        self.cancelada = False
+        self.en_curso = False
+        self.proxima = None
+
+        # Estadísticas
+        self.ejecuciones = 0
+        self.errores = 0
+        self.ultima_duracion_ms = None
+        self.ultimo_atraso_ms = None
+
+    def cancelar(self):
+        """Cancela la tarea; si está ejecutándose, termina pero no se reprograma."""
+        self.cancelada = True
+
+    def siguiente_espera(self):
+        """Segundos hasta la próxima ejecución (con jitter)."""
+        intervalo = self.intervalo() if callable(self.intervalo) else self.intervalo
+        if self.jitter:
+            intervalo *= 1 + random.uniform(-self.jitter, self.jitter)
+        return max(0.0, intervalo)
+
+
+class TaskScheduler:
+    """
+    Heap de tareas periódicas con un hilo temporizador y un pool de ejecución.
+
+    - workers: tope de hilos que ejecutan tareas; se crean a demanda, así que
+      una tarea lenta no atrasa a las demás mientras haya menos de `workers`
+      bloqueadas a la vez
+
+    Una tarea nunca se solapa consigo misma: se reprograma al terminar, así
+    que nunca corren más tareas a la vez que las programadas.
+    """
+
+    def __init__(self, workers=32):
+        self.workers = workers
+        self._cond = threading.Condition()
+        self._heap = []
+        self._orden = itertools.count()
+        self._tareas = set()
+        self._activo = False
+        self._thread = None
+        self._pool = None
+
+    # === Ciclo de vida ===
+
+    def iniciar(self):
+        """Arranca el hilo temporizador."""
+        if self._activo:
+            return
+        self._activo = True
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tarea")
+        self._thread = threading.Thread(target=self._bucle, daemon=True)
+        self._thread.start()
+        logging.info(f"⏱️ DEPURACIÓN: Planificador de tareas iniciado con {self.workers} hilo(s)")
+
+    def detener(self, timeout=5.0):
+        """Detiene el temporizador y espera a las tareas en curso."""
+        with self._cond:
+            self._activo = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._pool:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+
+    # === Programación ===
+
+    def programar(self, funcion, intervalo, jitter=0.1, retraso_inicial=None, nombre=None):
+        """
+        Programa una tarea periódica.
+
+        Args:
+            funcion: Callable sin argumentos
+            intervalo: Segundos entre ejecuciones, o callable que los calcula
+                (p.ej. segundos hasta la medianoche)
+            jitter: Variación relativa aleatoria del intervalo (0.1 = ±10%)
+            retraso_inicial: Segundos hasta la primera ejecución (por defecto
+                un intervalo con jitter)
+            nombre: Nombre para logs y estado
+
+        Returns:
+            Tarea: objeto con cancelar()
+        """
+        tarea = Tarea(funcion, intervalo, jitter, nombre or getattr(funcion, "__name__", "tarea"))
+        espera = tarea.siguiente_espera() if retraso_inicial is None else retraso_inicial
+        with self._cond:
+            self._tareas.add(tarea)
+            self._encolar(tarea, time.monotonic() + espera)
+        return tarea
+
+    def cancelar(self, tarea):
+        """Cancela una tarea (equivale a tarea.cancelar())."""
+        if tarea is None:
+            return
+        tarea.cancelar()
+        with self._cond:
+            self._tareas.discard(tarea)
+            self._cond.notify()
+
+    # === Internos ===
+
+    def _encolar(self, tarea, momento):
+        tarea.proxima = momento
+        heapq.heappush(self._heap, (momento, next(self._orden), tarea))
+        self._cond.notify()
+
+    def _bucle(self):
+        while True:
+            with self._cond:
+                if not self._activo:
+                    return
+                # Las tareas canceladas se descartan al llegar a la cima
+                while self._heap and self._heap[0][2].cancelada:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                momento, _, tarea = self._heap[0]
+                ahora = time.monotonic()
+                if momento > ahora:
+                    self._cond.wait(momento - ahora)
+                    continue
+                heapq.heappop(self._heap)
+                tarea.en_curso = True
+
+            tarea.ultimo_atraso_ms = round((ahora - momento) * 1000, 1)
+            try:
+                self._pool.submit(self._ejecutar, tarea)
+            except RuntimeError:
+                # Pool cerrado durante el apagado
+                return
+
+    def _ejecutar(self, tarea):
+        inicio = time.monotonic()
+        try:
+            tarea.funcion()
+        except Exception as e:
+            tarea.errores += 1
+            logging.error(f"❌ DEPURACIÓN: Error en tarea {tarea.nombre}: {str(e)}")
+        finally:
+            tarea.ejecuciones += 1
+            tarea.ultima_duracion_ms = round((time.monotonic() - inicio) * 1000, 1)
+            with self._cond:
+                tarea.en_curso = False
+                if tarea.cancelada:
+                    self._tareas.discard(tarea)
+                elif self._activo:
+                    self._encolar(tarea, time.monotonic() + tarea.siguiente_espera())
+
+    # === Estado ===
+
+    def obtener_estado(self):
+        """Cantidad de tareas, ejecuciones y errores."""
+        with self._cond:
+            tareas = list(self._tareas)
+            ahora = time.monotonic()
+            proxima = min((t.proxima for t in tareas if not t.en_curso and t.proxima is not None), default=None)
+        return {
+            "tareas": len(tareas),
+            "en_curso": sum(1 for t in tareas if t.en_curso),
+            "ejecuciones": sum(t.ejecuciones for t in tareas),
+            "errores": sum(t.errores for t in tareas),
+            "atraso_max_ms": max((t.ultimo_atraso_ms or 0 for t in tareas), default=0),
+            "proxima_en_s": round(max(0.0, proxima - ahora), 1) if proxima is not None else None,
+            "workers": self.workers,
+        }
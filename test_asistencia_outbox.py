@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la bandeja de salida de asistencias (AsistenciaOutbox).
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+from asistencia_outbox import AsistenciaOutbox
+from laravel_simulado import LaravelSimulado
+
+
+class _Laravel:
+    """Función de envío de prueba: registra los lotes y responde según `resultado`."""
+
+    def __init__(self, resultado=True):
+        self.resultado = resultado
+        self.lotes = []
+
+    def __call__(self, matricula_id, rostros, captura, laravel_api_url):
+        self.lotes.append((matricula_id, sorted(r["id"] for r in rostros), captura))
+        return self.resultado(matricula_id, rostros) if callable(self.resultado) else self.resultado
+
+
+def _outbox(directorio, enviar, **kwargs):
+    return AsistenciaOutbox(os.path.join(directorio, "outbox.db"), "http://laravel.local", enviar=enviar, **kwargs)
+
+
+def test_agrupa_por_matricula():
+    """Los eventos de una matrícula viajan en un solo registro masivo, sin rostros repetidos."""
+    directorio = tempfile.mkdtemp()
+    try:
+        laravel = _Laravel()
+        outbox = _outbox(directorio, laravel)
+        outbox.encolar(7, [{"id": 1, "dist": 0.5}], "2025-07-14T10:30:00")
+        outbox.encolar(7, [{"id": 1, "dist": 0.3}, {"id": 2, "dist": 0.4}], "2025-07-14T10:30:05")
+        outbox.encolar(8, [{"id": 3, "dist": 0.4}], "2025-07-14T10:30:01")
+
+        assert outbox.flush() == 2
+        assert sorted(laravel.lotes) == [
+            ("7", [1, 2], "2025-07-14T10:30:00"),
+            ("8", [3], "2025-07-14T10:30:01"),
+        ]
+        assert outbox.profundidad() == 0 and outbox.stats()["enviados"] == 3
+        print("✅ Eventos agrupados por matrícula")
+    finally:
+        shutil.rmtree(directorio)
+
+
+def test_lote_conserva_el_cuerpo_de_registro_masivo():
+    """Un lote agrupado llega a Laravel con la misma forma que un envío directo."""
+    directorio = tempfile.mkdtemp()
+    laravel = LaravelSimulado(rostros=0)
+    try:
+        outbox = AsistenciaOutbox(os.path.join(directorio, "outbox.db"), laravel.url)
+        outbox.encolar(7, [{"id": 1, "dist": 0.5}], "2025-07-14T10:30:00")
+        outbox.encolar(7, [{"id": 1, "dist": 0.3}, {"id": 2, "dist": 0.4}], "2025-07-14T10:30:05")
+        assert outbox.flush() == 1
+        assert laravel.asistencias == [{
+            "matricula_id": "7",
+            "rostros_detectados": [{"id": 1, "dist": 0.3}, {"id": 2, "dist": 0.4}],
+            "captura": "2025-07-14T10:30:00",
+        }]
+        assert outbox.stats()["descartadas"] == 0
+        print("✅ Registro masivo con la forma original")
+    finally:
+        laravel.detener()
+        shutil.rmtree(directorio)
+
+
+def test_eventos_nuevos_no_se_suman_a_un_lote_fallido():
+    """Un lote que falló se reintenta solo; los eventos nuevos no heredan su backoff."""
+    directorio = tempfile.mkdtemp()
+    try:
+        laravel = _Laravel(resultado=False)
+        outbox = _outbox(directorio, laravel, backoff_base=3600)
+        outbox.encolar(7, [{"id": 1}], "2025-07-14T10:30:00")
+        assert outbox._enviar_pendientes() == 0
+
+        # El lote fallido espera su backoff; el evento nuevo sale por separado
+        laravel.resultado = True
+        outbox.encolar(7, [{"id": 2}], "2025-07-14T10:31:00")
+        assert outbox._enviar_pendientes() == 1
+        assert laravel.lotes[-1] == ("7", [2], "2025-07-14T10:31:00")
+        assert outbox.profundidad() == 1
+
+        # Ignorando el backoff, cada grupo de intentos sigue siendo un lote propio
+        laravel.resultado = False
+        outbox.encolar(7, [{"id": 3}], "2025-07-14T10:32:00")
+        laravel.lotes.clear()
+        outbox.flush()
+        assert sorted(lote[1] for lote in laravel.lotes) == [[1], [3]]
+        print("✅ Eventos nuevos separados del lote fallido")
+    finally:
+        shutil.rmtree(directorio)
+
+
+def test_rechazos_y_reintentos_agotados_se_descartan():
+    """Un 4xx descarta solo los eventos inválidos; max_intentos corta los reintentos."""
+    directorio = tempfile.mkdtemp()
+    try:
+        # Laravel rechaza cualquier lote que incluya al rostro 99
+        laravel = _Laravel(resultado=lambda m, rostros: None if any(r["id"] == 99 for r in rostros) else True)
+        outbox = _outbox(directorio, laravel)
+        outbox.encolar(7, [{"id": 1}], "2025-07-14T10:30:00")
+        outbox.encolar(7, [{"id": 99}], "2025-07-14T10:30:01")
+        outbox.encolar(7, [{"id": 2}], "2025-07-14T10:30:02")
+        outbox.flush()
+        stats = outbox.stats()
+        assert stats["pendientes"] == 0 and stats["descartadas"] == 1 and stats["enviados"] == 2
+
+        laravel = _Laravel(resultado=False)
+        outbox = _outbox(directorio, laravel, max_intentos=3)
+        outbox.encolar(8, [{"id": 5}], "2025-07-14T10:31:00")
+        for _ in range(3):
+            outbox.flush()
+        stats = outbox.stats()
+        assert stats["pendientes"] == 0 and stats["descartadas"] == 2
+        assert len(laravel.lotes) == 3
+
+        motivos = outbox._conexion().execute(
+            "SELECT motivo FROM asistencias_descartadas ORDER BY id"
+        ).fetchall()
+        assert [m[0] for m in motivos] == ["rechazado", "intentos_agotados"]
+        print("✅ Rechazos y reintentos agotados descartados")
+    finally:
+        shutil.rmtree(directorio)
+
+
+def test_detener_no_vacia_con_envio_en_curso():
+    """Si el hilo de envío sigue ocupado al detener, no se envía el mismo lote otra vez."""
+    directorio = tempfile.mkdtemp()
+    liberar = threading.Event()
+    enviando = threading.Event()
+
+    def _lento(matricula_id, rostros, captura, laravel_api_url):
+        enviando.set()
+        liberar.wait(30)
+        return True
+
+    try:
+        laravel = _Laravel(resultado=lambda m, r: _lento(m, r, None, None))
+        outbox = _outbox(directorio, laravel, intervalo=0.01)
+        outbox.iniciar()
+        outbox.encolar(7, [{"id": 1}], "2025-07-14T10:30:00")
+        assert enviando.wait(5)
+
+        outbox._thread.join = lambda timeout=None: None  # El hilo no termina a tiempo
+        outbox.detener()
+        assert len(laravel.lotes) == 1
+
+        liberar.set()
+        threading.Thread.join(outbox._thread, 5)
+        assert outbox.profundidad() == 0 and len(laravel.lotes) == 1
+        print("✅ Detener no duplica un envío en curso")
+    finally:
+        liberar.set()
+        shutil.rmtree(directorio)
+
+
+def main():
+    print("🧪 Pruebas del outbox de asistencias")
+    print("=" * 60)
+    test_agrupa_por_matricula()
+    test_lote_conserva_el_cuerpo_de_registro_masivo()
+    test_eventos_nuevos_no_se_suman_a_un_lote_fallido()
+    test_rechazos_y_reintentos_agotados_se_descartan()
+    test_detener_no_vacia_con_envio_en_curso()
+    print("=" * 60)
+    print("🎯 Pruebas finalizadas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Pruebas del planificador de detección compartido (DetectionScheduler).
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+import detection_scheduler
+from detection_scheduler import DetectionScheduler
+
+
+def _detectar_o_morir(frame, detector=None):
+    """Detector de prueba: un frame blanco mata al proceso (como el OOM killer)."""
+    if frame[0, 0, 0] == 255:
+        os._exit(1)
+    return [(1, 2, 3, 0)], 0.001
+
+
+def _codificar_lento(frame, face_locations, perfil=None):
+    """Encoding de prueba que ocupa el proceso un rato."""
+    time.sleep(0.3)
+    return [np.zeros(128) for _ in face_locations], 0.3
+
+
+class _Fuente:
+    """Fuente mínima: una cola de frames y las detecciones recibidas."""
+
+    def __init__(self, planificador=None):
+        self.planificador = planificador
+        self._lock = threading.Lock()
+        self._frames = []
+        self.detecciones = []
+        self.procesado = threading.Event()
+
+    def poner(self, frame):
+        with self._lock:
+            self._frames.append(frame)
+        if self.planificador is not None:
+            self.planificador.notificar()
+
+    def frame_pendiente(self):
+        return bool(self._frames)
+
+    def tomar_frame(self):
+        with self._lock:
+            if not self._frames:
+                return None
+            return len(self.detecciones) + 1, self._frames.pop(0), time.monotonic()
+
+    def procesar_deteccion(self, seq, timestamp, face_locations, frame):
+        self.detecciones.append(face_locations)
+        self.procesado.set()
+
+
+def _esperar(condicion, timeout=10.0):
+    limite = time.monotonic() + timeout
+    while not condicion():
+        if time.monotonic() > limite:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_pool_roto_se_reemplaza():
+    """Un proceso muerto no deja a todas las cámaras sin detección."""
+    original = detection_scheduler.detectar_en_proceso
+    detection_scheduler.detectar_en_proceso = _detectar_o_morir
+    planificador = DetectionScheduler(workers=1, quantum=1.0)
+    try:
+        planificador.iniciar()
+        fuente = _Fuente(planificador)
+        planificador.registrar("a", fuente)
+
+        fuente.poner(np.full((4, 4, 3), 255, dtype=np.uint8))
+        assert _esperar(lambda: planificador.reinicios_pool == 1)
+        # Con hilos ya corriendo el reemplazo no se crea con fork
+        assert planificador.pool._mp_context.get_start_method() == "forkserver"
+        assert _esperar(lambda: planificador.obtener_estado()["en_vuelo"] == 0)
+
+        fuente.poner(np.zeros((4, 4, 3), dtype=np.uint8))
+        assert _esperar(lambda: len(fuente.detecciones) == 1)
+        assert planificador.obtener_estado_camara("a")["errores"] == 1
+        print(f"✅ Pool recreado: {planificador.obtener_estado()}")
+    finally:
+        planificador.detener()
+        detection_scheduler.detectar_en_proceso = original
+
+
+def test_aviso_despierta_al_despachador():
+    """Con notificar() el frame se despacha sin esperar el sondeo de respaldo."""
+    original = detection_scheduler.detectar_en_proceso
+    detection_scheduler.detectar_en_proceso = _detectar_o_morir
+    planificador = DetectionScheduler(workers=1, quantum=1.0)
+    planificador.ESPERA_SIN_AVISOS = 30.0
+    try:
+        planificador.iniciar()
+        fuente = _Fuente(planificador)
+        planificador.registrar("a", fuente)
+        time.sleep(0.2)  # El despachador queda esperando avisos
+
+        inicio = time.monotonic()
+        fuente.poner(np.zeros((4, 4, 3), dtype=np.uint8))
+        assert fuente.procesado.wait(5)
+        print(f"✅ Frame despachado en {(time.monotonic() - inicio) * 1000:.1f} ms tras el aviso")
+    finally:
+        planificador.detener()
+        detection_scheduler.detectar_en_proceso = original
+
+
+def test_encodings_cuentan_en_vuelo():
+    """Los encodings ocupan lugares del pool: no se encolan más que los procesos."""
+    original = detection_scheduler.codificar_en_proceso
+    detection_scheduler.codificar_en_proceso = _codificar_lento
+    planificador = DetectionScheduler(workers=1)
+    try:
+        planificador.iniciar()
+        planificador.registrar("a", _Fuente())
+        recibidos = []
+        caja = [(1, 2, 3, 0)]
+        assert planificador.solicitar_encodings("a", np.zeros((4, 4, 3), dtype=np.uint8), caja, recibidos.append)
+        assert planificador.obtener_estado()["en_vuelo"] == 1
+        # Con el único proceso ocupado el segundo pedido se difiere
+        assert not planificador.solicitar_encodings("a", np.zeros((4, 4, 3), dtype=np.uint8), caja, recibidos.append)
+
+        assert _esperar(lambda: planificador.obtener_estado()["en_vuelo"] == 0)
+        assert len(recibidos) == 1
+        assert planificador.solicitar_encodings("a", np.zeros((4, 4, 3), dtype=np.uint8), caja, recibidos.append)
+        assert _esperar(lambda: len(recibidos) == 2)
+        print("✅ Encodings dentro del límite de trabajos en vuelo")
+    finally:
+        planificador.detener()
+        detection_scheduler.codificar_en_proceso = original
+
+
+def main():
+    print("🧪 Planificador de detección")
+    print("=" * 60)
+    test_pool_roto_se_reemplaza()
+    test_aviso_despierta_al_despachador()
+    test_encodings_cuentan_en_vuelo()
+    print("=" * 60)
+    print("🎯 Pruebas finalizadas")
+
+
+if __name__ == "__main__":
+    main()
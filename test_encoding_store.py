@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Pruebas del almacén persistente de encodings de /faces (EncodingStore).
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from encoding_store import EncodingStore
+
+
+def _imagen(directorio, nombre, contenido=b"jpeg"):
+    path = os.path.join(directorio, f"{nombre}.jpg")
+    with open(path, "wb") as f:
+        f.write(contenido)
+    return path
+
+
+def _encoding(valor):
+    return np.full(128, valor, dtype=np.float32)
+
+
+def test_sincronizar_solo_codifica_cambios():
+    """Al reiniciar solo se codifican las imágenes nuevas o modificadas."""
+    directorio = tempfile.mkdtemp(prefix="faces_")
+    try:
+        for i in range(3):
+            _imagen(directorio, f"r{i}", bytes([i]) * 10)
+        codificadas = []
+
+        def codificar(path):
+            codificadas.append(os.path.basename(path))
+            return _encoding(len(codificadas))
+
+        assert len(EncodingStore(directorio).sincronizar(codificar)) == 3
+        _imagen(directorio, "r1", b"otra foto!")
+        rostros = EncodingStore(directorio).sincronizar(codificar)
+        assert codificadas[3:] == ["r1.jpg"] and np.allclose(rostros["r1"], 4)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def test_cambio_de_perfil_recalcula():
+    """Los rostros codificados con otro perfil se recalculan; sin perfil guardado valen como "rapido"."""
+    directorio = tempfile.mkdtemp(prefix="faces_")
+    try:
+        for i in range(3):
+            _imagen(directorio, f"r{i}", bytes([i]) * 10)
+        codificadas = []
+
+        def codificar(path):
+            codificadas.append(os.path.basename(path))
+            return _encoding(len(codificadas))
+
+        EncodingStore(directorio).sincronizar(codificar)
+        EncodingStore(directorio).sincronizar(codificar, perfil="rapido")
+        assert len(codificadas) == 3
+
+        store = EncodingStore(directorio)
+        store.sincronizar(codificar, perfil="registro")
+        assert len(codificadas) == 6
+        store.put("r3", _encoding(9), _imagen(directorio, "r3"), perfil="registro")
+        EncodingStore(directorio).sincronizar(codificar, perfil="registro")
+        assert len(codificadas) == 6
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def test_altas_y_bajas_incrementales():
+    """put agrega una fila y remove solo anota la baja; la matriz no se reescribe hasta compactar."""
+    directorio = tempfile.mkdtemp(prefix="faces_")
+    try:
+        store = EncodingStore(directorio, compactar_min=8)
+        for i in range(5):
+            store.put(f"r{i}", _encoding(i), _imagen(directorio, f"r{i}"))
+        generacion = store.generacion
+        store.put("r2", _encoding(20), _imagen(directorio, "r2"))
+        assert store.remove("r4") and not store.remove("r4")
+        assert store.generacion == generacion  # Sin reescritura
+        assert store.stats()["filas"] == 6 and store.stats()["filas_muertas"] == 2
+        assert np.allclose(store.obtener("r2"), 20) and store.obtener("r4") is None
+
+        # Otro proceso (o un reinicio) ve el mismo estado leyendo el diario
+        otro = EncodingStore(directorio)
+        assert sorted(otro.como_dict()) == ["r0", "r1", "r2", "r3"] and np.allclose(otro.obtener("r2"), 20)
+
+        # Al superar compactar_min líneas se escribe una generación sin filas muertas
+        for i in range(2):
+            store.put("r0", _encoding(100 + i), _imagen(directorio, "r0"))
+        assert store.generacion > generacion and store.stats()["filas_muertas"] == 0
+        assert otro.recargar() and np.allclose(otro.obtener("r0"), 101) and len(otro) == 4
+        assert sorted(os.listdir(directorio)).count(f"encodings.{generacion}.f32") == 0
+        print(f"✅ Almacén incremental: {store.stats()}")
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def test_linea_incompleta_se_ignora():
+    """Un corte a mitad de una línea del diario no invalida el almacén."""
+    directorio = tempfile.mkdtemp(prefix="faces_")
+    try:
+        store = EncodingStore(directorio)
+        store.put("a", _encoding(1), _imagen(directorio, "a"))
+        with open(os.path.join(directorio, f"encodings.{store.generacion}.log"), "ab") as f:
+            f.write(b'{"op": "put", "id": "b", "me')
+        reabierto = EncodingStore(directorio)
+        assert list(reabierto.como_dict()) == ["a"]
+        reabierto.put("c", _encoding(3), _imagen(directorio, "c"))
+        assert sorted(EncodingStore(directorio).como_dict()) == ["a", "c"]
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def test_escrituras_concurrentes_entre_procesos():
+    """Varios procesos escribiendo a la vez no pierden altas."""
+    directorio = tempfile.mkdtemp(prefix="faces_")
+    try:
+        codigo = (
+            "import sys, numpy as np; from encoding_store import EncodingStore\n"
+            "d, p = sys.argv[1], sys.argv[2]\n"
+            "s = EncodingStore(d, compactar_min=16)\n"
+            "for i in range(20):\n"
+            "    ruta = f'{d}/{p}{i}.jpg'; open(ruta, 'wb').write(b'x')\n"
+            "    s.put(f'{p}{i}', np.full(128, i, np.float32), ruta)\n"
+        )
+        procesos = [
+            subprocess.Popen([sys.executable, "-c", codigo, directorio, prefijo], cwd=os.getcwd())
+            for prefijo in "abcd"
+        ]
+        assert all(p.wait(60) == 0 for p in procesos)
+        rostros = EncodingStore(directorio).como_dict()
+        assert len(rostros) == 80 and np.allclose(rostros["c7"], 7)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def main():
+    print("🧪 Almacén de encodings")
+    print("=" * 60)
+    test_sincronizar_solo_codifica_cambios()
+    test_cambio_de_perfil_recalcula()
+    test_altas_y_bajas_incrementales()
+    test_linea_incompleta_se_ignora()
+    test_escrituras_concurrentes_entre_procesos()
+    print("=" * 60)
+    print("🎯 Pruebas finalizadas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la selección de detectores de rostros (obtener_detector).
+"""
+
+import face_detectors
+from face_detectors import obtener_detector, HaarDetector, YuNetDetector
+
+
+def test_especificaciones_normalizadas():
+    """Las variantes de una misma especificación comparten una instancia."""
+    hog = obtener_detector("hog")
+    assert hog.especificacion == "hog:1" and hog.upsample == 1
+    assert obtener_detector(" HOG:1.0 ") is hog
+    assert obtener_detector(None) is hog
+    assert obtener_detector("hog:2") is obtener_detector("hog:1.6")
+    print("✅ Especificaciones normalizadas")
+
+
+def test_parametros_fuera_de_rango_se_acotan():
+    """Un parámetro fuera de rango se lleva al límite y no crea detectores nuevos."""
+    assert obtener_detector("hog:50").upsample == 2
+    assert obtener_detector("hog:-3").upsample == 0
+    # YuNet y Haar necesitan modelos de OpenCV: se prueba solo su normalización
+    assert YuNetDetector.normalizar(5) == 0.99 and YuNetDetector.normalizar(0) == 0.01
+    assert YuNetDetector.normalizar(0.7123) == 0.71
+    assert HaarDetector.normalizar(1000) == 20 and HaarDetector.normalizar(0) == 1
+
+    antes = len(face_detectors._detectores)
+    for n in range(3, 200):
+        obtener_detector(f"hog:{n}")
+        obtener_detector(f"hog:{n / 7}")
+    assert len(face_detectors._detectores) - antes <= 1
+
+    for invalida in ("hog:nan", "hog:inf", "hog:uno", "cnn"):
+        try:
+            obtener_detector(invalida)
+            assert False, invalida
+        except ValueError:
+            pass
+    print(f"✅ Parámetros acotados: {len(face_detectors._detectores)} detector(es) en cache")
+
+
+def main():
+    print("🧪 Detectores de rostros")
+    print("=" * 60)
+    test_especificaciones_normalizadas()
+    test_parametros_fuera_de_rango_se_acotan()
+    print("=" * 60)
+    print("🎯 Pruebas finalizadas")
+
+
+if __name__ == "__main__":
+    main()
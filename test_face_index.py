@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Pruebas del índice IVF institucional (FaceIndex).
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from face_index import FaceIndex
+
+
+def _vectores(n, semilla=0):
+    return np.random.default_rng(semilla).standard_normal((n, 128)).astype(np.float32)
+
+
+def _exacto(vectores, consulta, k):
+    distancias = np.linalg.norm(vectores - consulta, axis=1)
+    return list(np.argsort(distancias)[:k])
+
+
+def test_busqueda_exacta_sin_entrenar():
+    """Sin entrenar, la búsqueda recorre todos los vectores y coincide con la exacta."""
+    vectores = _vectores(100)
+    indice = FaceIndex(min_entrenamiento=1000)
+    indice.add(list(range(100)), vectores)
+    resultado = indice.search(vectores[:5] + 0.01, k=3)
+    for i, vecinos in enumerate(resultado):
+        assert [rostro_id for rostro_id, _ in vecinos] == _exacto(vectores, vectores[i] + 0.01, 3)
+        assert vecinos[0][0] == i and vecinos[0][1] < 0.2
+
+
+def test_entrenado_nprobe_completo_es_exacto():
+    """Entrenado, nprobe = nlist equivale a la búsqueda exacta; nprobe bajo encuentra el propio vector."""
+    vectores = _vectores(3000)
+    indice = FaceIndex(min_entrenamiento=2048)
+    indice.add(list(range(3000)), vectores)
+    assert indice.necesita_entrenamiento()
+    indice.entrenar()
+    assert indice.stats()["entrenado"] and indice.nlist > 1
+
+    consultas = vectores[:20]
+    exactos = indice.search(consultas, k=5, nprobe=indice.nlist)
+    for i, vecinos in enumerate(exactos):
+        assert [rostro_id for rostro_id, _ in vecinos] == _exacto(vectores, consultas[i], 5)
+    aproximados = indice.search(consultas, k=1, nprobe=1)
+    assert all(vecinos[0][0] == i for i, vecinos in enumerate(aproximados))
+    print(f"✅ IVF: {indice.stats()}")
+
+
+def test_altas_bajas_y_k():
+    """Upsert por id, bajas, k fuera de rango y más candidatos pedidos que vectores."""
+    vectores = _vectores(10)
+    indice = FaceIndex()
+    indice.add(list(range(10)), vectores)
+    indice.add([3], vectores[7] + 0.001)  # El id 3 cambia de encoding
+    assert len(indice) == 10
+    assert {rostro_id for rostro_id, _ in indice.search(vectores[7], k=2)[0]} == {3, 7}
+    assert indice.remove([3, 42]) == 1 and len(indice) == 9
+    assert len(indice.search(vectores[0], k=50)[0]) == 9
+    for k in (0, -1):
+        try:
+            indice.search(vectores[0], k=k)
+        except ValueError:
+            continue
+        raise AssertionError(f"k={k} debería rechazarse")
+
+
+def test_guardar_y_cargar():
+    """El índice guardado conserva ids, vectores y el cuantizador."""
+    vectores = _vectores(3000, semilla=1)
+    indice = FaceIndex()
+    indice.add([f"r{i}" for i in range(3000)], vectores)
+    indice.entrenar()
+    path = os.path.join(tempfile.mkdtemp(prefix="indice_"), "indice.npz")
+    indice.save(path)
+    cargado = FaceIndex.load(path)
+    assert len(cargado) == 3000 and cargado.nlist == indice.nlist and not cargado.modificado
+    assert cargado.search(vectores[5], k=1)[0][0][0] == "r5"
+    os.remove(path)
+
+
+def main():
+    print("🧪 Índice IVF")
+    print("=" * 60)
+    test_busqueda_exacta_sin_entrenar()
+    test_entrenado_nprobe_completo_es_exacto()
+    test_altas_bajas_y_k()
+    test_guardar_y_cargar()
+    print("=" * 60)
+    print("🎯 Pruebas finalizadas")
+
+
+if __name__ == "__main__":
+    main()
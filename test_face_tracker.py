@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Pruebas del tracker de rostros (FaceTracker) y de su vida útil en un salón.
+"""
+
+from face_tracker import FaceTracker
+from salon_manager import SalonData, MARGEN_TRACKER
+
+
+def test_asociacion_entre_frames():
+    """Una caja que se desplaza conserva su track; una caja lejana crea otro."""
+    tracker = FaceTracker()
+    (a,) = tracker.actualizar([(100, 200, 200, 100)], ahora=0.0)
+    # Desplazamiento pequeño: IoU alta
+    (b,) = tracker.actualizar([(110, 210, 210, 110)], ahora=1.0)
+    assert b is a and a.apariciones == 2
+    # Salto con poco solape pero centroide cercano (frames espaciados)
+    (c,) = tracker.actualizar([(140, 250, 240, 150)], ahora=2.0)
+    assert c is a
+
+    c, d = tracker.actualizar([(140, 250, 240, 150), (400, 600, 500, 500)], ahora=3.0)
+    assert c is a and d is not a
+    assert tracker.obtener_estado()["tracks_creados"] == 2
+    print("✅ Asociación de cajas entre frames")
+
+
+def test_encoding_solo_hasta_confirmar():
+    """Un track se codifica hasta confirmar su identidad y luego reutiliza la identidad."""
+    tracker = FaceTracker(confirmaciones=2, reintento=2.0)
+    tracks = tracker.actualizar([(100, 200, 200, 100)], ahora=0.0)
+    assert tracker.seleccionar_para_encoding(tracks, ahora=0.0) == [0]
+    tracker.registrar_identidad(tracks[0], 7, 0.4, ahora=0.0)
+    assert not tracks[0].confirmado
+
+    # Antes del reintento no se vuelve a codificar
+    assert tracker.seleccionar_para_encoding(tracks, ahora=1.0) == []
+    assert tracker.seleccionar_para_encoding(tracks, ahora=2.0) == [0]
+    tracker.registrar_identidad(tracks[0], 7, 0.4, ahora=2.0)
+    assert tracks[0].confirmado and tracks[0].rostro_id == 7
+
+    assert tracker.seleccionar_para_encoding(tracks, ahora=10.0) == []
+    estado = tracker.obtener_estado()
+    assert estado["encodings_calculados"] == 2
+    assert estado["encodings_evitados"] == 2
+    print("✅ Encodings solo hasta confirmar la identidad")
+
+
+def test_encoding_pendiente_no_se_repite():
+    """Un track con un encoding en curso no se vuelve a seleccionar."""
+    tracker = FaceTracker(espera_pendiente=10.0)
+    tracks = tracker.actualizar([(100, 200, 200, 100)], ahora=0.0)
+    assert tracker.seleccionar_para_encoding(tracks, ahora=0.0) == [0]
+    tracker.marcar_pendientes(tracks, ahora=0.0)
+    assert tracker.seleccionar_para_encoding(tracks, ahora=1.0) == []
+
+    # Si el pedido no llegó a enviarse, el siguiente frame lo reintenta
+    tracker.desmarcar_pendientes(tracks)
+    assert tracker.seleccionar_para_encoding(tracks, ahora=1.0) == [0]
+
+    # Un resultado perdido no bloquea al track para siempre
+    tracker.marcar_pendientes(tracks, ahora=1.0)
+    assert tracker.seleccionar_para_encoding(tracks, ahora=10.0) == []
+    assert tracker.seleccionar_para_encoding(tracks, ahora=11.0) == [0]
+
+    tracker.registrar_identidad(tracks[0], None, ahora=11.5)
+    assert tracks[0].encoding_pendiente is None
+    print("✅ Encodings pendientes no se repiten")
+
+
+def test_tracks_perdidos_expiran():
+    """Un track no visto durante más de max_perdido se descarta."""
+    tracker = FaceTracker(max_perdido=5.0)
+    (a,) = tracker.actualizar([(100, 200, 200, 100)], ahora=0.0)
+    (b,) = tracker.actualizar([(100, 200, 200, 100)], ahora=5.0)
+    assert b is a
+    (c,) = tracker.actualizar([(100, 200, 200, 100)], ahora=10.5)
+    assert c is not a
+    print("✅ Tracks perdidos expiran")
+
+
+def test_vida_del_track_cubre_la_compuerta():
+    """
+    Con la escena quieta la compuerta omite frames hasta refresco_movimiento:
+    los tracks del salón deben sobrevivir a ese hueco.
+    """
+    salon = SalonData(1, "http://camara.local:81/stream", "http://laravel.local", 0.6,
+                      intervalo_deteccion=2.0, cargar_al_iniciar=False,
+                      opciones={"refresco_movimiento": 30})
+    salon.detener_monitoreo()
+    assert salon.tracker.max_perdido == 30 + 2 * 2.0 + MARGEN_TRACKER
+
+    (a,) = salon.tracker.actualizar([(100, 200, 200, 100)], ahora=0.0)
+    (b,) = salon.tracker.actualizar([(100, 200, 200, 100)], ahora=32.0)
+    assert b is a
+
+    # En modo snapshot manda el intervalo entre fotos si es mayor
+    assert salon.cambiar_captura({"modo_captura": "snapshot", "intervalo_captura": 5})
+    assert salon.tracker.max_perdido == 30 + 2 * 5.0 + MARGEN_TRACKER
+    print(f"✅ Vida del track: {salon.tracker.max_perdido:g}s")
+
+
+def main():
+    print("🧪 Pruebas del tracker de rostros")
+    print("=" * 60)
+    test_asociacion_entre_frames()
+    test_encoding_solo_hasta_confirmar()
+    test_encoding_pendiente_no_se_repite()
+    test_tracks_perdidos_expiran()
+    test_vida_del_track_cubre_la_compuerta()
+    print("=" * 60)
+    print("🎯 Pruebas finalizadas")
+
+
+if __name__ == "__main__":
+    main()
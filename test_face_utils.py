@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Pruebas de las galerías de rostros (FaceGallery, EncodingPool, PooledGallery)
+y de la decodificación de imágenes (reducción JPEG y orientación EXIF).
+"""
+
+import gc
+import json
+import struct
+
+import cv2
+import numpy as np
+
+from face_utils import (
+    FaceGallery, EncodingPool, PooledGallery, detect_faces_in_image, decodificar_imagen, escalar_ubicaciones,
+    obtener_perfil, MAX_JITTERS, calc_face_encoding, ImagenNoProcesable
+)
+
+
+def _rostros(n, desde=1):
+    return [
+        {"id": i, "encoding": [round(0.001 * i + 0.01 * d, 4) for d in range(128)]}
+        for i in range(desde, desde + n)
+    ]
+
+
+def test_galeria_vacia():
+    """Una matrícula sin rostros (o un error de red de Laravel) no coincide con nadie."""
+    consultas = np.full((2, 128), 0.1, dtype=np.float32)
+    for galeria in (FaceGallery.from_rostros([]), FaceGallery([], []), PooledGallery([], [], pool=EncodingPool())):
+        assert len(galeria) == 0 and galeria.matrix.shape == (0, 128)
+        assert galeria.match(consultas, 0.6) == [] and galeria.distances(consultas).shape == (2, 0)
+
+    vacia = FaceGallery.from_rostros([{"id": 1, "encoding": None}])
+    assert vacia.aplicar_cambios([{"id": 2, "encoding": [0.1] * 128}], []).match(consultas, 0.6)[0]["id"] == 2
+
+    _, jpeg = cv2.imencode(".jpg", np.full((120, 160, 3), 128, dtype=np.uint8))
+    resultado = detect_faces_in_image(jpeg.tobytes(), [], 0.6)
+    assert resultado["faces"] == []
+    print("✅ Galería vacía: sin coincidencias ni errores")
+
+
+def test_galeria_compacta():
+    """Los cambios producen una galería float32 nueva sin tocar la anterior."""
+    rostros = _rostros(50)
+    galeria = FaceGallery.from_rostros(rostros)
+    assert galeria.matrix.dtype == np.float32 and galeria.matrix.flags.c_contiguous
+    assert galeria.cambiados_en(rostros) == []
+
+    modificado = {"id": 3, "encoding": [v + 0.5 for v in rostros[2]["encoding"]]}
+    nuevo = {"id": 99, "encoding": [0.2] * 128}
+    cambiados = galeria.cambiados_en([modificado, nuevo] + rostros[3:])
+    assert [r["id"] for r in cambiados] == [3, 99]
+
+    nueva = galeria.aplicar_cambios(cambiados, [10])
+    assert sorted(nueva.lista_ids()) == sorted(set(range(1, 51)) - {10} | {99})
+    assert np.allclose(nueva.vector(nueva.posiciones()[3]), modificado["encoding"])
+    assert len(galeria) == 50  # La galería anterior no se modifica
+
+    lista_bytes = sum(len(json.dumps(r)) for r in rostros)
+    print(f"✅ Galería compacta: {galeria.nbytes} bytes (JSON: {lista_bytes} bytes)")
+    assert galeria.nbytes < 600 * len(galeria)
+
+
+def test_pool_compartido():
+    """Un mismo rostro en varias galerías ocupa una sola fila del pool."""
+    pool = EncodingPool(capacidad=4)
+    rostros = _rostros(10)
+    ids = [r["id"] for r in rostros]
+    matriz = np.array([r["encoding"] for r in rostros], dtype=np.float32)
+    galerias = [PooledGallery(ids, matriz, pool=pool) for _ in range(3)]
+    stats = pool.stats()
+    assert stats["rostros_distintos"] == 10 and stats["referencias"] == 30
+    assert np.array_equal(galerias[0].matrix, matriz)
+
+    cambiada = galerias[0].aplicar_cambios([{"id": 3, "encoding": [0.7] * 128}], [1])
+    assert pool.stats()["filas_en_uso"] == 11  # El encoding viejo sigue en uso por las otras galerías
+    assert np.allclose(cambiada.vector(cambiada.posiciones()[3]), 0.7)
+    assert not np.allclose(galerias[1].vector(galerias[1].posiciones()[3]), 0.7)
+
+    # La matriz se junta en la primera comparación y las siguientes la reutilizan,
+    # aunque el pool crezca y cambie su matriz entre medio
+    assert galerias[1].match(matriz[4:5], 0.1)[0]["id"] == 5
+    densa = galerias[1].matrix
+    PooledGallery(list(range(100, 110)), np.ones((10, 128), dtype=np.float32), pool=pool)
+    assert galerias[1].matrix is densa
+    assert galerias[1].match(matriz[4:5], 0.1)[0]["id"] == 5
+
+    del galerias, cambiada, densa
+    gc.collect()
+    assert pool.stats()["referencias"] == 0
+    print(f"✅ Pool: 3 galerías × 10 rostros en {stats['rostros_distintos']} fila(s)")
+
+
+def test_perfiles_de_encoding():
+    """registro:N acepta de 1 a MAX_JITTERS re-muestreos."""
+    assert obtener_perfil(None) == {"model": "small", "num_jitters": 1}
+    assert obtener_perfil("registro")["num_jitters"] == 10
+    assert obtener_perfil(f"registro:{MAX_JITTERS}")["num_jitters"] == MAX_JITTERS
+    for invalido in ("registro:0", f"registro:{MAX_JITTERS + 1}", "registro:1000000", "registro:-1", "cnn"):
+        try:
+            obtener_perfil(invalido)
+            assert False, invalido
+        except ValueError:
+            pass
+    print("✅ Perfiles de encoding acotados")
+
+
+def _jpeg(ancho, alto, orientacion=None, orden="MM"):
+    """JPEG con la esquina superior izquierda blanca y, opcionalmente, orientación EXIF."""
+    bgr = np.zeros((alto, ancho, 3), dtype=np.uint8)
+    bgr[: alto // 4, : ancho // 4] = 255
+    datos = cv2.imencode(".jpg", bgr, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+    if orientacion is None:
+        return datos
+    fmt = ">" if orden == "MM" else "<"
+    tiff = orden.encode() + struct.pack(fmt + "HI", 42, 8) + struct.pack(fmt + "H", 1)
+    tiff += struct.pack(fmt + "HHIHH", 0x0112, 3, 1, orientacion, 0) + struct.pack(fmt + "I", 0)
+    segmento = b"Exif\x00\x00" + tiff
+    return datos[:2] + b"\xff\xe1" + struct.pack(">H", len(segmento) + 2) + segmento + datos[2:]
+
+
+def test_decodificar_reduce_jpeg():
+    """Un JPEG grande se decodifica reducido y la escala lleva las cajas al original."""
+    imagen, escala = decodificar_imagen(_jpeg(2000, 1000), max_dim=500)
+    assert imagen.shape == (250, 500, 3) and escala == 4.0
+    assert escalar_ubicaciones([(10, 20, 30, 5)], escala) == [(40, 80, 120, 20)]
+
+    # Sin límite se conserva la resolución original
+    imagen, escala = decodificar_imagen(_jpeg(640, 480), max_dim=None)
+    assert imagen.shape == (480, 640, 3) and escala == 1.0
+
+    # Formatos sin reducción en el decodificador (PNG) se reducen después
+    png = cv2.imencode(".png", np.zeros((900, 1200, 3), dtype=np.uint8))[1].tobytes()
+    imagen, escala = decodificar_imagen(png, max_dim=600)
+    assert imagen.shape == (450, 600, 3) and escala == 2.0
+    print("✅ JPEG reducido al decodificar")
+
+
+def test_decodificar_aplica_orientacion_exif():
+    """La orientación EXIF (big y little endian) se aplica como la ve quien tomó la foto."""
+    def _blanca(imagen):
+        alto, ancho = imagen.shape[:2]
+        esquinas = {
+            "arriba_izquierda": imagen[: alto // 8, : ancho // 8],
+            "arriba_derecha": imagen[: alto // 8, -ancho // 8:],
+            "abajo_izquierda": imagen[-alto // 8:, : ancho // 8],
+            "abajo_derecha": imagen[-alto // 8:, -ancho // 8:],
+        }
+        return [nombre for nombre, zona in esquinas.items() if zona.mean() > 200]
+
+    imagen, _ = decodificar_imagen(_jpeg(400, 200), max_dim=None)
+    assert imagen.shape[:2] == (200, 400) and _blanca(imagen) == ["arriba_izquierda"]
+
+    casos = [
+        (3, "MM", (200, 400), "abajo_derecha"),
+        (6, "MM", (400, 200), "arriba_derecha"),   # Rotar 90° horario
+        (8, "II", (400, 200), "abajo_izquierda"),  # Rotar 90° antihorario
+        (2, "II", (200, 400), "arriba_derecha"),   # Espejo horizontal
+    ]
+    for orientacion, orden, forma, esquina in casos:
+        imagen, escala = decodificar_imagen(_jpeg(400, 200, orientacion, orden), max_dim=None)
+        assert imagen.shape[:2] == forma and _blanca(imagen) == [esquina], (orientacion, _blanca(imagen))
+        assert escala == 1.0
+
+    # Orientación fuera de rango: se ignora
+    imagen, _ = decodificar_imagen(_jpeg(400, 200, 9), max_dim=None)
+    assert _blanca(imagen) == ["arriba_izquierda"]
+    print("✅ Orientación EXIF aplicada")
+
+
+def test_errores_que_dependen_de_la_imagen():
+    """Sin rostros es ImagenNoProcesable (cacheable); un detector inexistente no lo es."""
+    negra = cv2.imencode(".png", np.zeros((64, 64, 3), dtype=np.uint8))[1].tobytes()
+    try:
+        calc_face_encoding(negra)
+        assert False, "una imagen sin rostros no tiene encoding"
+    except ImagenNoProcesable as e:
+        assert str(e) == "No face found in the image."
+
+    try:
+        calc_face_encoding(negra, detector="inexistente")
+        assert False, "el detector no existe"
+    except ImagenNoProcesable:
+        assert False, "un detector no disponible no depende de la imagen"
+    except ValueError:
+        pass
+    print("✅ Errores de imagen distinguidos de los transitorios")
+
+
+def main():
+    print("🧪 Galerías de rostros")
+    print("=" * 60)
+    test_galeria_vacia()
+    test_galeria_compacta()
+    test_pool_compartido()
+    test_perfiles_de_encoding()
+    test_decodificar_reduce_jpeg()
+    test_decodificar_aplica_orientacion_exif()
+    test_errores_que_dependen_de_la_imagen()
+    print("=" * 60)
+    print("🎯 Pruebas finalizadas")
+
+
+if __name__ == "__main__":
+    main()
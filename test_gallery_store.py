@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Pruebas del almacén de galerías compartidas entre procesos (SharedGalleryStore).
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from face_utils import FaceGallery
+from gallery_store import SharedGalleryStore
+
+
+def _galeria(n, desplazamiento=0.0):
+    ids = list(range(1, n + 1))
+    matriz = np.array([[0.001 * i + 0.01 * d + desplazamiento for d in range(128)] for i in ids], dtype=np.float32)
+    return FaceGallery(ids, matriz)
+
+
+def test_publicar_y_adjuntar():
+    """Los lectores mapean la versión publicada y ven las nuevas sin releer lo demás."""
+    directorio = tempfile.mkdtemp(prefix="galerias_")
+    try:
+        dueno = SharedGalleryStore(directorio, dueno=True)
+        lector = SharedGalleryStore(directorio)
+        assert lector.obtener(7) is None
+
+        dueno.publicar(7, _galeria(50))
+        galeria = lector.obtener(7)
+        assert len(galeria) == 50 and not galeria.matrix.flags.owndata  # Vista sobre el archivo mapeado
+        assert np.array_equal(galeria.matrix, _galeria(50).matrix)
+        assert lector.obtener(7) is galeria  # Misma versión: misma galería adjunta
+
+        # Otro proceso adjunta la misma galería
+        codigo = (
+            "import sys; from gallery_store import SharedGalleryStore; "
+            "g = SharedGalleryStore(sys.argv[1]).obtener(7); print(len(g), g.id_de(0))"
+        )
+        salida = subprocess.run([sys.executable, "-c", codigo, directorio], capture_output=True, text=True, check=True)
+        assert salida.stdout.split() == ["50", "1"]
+
+        dueno.publicar(7, _galeria(40, desplazamiento=0.5))
+        nueva = lector.obtener(7)
+        assert nueva is not galeria and len(nueva) == 40 and np.allclose(nueva.vector(0), _galeria(40, 0.5).vector(0))
+        assert len(galeria) == 50  # La versión anterior sigue legible para quien la tenga
+
+        dueno.publicar(8, FaceGallery.from_rostros([]))
+        assert len(lector.obtener(8)) == 0
+        assert lector.obtener(7, max_edad=-1) is None  # Vencida
+        print(f"✅ Galerías compartidas: {lector.stats()['adjuntadas']} adjuntada(s)")
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def test_verificar_no_reescribe_indice():
+    """Revalidar sin cambios renueva la vigencia sin reemplazar galerias.json."""
+    directorio = tempfile.mkdtemp(prefix="galerias_")
+    try:
+        dueno = SharedGalleryStore(directorio, dueno=True)
+        lector = SharedGalleryStore(directorio)
+        dueno.publicar(7, _galeria(50))
+        assert lector.obtener(7) is not None
+        indice = os.stat(dueno.path_indice)
+        recargas = lector.recargas_indice
+
+        antes = dueno.publicada(7)["verificado"]
+        time.sleep(0.05)
+        assert dueno.verificar(7) and not dueno.verificar(99)
+        assert dueno.publicada(7)["verificado"] > antes
+        assert lector.obtener(7, max_edad=0.04) is not None  # Vigente otra vez
+        assert os.stat(dueno.path_indice).st_mtime_ns == indice.st_mtime_ns
+        assert lector.recargas_indice == recargas
+
+        # Un sello sin matrícula en el índice se borra al reiniciar el dueño
+        open(os.path.join(directorio, "99.verificado"), "w").close()
+        SharedGalleryStore(directorio, dueno=True)
+        assert sorted(f for f in os.listdir(directorio) if f.endswith(".verificado")) == ["7.verificado"]
+        print("✅ Verificación sin reescribir el índice")
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def main():
+    print("🧪 Galerías compartidas")
+    print("=" * 60)
+    test_publicar_y_adjuntar()
+    test_verificar_no_reescribe_indice()
+    print("=" * 60)
+    print("🎯 Pruebas finalizadas")
+
+
+if __name__ == "__main__":
+    main()
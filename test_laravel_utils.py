@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Pruebas del cliente de Laravel: formato binario de las galerías y registro
+de asistencias.
+"""
+
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import requests
+
+from face_utils import FaceGallery
+from laravel_utils import (
+    LaravelClient, SincronizadorRostros, codificar_rostros_binarios, decodificar_rostros_binarios,
+    reportar_asistencias
+)
+from laravel_simulado import LaravelSimulado
+
+
+def test_codificar_y_decodificar_binario():
+    """El formato binario conserva ids, encodings y los campos del encabezado."""
+    rostros = [{"id": i, "encoding": [0.01 * i] * 128} for i in range(1, 6)]
+    cuerpo = codificar_rostros_binarios(rostros, delta=True, eliminados=[9], cursor="42")
+    data = decodificar_rostros_binarios(cuerpo)
+    assert data["ids"] == [1, 2, 3, 4, 5] and data["matriz"].shape == (5, 128)
+    assert data["delta"] is True and data["eliminados"] == [9] and data["cursor"] == "42"
+    assert np.allclose(data["rostros"][2]["encoding"], 0.03)
+
+    solo_bajas = decodificar_rostros_binarios(codificar_rostros_binarios([], delta=True, eliminados=[1]))
+    assert solo_bajas["ids"] == [] and solo_bajas["matriz"].shape == (0, 128) and solo_bajas["eliminados"] == [1]
+
+
+def test_formato_binario():
+    """Con Accept binario la galería se arma sobre la matriz recibida, sin floats de Python."""
+    json_laravel = LaravelSimulado()
+    laravel = LaravelSimulado(binario=True)
+    try:
+        SincronizadorRostros(json_laravel.url, cliente=LaravelClient(pool_size=2)).sincronizar(7)
+        sincronizador = SincronizadorRostros(laravel.url, cliente=LaravelClient(pool_size=2),
+                                             galeria_vacia=lambda: FaceGallery.from_rostros([]))
+        galeria, cambiados, _ = sincronizador.sincronizar(7)
+        assert isinstance(galeria, FaceGallery) and len(cambiados) == 50
+        assert not galeria.matrix.flags.owndata  # Vista sobre el cuerpo de la respuesta
+        esperada = FaceGallery.from_rostros(list(laravel.rostros.values()))
+        assert galeria.lista_ids() == esperada.lista_ids() and np.array_equal(galeria.matrix, esperada.matrix)
+        print(f"✅ Binario: {laravel.bytes_enviados} bytes (JSON: {json_laravel.bytes_enviados} bytes)")
+        assert laravel.bytes_enviados < json_laravel.bytes_enviados * 0.6  # Aun con floats JSON de 4 decimales
+
+        laravel.modificar(3)
+        laravel.agregar(99)
+        laravel.eliminar(10)
+        nuevas, cambiados, eliminados = sincronizador.sincronizar(7, galeria)
+        esperada = FaceGallery.from_rostros(list(laravel.rostros.values()))
+        orden = sorted(range(len(nuevas)), key=nuevas.id_de)
+        assert sorted(r["id"] for r in cambiados) == [3, 99] and eliminados == [10]
+        assert np.array_equal(nuevas.matrix[orden], esperada.matrix[sorted(range(len(esperada)), key=esperada.id_de)])
+
+        laravel.eliminar(11)  # Delta con solo bajas: matriz sin filas
+        nuevas, cambiados, eliminados = sincronizador.sincronizar(7, nuevas)
+        assert cambiados == [] and eliminados == [11] and 11 not in nuevas.lista_ids()
+
+        sin_cliente_binario = LaravelClient(pool_size=2, rostros_binarios=False)
+        rostros, _, _ = SincronizadorRostros(laravel.url, cliente=sin_cliente_binario).sincronizar(7)
+        assert isinstance(rostros[0]["encoding"], list)  # Se puede seguir pidiendo JSON
+    finally:
+        laravel.detener()
+        json_laravel.detener()
+
+
+def test_reportar_asistencias_distingue_rechazos():
+    """Un 4xx es un rechazo definitivo (None); un 5xx o 429 es transitorio (False)."""
+    laravel = LaravelSimulado(rostros=0)
+    cliente = LaravelClient(pool_size=1)
+    try:
+        rostros = [{"id": 1, "dist": 0.4}]
+        assert reportar_asistencias(7, rostros, "2025-07-14T10:30:00", laravel.url, cliente=cliente) is True
+        assert laravel.asistencias[0]["matricula_id"] == 7
+
+        for estado, esperado in ((422, None), (404, None), (429, False), (503, False)):
+            laravel.estado_asistencias = estado
+            resultado = reportar_asistencias(7, rostros, "2025-07-14T10:30:00", laravel.url, cliente=cliente)
+            assert resultado is esperado, (estado, resultado)
+
+        laravel.detener()
+        assert reportar_asistencias(7, rostros, "2025-07-14T10:30:00", laravel.url, cliente=cliente) is False
+        print("✅ Rechazos 4xx distinguidos de errores transitorios")
+    finally:
+        cliente.cerrar()
+
+
+class _LaravelCaido(BaseHTTPRequestHandler):
+    """Laravel sobrecargado: tarda en contestar y siempre responde 503."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(0.3)
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def test_plazo_y_pool_del_cliente():
+    """Los reintentos de un GET no pasan del plazo y agrandar el pool cierra el adaptador anterior."""
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _LaravelCaido)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    cliente = LaravelClient(pool_size=1, reintentos=20, backoff_base=0.2, backoff_max=0.5, plazo=1.5)
+    try:
+        url = f"http://127.0.0.1:{servidor.server_port}/api/camaras/activas"
+        inicio = time.monotonic()
+        assert cliente.get(url).status_code == 503
+        assert time.monotonic() - inicio < 2.5
+        assert 1 < cliente.stats()["peticiones"] < 21
+
+        anterior = cliente.session.get_adapter("http://")
+        assert anterior.poolmanager.pools
+        cliente.ajustar_pool(4)
+        assert cliente.session.get_adapter("http://") is not anterior
+        assert not anterior.poolmanager.pools  # Conexiones del adaptador viejo cerradas
+
+        # Un servidor que no contesta a tiempo agota el plazo con la excepción original
+        lento = LaravelClient(pool_size=1, timeout=(1, 0.2), reintentos=20, backoff_base=0.1, plazo=1.0)
+        inicio = time.monotonic()
+        try:
+            lento.get(url)
+            assert False, "se esperaba un timeout"
+        except requests.exceptions.Timeout:
+            pass
+        assert time.monotonic() - inicio < 2.0
+        print(f"✅ GET acotado por el plazo: {cliente.stats()['peticiones']} intento(s)")
+    finally:
+        cliente.cerrar()
+        servidor.shutdown()
+        servidor.server_close()
+
+
+def main():
+    print("🧪 Cliente de Laravel")
+    print("=" * 60)
+    test_codificar_y_decodificar_binario()
+    test_formato_binario()
+    test_reportar_asistencias_distingue_rechazos()
+    test_plazo_y_pool_del_cliente()
+    print("=" * 60)
+    print("🎯 Pruebas finalizadas")
+
+
+if __name__ == "__main__":
+    main()
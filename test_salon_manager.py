@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Pruebas de SalonManager contra un Laravel simulado local: galerías por
+matrícula, pool de encodings, galerías compartidas entre procesos,
+sincronización de salones y opciones de captura de SalonData.
+"""
+
+import gc
+import json
+import shutil
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from face_utils import obtener_pool
+from gallery_store import SharedGalleryStore
+from laravel_utils import LaravelClient
+from laravel_simulado import LaravelSimulado
+from salon_manager import SalonData, SalonManager, INTERVALO_CAPTURA_DEFECTO
+
+
+def test_pool_compartido_entre_matriculas():
+    """Un estudiante en varias matrículas ocupa una sola fila del pool de encodings."""
+    laravel = LaravelSimulado()  # Sirve los mismos 50 rostros para cualquier matrícula
+    pool = obtener_pool()
+    try:
+        manager = SalonManager(laravel.url, 0.6, supervisar=False, cliente=LaravelClient(pool_size=2))
+        inicial = pool.stats()
+        galerias = [manager.obtener_rostros(m) for m in (7, 8, 9)]
+        stats = pool.stats()
+        assert stats["rostros_distintos"] - inicial["rostros_distintos"] == 50
+        assert stats["referencias"] - inicial["referencias"] == 150
+        assert all(g.nbytes < 20 * len(g) for g in galerias)  # Solo ids y filas del pool
+
+        laravel.modificar(3)
+        actualizada = manager.obtener_rostros(7, refrescar=True)
+        assert np.allclose(actualizada.vector(actualizada.posiciones()[3]), laravel.rostros[3]["encoding"])
+        # La matrícula 8 aún no se refrescó: sigue viendo el encoding anterior
+        assert not np.allclose(galerias[1].vector(galerias[1].posiciones()[3]), laravel.rostros[3]["encoding"])
+        print(f"✅ Pool compartido: 3 matrículas × 50 rostros en {stats['rostros_distintos']} fila(s) "
+              f"({stats['bytes_sin_compartir']} bytes sin compartir)")
+
+        del galerias, actualizada
+        manager.galerias.clear()
+        gc.collect()
+        assert pool.stats()["referencias"] == inicial["referencias"]
+    finally:
+        laravel.detener()
+
+
+class _Dueno:
+    """Expone POST /sistema/galerias/<matricula> de un SalonManager dueño, como main.py."""
+
+    def __init__(self, manager):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                matricula_id = url.path.rsplit("/", 1)[-1]
+                refrescar = parse_qs(url.query).get("refrescar") == ["1"]
+                cuerpo = json.dumps({"publicada": manager.publicar_galeria(matricula_id, refrescar=refrescar)}).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.servidor.server_port}"
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+
+    def detener(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+
+def test_galerias_compartidas_entre_procesos():
+    """Un dueño publica las galerías; los lectores las mapean sin consultar a Laravel."""
+    laravel = LaravelSimulado()
+    directorio = tempfile.mkdtemp(prefix="galerias_")
+    dueno = SalonManager(laravel.url, 0.6, supervisar=False, cliente=LaravelClient(pool_size=2),
+                         compartidas=SharedGalleryStore(directorio, dueno=True))
+    servidor = _Dueno(dueno)
+    try:
+        lector = SalonManager(laravel.url, 0.6, supervisar=False, cliente=LaravelClient(pool_size=2),
+                              compartidas=SharedGalleryStore(directorio), dueno_url=servidor.url)
+        galeria = lector.obtener_rostros(7)
+        assert len(galeria) == 50 and not galeria.matrix.flags.owndata
+        assert lector.obtener_rostros(7) is galeria
+        peticiones = laravel.peticiones
+
+        laravel.modificar(3)
+        dueno.obtener_rostros(7, refrescar=True)
+        nueva = lector.obtener_rostros(7)
+        assert nueva is not galeria and np.allclose(nueva.vector(nueva.posiciones()[3]), laravel.rostros[3]["encoding"])
+        assert laravel.peticiones == peticiones + 1  # Solo el refresco del dueño
+        print(f"✅ Galerías compartidas: {lector.compartidas.stats()['adjuntadas']} adjuntada(s), "
+              f"{laravel.peticiones} consulta(s) a Laravel")
+    finally:
+        servidor.detener()
+        laravel.detener()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def test_galeria_compartida_no_mapeable_se_descarga():
+    """Si el dueño publicó pero el mapeo falla, el lector descarga en vez de quedar vacío."""
+    laravel = LaravelSimulado()
+    directorio = tempfile.mkdtemp(prefix="galerias_")
+    dueno = SalonManager(laravel.url, 0.6, supervisar=False, cliente=LaravelClient(pool_size=2),
+                         compartidas=SharedGalleryStore(directorio, dueno=True))
+    servidor = _Dueno(dueno)
+    try:
+        lector = SalonManager(laravel.url, 0.6, supervisar=False, cliente=LaravelClient(pool_size=2),
+                              compartidas=SharedGalleryStore(directorio), dueno_url=servidor.url)
+        intentos = []
+
+        def _sin_mapear(matricula_id, max_edad=None):
+            intentos.append(matricula_id)
+            return None
+
+        lector.compartidas.obtener = _sin_mapear
+        peticiones = laravel.peticiones
+        galeria = lector.obtener_rostros(7)
+        assert len(galeria) == 50 and galeria.matrix.flags.owndata
+        assert len(intentos) == 3  # Vigente, y dos intentos después de la respuesta del dueño
+        assert laravel.peticiones == peticiones + 2  # El dueño y la descarga local
+
+        # Una galería que el dueño confirma vacía no se descarga de nuevo
+        laravel.rostros = {}
+        peticiones = laravel.peticiones
+        assert len(lector.obtener_rostros(8)) == 0
+        assert laravel.peticiones == peticiones + 1
+        print("✅ Galería compartida no mapeable descargada localmente")
+    finally:
+        servidor.detener()
+        laravel.detener()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def test_sincronizacion_cuenta_galerias_cargadas():
+    """Las galerías que terminan antes de la espera cuentan como cargadas."""
+    laravel = LaravelSimulado(rostros=5)
+    laravel.camaras = [
+        {"matricula_id": m, "url_stream": "http://127.0.0.1:9/stream", "matricula": {"codigo_matricula": f"M{m}"}}
+        for m in (21, 22, 23)
+    ]
+    manager = SalonManager(laravel.url, 0.6, supervisar=False, cliente=LaravelClient(pool_size=2))
+    cargar_galeria = manager._cargar_galeria
+
+    def _cargar_y_esperar(salon_data):
+        # Cada galería termina antes de registrar el siguiente salón
+        carga = cargar_galeria(salon_data)
+        carga.result()
+        return carga
+
+    manager._cargar_galeria = _cargar_y_esperar
+    try:
+        resultado = manager.sincronizar_con_laravel()
+        assert resultado["exito"] and sorted(resultado["nuevos"]) == ["21", "22", "23"]
+        assert resultado["galerias_cargadas"] == 3 and resultado["galerias_pendientes"] == 0
+        assert all(len(salon.galeria) == 5 for salon in manager.salones.values())
+        print(f"✅ Sincronización: {resultado['galerias_cargadas']} galería(s) cargada(s)")
+    finally:
+        for matricula_id in list(manager.salones):
+            manager.desregistrar_salon(matricula_id)
+        laravel.detener()
+
+
+def test_sincronizaciones_simultaneas_no_duplican_salones():
+    """Dos sincronizaciones a la vez crean un solo SalonData por matrícula."""
+    laravel = LaravelSimulado(rostros=5)
+    laravel.camaras = [
+        {"matricula_id": m, "url_stream": "http://127.0.0.1:9/stream", "matricula": {"codigo_matricula": f"M{m}"}}
+        for m in (31, 32)
+    ]
+    manager = SalonManager(laravel.url, 0.6, supervisar=False, cliente=LaravelClient(pool_size=2))
+    crear_salon = manager._crear_salon
+    creados = []
+
+    def _crear_lento(*args, **kwargs):
+        time.sleep(0.2)  # Ensancha la ventana entre verificar e insertar
+        salon = crear_salon(*args, **kwargs)
+        creados.append(salon)
+        return salon
+
+    manager._crear_salon = _crear_lento
+    try:
+        hilos = [threading.Thread(target=manager.sincronizar_con_laravel) for _ in range(2)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        assert sorted(manager.salones) == ["31", "32"] and len(creados) == 2
+        print(f"✅ Sincronizaciones simultáneas: {len(creados)} salón(es) creados")
+    finally:
+        for salon in creados:
+            salon.detener_monitoreo()
+        laravel.detener()
+
+
+def test_cambio_de_stream_y_baja_concurrentes():
+    """Cambiar el stream reemplaza el tracker; dar de baja dos veces no falla."""
+    laravel = LaravelSimulado(rostros=5)
+    manager = SalonManager(laravel.url, 0.6, supervisar=False, cliente=LaravelClient(pool_size=2))
+    try:
+        assert manager.registrar_salon("41", "http://127.0.0.1:9/stream")
+        salon = manager.salones["41"]
+        salon.procesar_deteccion(1, time.monotonic(), [(100, 200, 200, 100)])
+        anterior = salon.tracker
+        assert len(anterior.tracks) == 1
+
+        assert salon.cambiar_stream("http://127.0.0.1:9/otro")
+        # Quien todavía recorra el tracker anterior no lo ve cambiar
+        assert salon.tracker is not anterior and len(salon.tracker.tracks) == 0
+        assert len(anterior.tracks) == 1
+
+        resultados = []
+        hilos = [threading.Thread(target=lambda: resultados.append(manager.desregistrar_salon("41")))
+                 for _ in range(2)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        assert sorted(resultados) == [False, True] and not manager.salones
+        print("✅ Cambio de stream y baja concurrente")
+    finally:
+        for matricula_id in list(manager.salones):
+            manager.desregistrar_salon(matricula_id)
+        laravel.detener()
+
+
+def test_intervalo_de_captura_invalido_usa_el_de_defecto():
+    """Un intervalo_captura ilegible desde Laravel no interrumpe la configuración del salón."""
+    salon = SalonData(1, "http://camara.local:81/stream", "http://laravel.local", 0.6,
+                      intervalo_deteccion=2.0, cargar_al_iniciar=False,
+                      opciones={"modo_captura": "snapshot", "intervalo_captura": "cada 5s"})
+    salon.detener_monitoreo()
+    assert salon.modo_captura == "snapshot" and salon.intervalo_captura == INTERVALO_CAPTURA_DEFECTO
+
+    assert salon.cambiar_captura({"modo_captura": "snapshot", "intervalo_captura": 5})
+    for invalido in ("inf", "nan", [5]):
+        assert salon.cambiar_captura({"modo_captura": "snapshot", "intervalo_captura": invalido})
+        assert salon.intervalo_captura == INTERVALO_CAPTURA_DEFECTO
+        salon.cambiar_captura({"modo_captura": "snapshot", "intervalo_captura": 5})
+    assert salon.intervalo_captura == 5.0
+    print("✅ Intervalo de captura inválido reemplazado por el de defecto")
+
+
+def main():
+    print("🧪 SalonManager contra Laravel simulado")
+    print("=" * 60)
+    test_pool_compartido_entre_matriculas()
+    test_galerias_compartidas_entre_procesos()
+    test_galeria_compartida_no_mapeable_se_descarga()
+    test_sincronizacion_cuenta_galerias_cargadas()
+    test_sincronizaciones_simultaneas_no_duplican_salones()
+    test_cambio_de_stream_y_baja_concurrentes()
+    test_intervalo_de_captura_invalido_usa_el_de_defecto()
+    print("=" * 60)
+    print("🎯 Pruebas finalizadas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la compuerta de movimiento (MotionGate) y de la captura por
+sondeo de fotos (SnapshotGrabber).
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+from stream_utils import MotionGate, SnapshotGrabber
+
+
+def _frame(valor=0, alto=240, ancho=320):
+    return np.full((alto, ancho, 3), valor, dtype=np.uint8)
+
+
+def test_escena_estatica_se_omite():
+    """El primer frame pasa; los idénticos siguientes se omiten."""
+    gate = MotionGate(refresco_max=3600)
+    assert gate.hay_cambio(_frame())
+    for _ in range(5):
+        assert not gate.hay_cambio(_frame())
+
+    estado = gate.obtener_estado()
+    assert estado["frames_con_movimiento"] == 1
+    assert estado["frames_omitidos_sin_movimiento"] == 5
+    assert estado["ultimo_cambio"] == 0.0
+    print("✅ Escena estática omitida")
+
+
+def test_movimiento_pasa_y_renueva_referencia():
+    """Un cambio grande pasa y se convierte en la nueva referencia."""
+    gate = MotionGate(refresco_max=3600)
+    gate.hay_cambio(_frame())
+
+    movido = _frame()
+    movido[60:180, 80:240] = 255  # Un cuarto del cuadro cambia
+    assert gate.hay_cambio(movido)
+    assert gate.ultimo_cambio > 0.1
+    # El mismo frame otra vez ya no es cambio: la referencia se actualizó
+    assert not gate.hay_cambio(movido.copy())
+
+    # Cambios por debajo de umbral_pixel (ruido del sensor) no cuentan
+    ruido = movido.copy()
+    ruido[:, :, :] = np.clip(ruido.astype(int) + 10, 0, 255).astype(np.uint8)
+    assert not gate.hay_cambio(ruido)
+    print("✅ Movimiento detectado")
+
+
+def test_cambio_pequeno_bajo_umbral_area():
+    """Un cambio que cubre menos que umbral_area se considera estático."""
+    gate = MotionGate(umbral_area=0.05, refresco_max=3600)
+    gate.hay_cambio(_frame())
+
+    mancha = _frame()
+    mancha[100:110, 100:110] = 255  # ~0.1 % del cuadro
+    assert not gate.hay_cambio(mancha)
+
+    grande = _frame()
+    grande[:, :160] = 255
+    assert gate.hay_cambio(grande)
+    print("✅ Umbral de área respetado")
+
+
+def test_refresco_maximo_y_cambio_de_resolucion():
+    """Pasado refresco_max se analiza aunque nada cambie; otra proporción siempre pasa."""
+    gate = MotionGate(refresco_max=0.05)
+    gate.hay_cambio(_frame())
+    assert not gate.hay_cambio(_frame())
+    time.sleep(0.06)
+    assert gate.hay_cambio(_frame())
+
+    gate = MotionGate(refresco_max=3600)
+    gate.hay_cambio(_frame())
+    assert gate.hay_cambio(_frame(alto=720, ancho=1280))
+
+    # Frames en escala de grises también se aceptan
+    gate = MotionGate(refresco_max=3600)
+    assert gate.hay_cambio(np.zeros((240, 320), dtype=np.uint8))
+    assert not gate.hay_cambio(np.zeros((240, 320), dtype=np.uint8))
+    print("✅ Refresco máximo y cambio de resolución")
+
+
+class _Respuesta:
+    def __init__(self, contenido):
+        self.content = contenido
+
+    def raise_for_status(self):
+        pass
+
+
+class _CamaraFalla:
+    """Sesión falsa: responde vacío, basura y un error inesperado antes de una foto válida."""
+
+    def __init__(self):
+        self.pedidos = 0
+        self.jpeg = cv2.imencode(".jpg", _frame(128))[1].tobytes()
+
+    def get(self, url, timeout=None):
+        self.pedidos += 1
+        if self.pedidos == 1:
+            return _Respuesta(b"")
+        if self.pedidos == 2:
+            return _Respuesta(self.jpeg[:20])  # JPEG truncado
+        if self.pedidos == 3:
+            raise RuntimeError("fallo inesperado")
+        return _Respuesta(self.jpeg)
+
+
+def test_snapshot_sobrevive_respuestas_invalidas():
+    """Una respuesta vacía, truncada o un error inesperado no terminan el sondeo."""
+    sesion = _CamaraFalla()
+    grabber = SnapshotGrabber("http://camara.local/capture", intervalo=0.01, espera_reconexion=0.01, sesion=sesion)
+    grabber.iniciar()
+    try:
+        resultado = grabber.obtener_frame(timeout=5.0)
+        assert resultado is not None and resultado[1].shape == (240, 320, 3)
+        assert grabber.errores_captura == 3 and grabber.conectado
+        print(f"✅ Sondeo recuperado tras {grabber.errores_captura} respuesta(s) inválida(s)")
+    finally:
+        grabber.detener(timeout=1.0)
+
+
+def main():
+    print("🧪 Pruebas de la compuerta de movimiento")
+    print("=" * 60)
+    test_escena_estatica_se_omite()
+    test_movimiento_pasa_y_renueva_referencia()
+    test_cambio_pequeno_bajo_umbral_area()
+    test_refresco_maximo_y_cambio_de_resolucion()
+    test_snapshot_sobrevive_respuestas_invalidas()
+    print("=" * 60)
+    print("🎯 Pruebas finalizadas")
+
+
+if __name__ == "__main__":
+    main()
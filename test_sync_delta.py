@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Prueba del refresco incremental de rostros contra un Laravel simulado local.
+
+Levanta un servidor HTTP que imita /api/biometricos/matricula/{id} con
+soporte de ETag/If-None-Match y updated_since, y muestra que las
+re-sincronizaciones sin cambios no transfieren rostros.
+"""
+
+import hashlib
+import json
+
+from face_utils import FaceGallery
+from laravel_utils import LaravelClient, SincronizadorRostros
+from laravel_simulado import LaravelSimulado
+from salon_manager import crear_cache_galerias
+
+
+def _huella(rostros):
+    return hashlib.sha1(json.dumps(sorted(rostros, key=lambda r: r["id"])).encode()).hexdigest()
+
+
+def test_resincronizacion_sin_cambios():
+    """Con ETag una re-sincronización sin cambios responde 304 y reutiliza la lista."""
+    laravel = LaravelSimulado()
+    try:
+        sincronizador = SincronizadorRostros(laravel.url, cliente=LaravelClient(pool_size=2))
+        rostros, cambiados, eliminados = sincronizador.sincronizar(7)
+        completa = laravel.bytes_enviados
+        assert len(rostros) == 50 and len(cambiados) == 50 and eliminados == []
+
+        for _ in range(10):
+            nuevos, cambiados, eliminados = sincronizador.sincronizar(7, rostros)
+            assert nuevos is rostros and cambiados == [] and eliminados == []
+
+        print(f"✅ Descarga completa: {completa} bytes; 10 re-sincronizaciones: "
+              f"{laravel.bytes_enviados - completa} bytes")
+        assert laravel.bytes_enviados == completa
+        assert sincronizador.stats()["sin_cambios"] == 10
+    finally:
+        laravel.detener()
+
+
+def test_delta_aplica_altas_bajas_y_cambios():
+    """Con updated_since solo viajan los rostros modificados y los ids eliminados."""
+    laravel = LaravelSimulado()
+    try:
+        sincronizador = SincronizadorRostros(laravel.url, cliente=LaravelClient(pool_size=2))
+        rostros, _, _ = sincronizador.sincronizar(7)
+        completa = laravel.bytes_enviados
+
+        laravel.modificar(3)
+        laravel.agregar(99)
+        laravel.eliminar(10)
+        rostros, cambiados, eliminados = sincronizador.sincronizar(7, rostros)
+        delta = laravel.bytes_enviados - completa
+
+        print(f"✅ Delta: {delta} bytes (completa: {completa} bytes)")
+        assert sorted(r["id"] for r in cambiados) == [3, 99]
+        assert eliminados == [10]
+        assert _huella(rostros) == _huella(list(laravel.rostros.values()))
+        assert delta < completa / 10
+        assert sincronizador.stats()["deltas"] == 1
+    finally:
+        laravel.detener()
+
+
+def test_servidor_sin_etag_no_reparsea():
+    """Sin ETag ni cursor, un cuerpo idéntico se detecta por hash y no se reprocesa."""
+    laravel = LaravelSimulado(etag=False, cursor=False)
+    try:
+        sincronizador = SincronizadorRostros(laravel.url, cliente=LaravelClient(pool_size=2))
+        rostros, _, _ = sincronizador.sincronizar(7)
+        nuevos, cambiados, eliminados = sincronizador.sincronizar(7, rostros)
+        assert nuevos is rostros and cambiados == [] and eliminados == []
+
+        laravel.eliminar(1)
+        nuevos, cambiados, eliminados = sincronizador.sincronizar(7, rostros)
+        assert len(nuevos) == 49 and cambiados == [] and eliminados == [1]
+        print("✅ Sin ETag: cuerpo repetido detectado por hash; baja aplicada con descarga completa")
+    finally:
+        laravel.detener()
+
+
+def test_bajas_hasta_vaciar_no_reviven():
+    """Si un delta deja la galería vacía, la galería anterior no vuelve desde el cache."""
+    laravel = LaravelSimulado(rostros=3)
+    try:
+        galerias = crear_cache_galerias()
+        sincronizador = SincronizadorRostros(
+            laravel.url, cliente=LaravelClient(pool_size=2), galeria_vacia=lambda: FaceGallery.from_rostros([])
+        )
+        cargar = lambda anterior: sincronizador.sincronizar(7, anterior)[0]
+        assert len(galerias.get("7", cargar)) == 3
+
+        for rostro_id in (1, 2, 3):
+            laravel.eliminar(rostro_id)
+        assert len(galerias.get("7", cargar, refrescar=True)) == 0
+        # La galería vacía no se cachea, pero tampoco sigue vigente la anterior
+        assert len(galerias.get("7", cargar)) == 0
+        assert len(galerias.get("7", cargar, refrescar=True)) == 0
+
+        laravel.agregar(4)
+        assert galerias.get("7", cargar).ids == [4]
+        print("✅ Las bajas que vacían la galería no reviven")
+    finally:
+        laravel.detener()
+
+
+def main():
+    print("🧪 Refresco incremental de rostros contra Laravel simulado")
+    print("=" * 60)
+    test_resincronizacion_sin_cambios()
+    test_delta_aplica_altas_bajas_y_cambios()
+    test_servidor_sin_etag_no_reparsea()
+    test_bajas_hasta_vaciar_no_reviven()
+    print("=" * 60)
+    print("🎯 Pruebas finalizadas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Pruebas del planificador de tareas periódicas (TaskScheduler).
+"""
+
+import threading
+import time
+
+from task_scheduler import TaskScheduler
+
+
+def _esperar(condicion, timeout=5.0):
+    limite = time.monotonic() + timeout
+    while not condicion():
+        if time.monotonic() > limite:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_tareas_periodicas_y_cancelacion():
+    """Las tareas se repiten según su intervalo y una cancelada no vuelve a correr."""
+    planificador = TaskScheduler(workers=2)
+    planificador.iniciar()
+    try:
+        rapidas, lentas = [], []
+        rapida = planificador.programar(lambda: rapidas.append(time.monotonic()), 0.05, jitter=0, retraso_inicial=0)
+        planificador.programar(lambda: lentas.append(time.monotonic()), 10, jitter=0)
+        assert _esperar(lambda: len(rapidas) >= 5)
+        assert lentas == []
+
+        planificador.cancelar(rapida)
+        time.sleep(0.1)  # Una ejecución en curso puede terminar
+        cantidad = len(rapidas)
+        time.sleep(0.2)
+        assert len(rapidas) == cantidad
+
+        estado = planificador.obtener_estado()
+        assert estado["tareas"] == 1 and estado["errores"] == 0
+        assert 9 < estado["proxima_en_s"] <= 10
+        print(f"✅ Tareas periódicas: {cantidad} ejecución(es) antes de cancelar")
+    finally:
+        planificador.detener()
+
+
+def test_tarea_lenta_no_se_solapa_ni_atrasa_a_otras():
+    """Una tarea lenta no corre dos veces a la vez ni bloquea a las demás."""
+    planificador = TaskScheduler(workers=2)
+    planificador.iniciar()
+    activas, maximo, rapidas = [0], [0], []
+    lock = threading.Lock()
+
+    def _lenta():
+        with lock:
+            activas[0] += 1
+            maximo[0] = max(maximo[0], activas[0])
+        time.sleep(0.3)
+        with lock:
+            activas[0] -= 1
+
+    try:
+        planificador.programar(_lenta, 0.01, jitter=0, retraso_inicial=0)
+        planificador.programar(lambda: rapidas.append(1), 0.02, jitter=0, retraso_inicial=0)
+        time.sleep(0.7)
+        assert maximo[0] == 1
+        assert len(rapidas) >= 10
+        print(f"✅ Tarea lenta sin solaparse; {len(rapidas)} ejecución(es) de la rápida mientras tanto")
+    finally:
+        planificador.detener()
+
+
+def test_tareas_bloqueadas_no_atrasan_a_otras():
+    """Dos tareas bloqueadas (p.ej. esperando a Laravel) no frenan a una tercera."""
+    planificador = TaskScheduler()
+    planificador.iniciar()
+    liberar = threading.Event()
+    rapidas = []
+    try:
+        planificador.programar(liberar.wait, 0.01, jitter=0, retraso_inicial=0, nombre="sincronizacion")
+        planificador.programar(liberar.wait, 0.01, jitter=0, retraso_inicial=0, nombre="refresco")
+        time.sleep(0.05)
+        tarea = planificador.programar(lambda: rapidas.append(1), 0.02, jitter=0, retraso_inicial=0)
+        assert _esperar(lambda: len(rapidas) >= 5, timeout=1.0)
+        assert tarea.ultimo_atraso_ms < 100
+        assert planificador.obtener_estado()["en_curso"] >= 2
+        print(f"✅ Con 2 tareas bloqueadas la tercera corrió {len(rapidas)} vez/veces")
+    finally:
+        liberar.set()
+        planificador.detener()
+
+
+def test_errores_e_intervalo_calculado():
+    """Una excepción se cuenta y la tarea sigue programada; el intervalo puede ser una función."""
+    planificador = TaskScheduler(workers=1)
+    planificador.iniciar()
+    intervalos = []
+
+    def _intervalo():
+        intervalos.append(1)
+        return 0.02
+
+    def _falla():
+        raise RuntimeError("Laravel no responde")
+
+    try:
+        tarea = planificador.programar(_falla, _intervalo, jitter=0, retraso_inicial=0)
+        assert _esperar(lambda: tarea.errores >= 3)
+        assert len(intervalos) >= 3
+        assert planificador.obtener_estado()["errores"] >= 3
+        print(f"✅ Errores contados: {tarea.errores}")
+    finally:
+        planificador.detener()
+
+
+def main():
+    print("🧪 Planificador de tareas")
+    print("=" * 60)
+    test_tareas_periodicas_y_cancelacion()
+    test_tarea_lenta_no_se_solapa_ni_atrasa_a_otras()
+    test_tareas_bloqueadas_no_atrasan_a_otras()
+    test_errores_e_intervalo_calculado()
+    print("=" * 60)
+    print("🎯 Pruebas finalizadas")
+
+
+if __name__ == "__main__":
+    main()